@@ -37,6 +37,9 @@ GOOGLE_SERVICE_ACCOUNT_JSON = os.getenv(
     str(BASE_DIR / "tonal-concord-464913-u3-2024741e839c.json")
 )
 
+# Seconds a sheet read is reused before it is fetched again (0 disables caching)
+SHEETS_CACHE_TTL = float(os.getenv("SHEETS_CACHE_TTL", "60"))
+
 # Sheet names
 SHEET_WB = "WB"  # Sheet with cities, warehouses, and API keys
 SHEET_ACCESS = "Access"  # Sheet with warehouse access permissions
@@ -49,8 +52,14 @@ SHEET_TASKS_FOR_PDF = "TasksForPDF"  # Sheet for PDF generation with columns: И
 WB_MARKETPLACE_API_BASE = "https://marketplace-api.wildberries.ru"
 WB_CONTENT_API_BASE = "https://content-api.wildberries.ru"
 
+# Supplies listed per warehouse in the bots (first ones returned by WB)
+SUPPLY_LIST_LIMIT = 50
+
 # Polling interval (in seconds)
 POLLING_INTERVAL = 300  # 5 minutes
+# Poll WB for new orders in the background (off: orders are fetched from
+# supplies when a warehouse is selected in Telegram)
+ENABLE_PERIODIC_POLLING = os.getenv("ENABLE_PERIODIC_POLLING", "false").strip().lower() in ("1", "true", "yes")
 
 # API Rate Limiting
 WB_API_RETRY_ATTEMPTS = 3
@@ -70,3 +79,8 @@ PRODUCT_IMAGE_CACHE_DIR = (
 )
 PRODUCT_IMAGE_HTTP_TIMEOUT = int(os.getenv("PRODUCT_IMAGE_HTTP_TIMEOUT", "90"))
 PRODUCT_IMAGE_HTTP_RETRIES = int(os.getenv("PRODUCT_IMAGE_HTTP_RETRIES", "3"))
+
+# Local SQLite cache of processed order IDs (see order_tracker.py)
+ORDER_TRACKER_DB = os.getenv(
+    "ORDER_TRACKER_DB", str(BASE_DIR / "data" / "tracker.db")
+)
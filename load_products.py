@@ -3,8 +3,10 @@ Script to load all products into Products sheet
 Run this separately to populate the Products sheet with vendorCode and photo URLs
 """
 import logging
-from config import LOG_LEVEL, LOG_FILE
-from sheets_handler import SheetsHandler
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from config import LOG_LEVEL, LOG_FILE, SHEET_PRODUCTS, WB_CONTENT_API_BASE
+from sheets_handler import SheetsHandler, call_with_backoff
 from wb_api import WildberriesAPI
 
 # Configure logging
@@ -30,192 +32,179 @@ def load_all_products(api_key: str):
     sheets_handler = SheetsHandler()
     wb_api = WildberriesAPI(api_key)
     
-    # Use content API base from config
-    from config import WB_CONTENT_API_BASE
     url = f"{WB_CONTENT_API_BASE}/content/v2/get/cards/list"
     
     logger.info("Starting to load products into Products sheet...")
     
-    products_sheet = sheets_handler.spreadsheet.worksheet("Products")
+    products_sheet = sheets_handler.get_worksheet(SHEET_PRODUCTS)
     
     # Get existing products to avoid duplicates
     existing_products = set()
-    current_row_in_sheet = 1  # Start from row 1 (header)
     
     try:
-        # Google Sheets имеет квоту на чтения. Для больших листов важно сделать
-        # минимум запросов. Читаем колонку A одним вызовом (без батч-циклов).
-        vendor_codes = products_sheet.get("A2:A")
-        for row in vendor_codes or []:
-            if row and row[0]:
-                existing_products.add(str(row[0]).strip().lower())
-
-        # Текущая последняя строка (header + заполненные vendorCode)
-        current_row_in_sheet = 1 + len(vendor_codes or [])
+        # Sheets reads are quota-limited, so keep requests to a minimum on large
+        # sheets: read column A with one batchGet (majorDimension=COLUMNS) to get
+        # the whole column as a single list instead of one wrapper per row.
+        vals = sheets_handler.spreadsheet.values_batch_get(
+            ranges=[f"{SHEET_PRODUCTS}!A2:A"],
+            params={"majorDimension": "COLUMNS"},
+        )
+        col = (vals.get("valueRanges", [{}])[0].get("values") or [[]])[0]
+        existing_products = {str(v).strip().lower() for v in col if v}
+        last_row = 1 + len(col)
+        # Release the raw response: for 100k+ products it is as large as the set
+        # itself and is not needed for the rest of the (long) load
+        del vals, col
         
-        logger.info(f"Found {len(existing_products)} existing products in sheet (last row: {current_row_in_sheet})")
+        logger.info(f"Found {len(existing_products)} existing products in sheet (last row: {last_row})")
     except Exception as e:
         logger.warning(f"Could not read existing products: {e}")
     
-    current_cursor = None
+    # Request payload is built once; only the cursor changes between pages.
+    # Safe to mutate: at most one page fetch is in flight at a time.
+    payload = {"settings": {"cursor": {"limit": 100}, "filter": {"withPhoto": -1}}}
+    
+    def fetch_page(cursor_from_response):
+        """Request one page of product cards (runs in the worker pool)"""
+        # Always set limit to 100, update cursor with limit
+        payload["settings"]["cursor"] = {**(cursor_from_response or {}), "limit": 100}
+        return wb_api._make_request(wb_api.content_session, "POST", url, data=payload)
+    
+    def write_batch(batch):
+        """Append a batch of products to the sheet (runs in the worker pool)"""
+        # append_rows lets Sheets pick the next row and grow the grid,
+        # so no row_count read / add_rows / range computation is needed.
+        # 429s are retried with backoff so a throttled batch is not dropped
+        call_with_backoff(
+            products_sheet.append_rows,
+            batch,
+            value_input_option='USER_ENTERED',
+            table_range='A1',
+        )
+        return len(batch)
+    
     pages_fetched = 0
     total_products_written = 0
     products_to_add = []  # Collect products here (batch of 1000)
     max_pages = 1000  # Increased for 10k+ products
     
-    while pages_fetched < max_pages:
-        # Always set limit to 100, update cursor with limit
-        if current_cursor:
-            cursor = current_cursor.copy()
-            cursor["limit"] = 100
-        else:
-            cursor = {"limit": 100}
-        
-        settings = {
-            "cursor": cursor,
-            "filter": {"withPhoto": -1},
-        }
-        
-        data = {"settings": settings}
-        
+    # WB pagination and Sheets writes are both network-bound and independent:
+    # prefetch page N+1 while page N is processed and the previous batch is
+    # being appended. At most one fetch and one write are in flight.
+    pending_write = None  # (future, batch)
+    
+    def wait_pending_write():
+        """Wait for the in-flight write; on failure keep its rows for the next batch"""
+        nonlocal pending_write, products_to_add, total_products_written
+        if not pending_write:
+            return
+        future, batch = pending_write
+        pending_write = None
+        try:
+            total_products_written += future.result()
+            logger.info(
+                f"✅ Batch write: Added {len(batch)} products to sheet "
+                f"(total written: {total_products_written})"
+            )
+        except Exception as e:
+            logger.error(f"Error writing products to sheet: {e}")
+            logger.error(traceback.format_exc())
+            products_to_add = batch + products_to_add
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
         logger.info(f"Fetching product cards page {pages_fetched + 1} (limit: 100)...")
+        fetch_future = pool.submit(fetch_page, None)
         
-        response = wb_api._make_request(wb_api.content_session, "POST", url, data=data)
-        
-        if not response:
-            logger.error(f"Failed to fetch product cards at page {pages_fetched + 1}")
-            break
-        
-        try:
-            response_data = response.json()
-            cards = response_data.get("cards", [])
-            next_cursor = response_data.get("cursor")
-            
-            logger.debug(f"Received {len(cards)} cards, cursor: {next_cursor}")
+        while fetch_future is not None and pages_fetched < max_pages:
+            response = fetch_future.result()
+            fetch_future = None
             
-            if not cards:
-                logger.info("No more cards to fetch")
+            if not response:
+                logger.error(f"Failed to fetch product cards at page {pages_fetched + 1}")
                 break
             
-            # Process cards and collect products (batch 1000 before writing)
-            page_new_count = 0
-            for card in cards:
-                vendor_code = str(card.get("vendorCode", "")).strip()
-                if not vendor_code:
-                    continue
+            try:
+                response_data = response.json()
+                cards = response_data.get("cards", [])
+                next_cursor = response_data.get("cursor")
                 
-                vendor_code_lower = vendor_code.lower()
+                logger.debug(f"Received {len(cards)} cards, cursor: {next_cursor}")
                 
-                # Skip if already exists
-                if vendor_code_lower in existing_products:
-                    continue
+                if not cards:
+                    logger.info("No more cards to fetch")
+                    break
                 
-                # Get photo URL (big image)
-                photos = card.get("photos", [])
-                photo_url = ""
-                if photos and len(photos) > 0:
-                    photo_url = photos[0].get("big", "")
+                # Start fetching the next page before processing this one
+                if next_cursor and pages_fetched + 1 < max_pages:
+                    logger.info(f"Fetching product cards page {pages_fetched + 2} (limit: 100)...")
+                    fetch_future = pool.submit(fetch_page, next_cursor)
                 
-                # Get product title
-                title = str(card.get("title", "")).strip()
-                
-                # Add: vendorCode, photo URL, title (columns A, B, C)
-                products_to_add.append([vendor_code, photo_url, title])
-                existing_products.add(vendor_code_lower)
-                page_new_count += 1
-            
-            logger.info(
-                f"Page {pages_fetched + 1}: Processed {len(cards)} cards, "
-                f"found {page_new_count} new products "
-                f"(collected {len(products_to_add)} total, need {max(0, 1000 - len(products_to_add))} more to reach 1000)"
-            )
-            
-            # Write when we have 1000 products (10 fetches of 100 each)
-            if len(products_to_add) >= 1000:
-                try:
-                    next_row = current_row_in_sheet + 1
-                    needed_rows = next_row + len(products_to_add) - 1
+                # Process cards and collect products (batch 1000 before writing)
+                page_new_count = 0
+                for card in cards:
+                    vendor_code = str(card.get("vendorCode", "")).strip()
+                    if not vendor_code:
+                        continue
                     
-                    # Check current sheet max size and expand if needed
-                    max_rows = products_sheet.row_count
-                    if needed_rows > max_rows:
-                        rows_to_add = ((needed_rows - max_rows) // 1000 + 1) * 1000
-                        products_sheet.add_rows(rows_to_add)
-                        logger.info(
-                            f"Expanded Products sheet: added {rows_to_add} rows "
-                            f"(total now: {max_rows + rows_to_add})"
-                        )
+                    vendor_code_lower = vendor_code.lower()
                     
-                    # Write all 1000 products in one batch (columns A-C)
-                    range_name = f"A{next_row}:C{next_row + len(products_to_add) - 1}"
-                    products_sheet.update(
-                        range_name,
-                        products_to_add,
-                        value_input_option='USER_ENTERED'
-                    )
+                    # Skip if already exists
+                    if vendor_code_lower in existing_products:
+                        continue
                     
-                    # Update our row counter
-                    current_row_in_sheet += len(products_to_add)
-                    total_products_written += len(products_to_add)
+                    # Get photo URL (big image)
+                    photos = card.get("photos", [])
+                    photo_url = ""
+                    if photos and len(photos) > 0:
+                        photo_url = photos[0].get("big", "")
                     
-                    logger.info(
-                        f"✅ Batch write: Added {len(products_to_add)} products to sheet "
-                        f"(rows {next_row}-{next_row + len(products_to_add) - 1}, "
-                        f"total written: {total_products_written})"
-                    )
+                    # Get product title
+                    title = str(card.get("title", "")).strip()
                     
-                    # Clear batch
-                    products_to_add = []
-                    
-                except Exception as e:
-                    logger.error(f"Error writing products to sheet: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-            
-            if not next_cursor:
-                logger.info("No more pages available")
+                    # Add: vendorCode, photo URL, title (columns A, B, C)
+                    products_to_add.append([vendor_code, photo_url, title])
+                    existing_products.add(vendor_code_lower)
+                    page_new_count += 1
+                
+                logger.info(
+                    f"Page {pages_fetched + 1}: Processed {len(cards)} cards, "
+                    f"found {page_new_count} new products "
+                    f"(collected {len(products_to_add)} total, need {max(0, 1000 - len(products_to_add))} more to reach 1000)"
+                )
+                
+                # Write when we have 1000 products (10 fetches of 100 each)
+                if len(products_to_add) >= 1000:
+                    wait_pending_write()
+                    batch, products_to_add = products_to_add, []
+                    pending_write = (pool.submit(write_batch, batch), batch)
+                
+                if not next_cursor:
+                    logger.info("No more pages available")
+                    break
+                
+                pages_fetched += 1
+                
+            except Exception as e:
+                logger.error(f"Error parsing product cards response: {e}")
+                logger.error(traceback.format_exc())
                 break
-            
-            current_cursor = next_cursor
-            pages_fetched += 1
-            
-        except Exception as e:
-            logger.error(f"Error parsing product cards response: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            break
+        
+        # Drop an unused prefetch (if already running, the pool waits for it)
+        if fetch_future is not None:
+            fetch_future.cancel()
+        wait_pending_write()
     
     # Write remaining products if any (less than 1000)
     if products_to_add:
         try:
-            next_row = current_row_in_sheet + 1
-            needed_rows = next_row + len(products_to_add) - 1
-            
-            # Check current sheet max size and expand if needed
-            max_rows = products_sheet.row_count
-            if needed_rows > max_rows:
-                rows_to_add = ((needed_rows - max_rows) // 1000 + 1) * 1000
-                products_sheet.add_rows(rows_to_add)
-                logger.info(
-                    f"Expanded Products sheet: added {rows_to_add} rows"
-                )
-            
-            # Write remaining products (columns A-C)
-            range_name = f"A{next_row}:C{next_row + len(products_to_add) - 1}"
-            products_sheet.update(
-                range_name,
-                products_to_add,
-                value_input_option='USER_ENTERED'
-            )
-            
-            total_products_written += len(products_to_add)
+            # Append remaining products (columns A-C)
+            total_products_written += write_batch(products_to_add)
             logger.info(
                 f"✅ Final batch: Added {len(products_to_add)} remaining products "
                 f"(total written: {total_products_written})"
             )
         except Exception as e:
             logger.error(f"Error writing remaining products to sheet: {e}")
-            import traceback
             logger.error(traceback.format_exc())
     
     logger.info(
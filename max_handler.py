@@ -4,10 +4,10 @@ Manages MAX bot interactions, navigation, and message sending
 """
 import logging
 import asyncio
-import re
 import tempfile
 import os
 import time
+import traceback
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Tuple
 
@@ -23,48 +23,20 @@ from maxapi.types import (
 )
 from maxapi.utils.inline_keyboard import InlineKeyboardBuilder
 from sheets_handler import SheetsHandler
-from supply_orders import SupplyOrdersHandler
+from supply_orders import SupplyOrdersHandler, format_supply_date
 from wb_api import WildberriesAPI
-from pdf_generator import PDFGenerator
-from config import PRODUCT_IMAGE_HTTP_RETRIES, PRODUCT_IMAGE_HTTP_TIMEOUT
+from pdf_generator import PDFGenerator, extract_article_number
+from config import PRODUCT_IMAGE_HTTP_RETRIES, PRODUCT_IMAGE_HTTP_TIMEOUT, SUPPLY_LIST_LIMIT
 from image_download_headers import image_request_headers
 from product_image_cache import read_cached_image
 
 logger = logging.getLogger(__name__)
 
 
-def extract_article_number(article: str) -> int:
-    if not article:
-        return 999
-
-    article = str(article).strip()
-
-    if len(article) >= 2 and not article[0].isdigit() and not article[1].isdigit():
-        remaining = article[2:]
-        if remaining and remaining[0].isdigit() and remaining[0] != '0':
-            match = re.search(r'\d+', remaining)
-            if match:
-                number = int(match.group())
-                if 1 <= number <= 99:
-                    return number
-
-    if len(article) >= 1 and not article[0].isdigit():
-        remaining = article[1:]
-        if remaining and remaining[0].isdigit() and remaining[0] != '0':
-            match = re.search(r'\d+', remaining)
-            if match:
-                number = int(match.group())
-                if 1 <= number <= 99:
-                    return number
-
-    if article and article[0].isdigit() and article[0] != '0':
-        match = re.search(r'\d+', article)
-        if match:
-            number = int(match.group())
-            if 1 <= number <= 99:
-                return number
-
-    return 999
+def _split_supply_payload(payload: str) -> Tuple[str, Optional[str]]:
+    """Split "<supply_id>|warehouse_<name>" into (supply_id, name or None)"""
+    supply_id, sep, warehouse = payload.partition("|warehouse_")
+    return supply_id, (warehouse if sep else None)
 
 
 class MaxHandler:
@@ -257,15 +229,10 @@ class MaxHandler:
             attachments=attachments,
         )
 
-    def _get_warehouse_for_order(self, order_id: str) -> Optional[str]:
+    async def _get_warehouse_for_order(self, order_id: str) -> Optional[str]:
         try:
-            processed_sheet = self.sheets_handler.spreadsheet.worksheet("ProcessedOrders")
-            processed_records = processed_sheet.get_all_records()
-            for record in processed_records:
-                if str(record.get("Order ID", "")).strip() == str(order_id).strip():
-                    warehouse = str(record.get("Warehouse", "")).strip()
-                    return warehouse if warehouse else None
-            return None
+            order_warehouses = await self.sheets_handler.aget_processed_order_warehouses()
+            return order_warehouses.get(str(order_id).strip()) or None
         except Exception as e:
             logger.error(f"Error getting warehouse for order {order_id}: {e}")
             return None
@@ -296,7 +263,7 @@ class MaxHandler:
             user_username = getattr(event.from_user, "username", "") or ""
 
         try:
-            self.sheets_handler.log_user_contact(
+            await asyncio.to_thread(self.sheets_handler.log_user_contact,
                 chat_id=chat_id,
                 username=user_username,
                 first_name=user_name,
@@ -305,7 +272,7 @@ class MaxHandler:
             logger.warning(f"Could not log user contact: {e}")
 
         try:
-            user_access = self.sheets_handler.get_user_access()
+            user_access = await self.sheets_handler.aget_user_access()
             uid_alt = (
                 int(event.user.user_id)
                 if getattr(event, "user", None) and event.user.user_id
@@ -383,7 +350,7 @@ class MaxHandler:
             user_username = getattr(event.from_user, "username", "") or ""
 
         try:
-            self.sheets_handler.log_user_contact(
+            await asyncio.to_thread(self.sheets_handler.log_user_contact,
                 chat_id=chat_id,
                 username=user_username,
                 first_name=user_name,
@@ -392,7 +359,7 @@ class MaxHandler:
             logger.warning(f"Could not log user contact: {e}")
 
         try:
-            user_access = self.sheets_handler.get_user_access()
+            user_access = await self.sheets_handler.aget_user_access()
             user_info = self._user_info_by_ids(
                 user_access, chat_part, r_user_id, sender_uid
             )
@@ -482,24 +449,16 @@ class MaxHandler:
                 warehouse = data[len("warehouse_"):]
                 await self._handle_warehouse_selection(event, warehouse)
             elif data.startswith("supply_"):
-                parts = data[len("supply_"):].split("|warehouse_")
-                supply_id = parts[0]
-                warehouse = parts[1] if len(parts) > 1 else None
+                supply_id, warehouse = _split_supply_payload(data[len("supply_"):])
                 await self._handle_supply_selection(event, supply_id, warehouse)
             elif data.startswith("send_list_"):
-                parts = data[len("send_list_"):].split("|warehouse_")
-                supply_id = parts[0]
-                warehouse = parts[1] if len(parts) > 1 else None
+                supply_id, warehouse = _split_supply_payload(data[len("send_list_"):])
                 await self._handle_send_list(event, supply_id, warehouse)
             elif data.startswith("send_pdf_"):
-                parts = data[len("send_pdf_"):].split("|warehouse_")
-                supply_id = parts[0]
-                warehouse = parts[1] if len(parts) > 1 else None
+                supply_id, warehouse = _split_supply_payload(data[len("send_pdf_"):])
                 await self._handle_send_pdf(event, supply_id, warehouse)
             elif data.startswith("send_stickers_"):
-                parts = data[len("send_stickers_"):].split("|warehouse_")
-                supply_id = parts[0]
-                warehouse = parts[1] if len(parts) > 1 else None
+                supply_id, warehouse = _split_supply_payload(data[len("send_stickers_"):])
                 await self._handle_send_stickers_pdf(event, supply_id, warehouse)
             elif data.startswith("order_"):
                 order_id = data[len("order_"):]
@@ -542,7 +501,7 @@ class MaxHandler:
         chat_id = self._get_chat_id(event)
         id_hint = ", ".join(str(k) for k in self._access_lookup_keys(event))
         try:
-            user_access = self.sheets_handler.get_user_access()
+            user_access = await self.sheets_handler.aget_user_access()
             user_info = self._user_info_from_access(user_access, event)
 
             if not user_info:
@@ -582,7 +541,7 @@ class MaxHandler:
 
     async def _handle_city_selection(self, event: MessageCallback, city: str):
         chat_id = self._get_chat_id(event)
-        user_access = self.sheets_handler.get_user_access()
+        user_access = await self.sheets_handler.aget_user_access()
         user_info = self._user_info_from_access(user_access, event)
 
         if not user_info:
@@ -592,11 +551,10 @@ class MaxHandler:
             await self._edit_or_send(event, "Ошибка: доступ не найден", builder)
             return
 
-        warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
+        warehouse_index = await self.sheets_handler.aget_warehouse_index()
         city_warehouses = [
             w for w in user_info["warehouses"]
-            for item in warehouse_api_keys
-            if item["warehouse"] == w and item["city"] == city
+            if w in warehouse_index and warehouse_index[w]["city"] == city
         ]
 
         if not city_warehouses:
@@ -613,14 +571,10 @@ class MaxHandler:
         builder = self._build_keyboard(rows)
         await self._edit_or_send(event, f"Город: {city}\n\nВыберите склад:", builder)
 
-    def _get_supply_handler_for_warehouse(self, warehouse: str) -> Optional[SupplyOrdersHandler]:
+    async def _get_supply_handler_for_warehouse(self, warehouse: str) -> Optional[SupplyOrdersHandler]:
         try:
-            warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
-            api_key = None
-            for item in warehouse_api_keys:
-                if item["warehouse"] == warehouse:
-                    api_key = item["api_key"]
-                    break
+            item = (await self.sheets_handler.aget_warehouse_index()).get(warehouse)
+            api_key = item["api_key"] if item else None
             if not api_key:
                 logger.warning(f"No API key found for warehouse: {warehouse}")
                 return None
@@ -639,7 +593,7 @@ class MaxHandler:
         try:
             await self._edit_or_send(event, f"📦 Склад: {warehouse}\n\n⏳ Загрузка поставок...")
 
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": "back_to_start"}]
@@ -653,7 +607,9 @@ class MaxHandler:
 
             logger.info(f"Starting to fetch incomplete supplies for warehouse: {warehouse}")
             try:
-                supplies = supply_handler.fetch_all_incomplete_supplies(max_age_days=365)
+                supplies = await asyncio.to_thread(supply_handler.fetch_all_incomplete_supplies,
+                    max_age_days=365, limit=SUPPLY_LIST_LIMIT
+                )
                 logger.info(f"Fetched {len(supplies)} incomplete supplies for warehouse {warehouse}")
             except Exception as e:
                 logger.error(f"Error fetching supplies for warehouse {warehouse}: {e}", exc_info=True)
@@ -680,19 +636,12 @@ class MaxHandler:
                 return
 
             rows = []
-            for supply in supplies[:50]:
+            for supply in supplies:
                 supply_id = supply.get("id", "")
                 supply_name = supply.get("name", supply_id)
                 created_str = supply.get("createdAt", "")
 
-                try:
-                    if created_str:
-                        created_dt = datetime.fromisoformat(created_str.replace('Z', '+00:00'))
-                        date_str = created_dt.strftime('%d.%m.%Y')
-                    else:
-                        date_str = ""
-                except Exception:
-                    date_str = ""
+                date_str = format_supply_date(str(created_str))
 
                 button_text = f"📦 {supply_name}"
                 if date_str:
@@ -706,9 +655,15 @@ class MaxHandler:
             rows.append([{"text": "◀️ Назад", "payload": "back_to_start"}])
             builder = self._build_keyboard(rows)
 
+            # Paging stops at SUPPLY_LIST_LIMIT, so a full list is not the total
+            if len(supplies) >= SUPPLY_LIST_LIMIT:
+                count_line = f"📋 Показаны первые {len(supplies)} незавершенных поставок"
+            else:
+                count_line = f"📋 Найдено незавершенных поставок: {len(supplies)}"
+
             await self.bot.send_message(
                 chat_id=chat_id,
-                text=f"📦 Склад: {warehouse}\n\n📋 Найдено незавершенных поставок: {len(supplies)}\n\n"
+                text=f"📦 Склад: {warehouse}\n\n{count_line}\n\n"
                      "Выберите поставку для просмотра заказов:",
                 attachments=[builder.as_markup()],
             )
@@ -733,7 +688,7 @@ class MaxHandler:
             await self._edit_or_send(event, f"📦 Поставка: {supply_id}\n\n⏳ Загрузка заказов...")
 
             if not warehouse:
-                warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
+                warehouse_api_keys = await self.sheets_handler.aget_warehouse_api_keys()
                 for item in warehouse_api_keys:
                     warehouse = item["warehouse"]
                     break
@@ -748,7 +703,7 @@ class MaxHandler:
                 )
                 return
 
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": "back_to_start"}]
@@ -760,7 +715,7 @@ class MaxHandler:
                 )
                 return
 
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
 
             if not order_ids:
                 builder = self._build_keyboard([
@@ -808,24 +763,21 @@ class MaxHandler:
             except Exception:
                 pass
 
-    def _get_api_key_for_warehouse(self, warehouse: str) -> Optional[str]:
-        warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
-        for item in warehouse_api_keys:
-            if item["warehouse"] == warehouse:
-                return item["api_key"]
-        return None
+    async def _get_api_key_for_warehouse(self, warehouse: str) -> Optional[str]:
+        item = (await self.sheets_handler.aget_warehouse_index()).get(warehouse)
+        return item["api_key"] if item else None
 
     async def _handle_send_list(self, event: MessageCallback, supply_id: str, warehouse: str):
         chat_id = self._get_chat_id(event)
         try:
             await self._edit_or_send(event, f"📦 Поставка: {supply_id}\n\n⏳ Отправка списка заказов...")
 
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 await self.bot.send_message(chat_id=chat_id, text="❌ Ошибка: обработчик не найден")
                 return
 
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
             if not order_ids:
                 await self.bot.send_message(
                     chat_id=chat_id,
@@ -835,14 +787,17 @@ class MaxHandler:
 
             date_from = datetime.now(timezone.utc) - timedelta(days=30)
             date_from_ts = int(date_from.timestamp())
-            orders_map = supply_handler._fetch_orders_by_ids(order_ids, date_from_ts)
+            orders_map = await asyncio.to_thread(supply_handler._fetch_orders_by_ids, order_ids, date_from_ts)
 
             if not orders_map:
                 await self.bot.send_message(chat_id=chat_id, text="❌ Не удалось загрузить детали заказов.")
                 return
 
-            api_key = self._get_api_key_for_warehouse(warehouse)
-            wb_api = WildberriesAPI(api_key) if api_key else None
+            api_key = await self._get_api_key_for_warehouse(warehouse)
+            wb_api = (
+                WildberriesAPI(api_key, marketplace_session=supply_handler.session)
+                if api_key else None
+            )
 
             orders_list = []
             for order_id, order_data in orders_map.items():
@@ -860,23 +815,14 @@ class MaxHandler:
                 for i in range(0, len(all_order_ids), batch_size):
                     batch = all_order_ids[i:i + batch_size]
                     try:
-                        batch_stickers = wb_api.get_stickers(batch)
+                        batch_stickers = await asyncio.to_thread(wb_api.get_stickers, batch)
                         all_stickers.update(batch_stickers)
                     except Exception as e:
                         logger.warning(f"Error fetching stickers for batch: {e}")
 
             logger.info("Loading products from Products sheet...")
             try:
-                products_sheet = self.sheets_handler.spreadsheet.worksheet("Products")
-                all_products_records = products_sheet.get_all_records()
-                products_cache = {}
-                for record in all_products_records:
-                    vendor_code = str(record.get("Артикул продавца", "")).strip().lower()
-                    if vendor_code:
-                        products_cache[vendor_code] = {
-                            'photo_url': str(record.get("Фото", "")).strip(),
-                            'title': str(record.get("Наименование", "")).strip(),
-                        }
+                products_cache = await self.sheets_handler.aget_products_map()
             except Exception as e:
                 logger.warning(f"Error loading products cache: {e}")
                 products_cache = {}
@@ -888,10 +834,7 @@ class MaxHandler:
                     sku = order_data.get("skus", [""])[0] if order_data.get("skus") else ""
 
                     article_lower = article.strip().lower() if article else ""
-                    product_info = products_cache.get(article_lower) if products_cache else None
-                    if not product_info and products_cache:
-                        product_info_dict = self.sheets_handler.get_product_from_sheet(article)
-                        product_info = product_info_dict if product_info_dict else None
+                    product_info = products_cache.get(article_lower)
 
                     photo_url = product_info.get("photo_url") if product_info else None
                     product_name = product_info.get("title", "") if product_info else ""
@@ -980,7 +923,7 @@ class MaxHandler:
                         'sticker': order_data.get('sticker') or "Нужно собрать!",
                     })
                 if orders_for_batch:
-                    self.sheets_handler.add_orders_to_tasks_batch(orders_for_batch)
+                    await asyncio.to_thread(self.sheets_handler.add_orders_to_tasks_batch, orders_for_batch)
             except Exception as e:
                 logger.error(f"Error adding orders to Tasks sheet in batch: {e}")
 
@@ -995,7 +938,6 @@ class MaxHandler:
             )
 
         except Exception as e:
-            import traceback
             logger.error(f"Error showing orders for supply {supply_id}: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
             builder = self._build_keyboard([
@@ -1015,7 +957,7 @@ class MaxHandler:
         try:
             await self._edit_or_send(event, f"📦 Поставка: {supply_id}\n\n⏳ Генерация PDF файла...")
 
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": f"back_to_supplies_{warehouse}"}]
@@ -1027,7 +969,7 @@ class MaxHandler:
                 )
                 return
 
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
             if not order_ids:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": f"back_to_supplies_{warehouse}"}]
@@ -1041,7 +983,7 @@ class MaxHandler:
 
             date_from = datetime.now(timezone.utc) - timedelta(days=30)
             date_from_ts = int(date_from.timestamp())
-            orders_map = supply_handler._fetch_orders_by_ids(order_ids, date_from_ts)
+            orders_map = await asyncio.to_thread(supply_handler._fetch_orders_by_ids, order_ids, date_from_ts)
 
             if not orders_map:
                 builder = self._build_keyboard([
@@ -1054,8 +996,11 @@ class MaxHandler:
                 )
                 return
 
-            api_key = self._get_api_key_for_warehouse(warehouse)
-            wb_api = WildberriesAPI(api_key) if api_key else None
+            api_key = await self._get_api_key_for_warehouse(warehouse)
+            wb_api = (
+                WildberriesAPI(api_key, marketplace_session=supply_handler.session)
+                if api_key else None
+            )
 
             all_stickers = {}
             if wb_api:
@@ -1064,16 +1009,17 @@ class MaxHandler:
                 for i in range(0, len(all_order_ids), batch_size):
                     batch = all_order_ids[i:i + batch_size]
                     try:
-                        batch_stickers = wb_api.get_stickers(batch)
+                        batch_stickers = await asyncio.to_thread(wb_api.get_stickers, batch)
                         all_stickers.update(batch_stickers)
                     except Exception as e:
                         logger.warning(f"Error fetching stickers for batch: {e}")
 
+            products_cache = await self.sheets_handler.aget_products_map()
             tasks = []
             for order_id, order_data in orders_map.items():
                 article = order_data.get("article", "")
                 sku = order_data.get("skus", [""])[0] if order_data.get("skus") else ""
-                product_info = self.sheets_handler.get_product_from_sheet(article)
+                product_info = products_cache.get(article.strip().lower() if article else "")
                 photo_url = product_info.get("photo_url") if product_info else None
                 product_name = product_info.get("title", "") if product_info else ""
                 sticker = all_stickers.get(order_id, "")
@@ -1102,7 +1048,7 @@ class MaxHandler:
                 return
 
             try:
-                self.sheets_handler.write_tasks_to_pdf_sheet(tasks)
+                await asyncio.to_thread(self.sheets_handler.write_tasks_to_pdf_sheet, tasks)
             except Exception as e:
                 logger.warning(f"Error writing to TasksForPDF sheet: {e}")
 
@@ -1110,7 +1056,7 @@ class MaxHandler:
             temp_dir = tempfile.mkdtemp()
             pdf_path = os.path.join(temp_dir, f"orders_{supply_id}.pdf")
 
-            success = pdf_generator.generate_pdf_from_tasks(
+            success = await asyncio.to_thread(pdf_generator.generate_pdf_from_tasks,
                 tasks=tasks,
                 output_path=pdf_path,
                 title=f"Заказы из поставки {supply_id}",
@@ -1183,7 +1129,7 @@ class MaxHandler:
         try:
             await self._edit_or_send(event, f"📦 Поставка: {supply_id}\n\n⏳ Генерация PDF со стикерами...")
 
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": f"back_to_supplies_{warehouse}"}]
@@ -1195,7 +1141,7 @@ class MaxHandler:
                 )
                 return
 
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
             if not order_ids:
                 builder = self._build_keyboard([
                     [{"text": "◀️ Назад", "payload": f"back_to_supplies_{warehouse}"}]
@@ -1209,7 +1155,7 @@ class MaxHandler:
 
             date_from = datetime.now(timezone.utc) - timedelta(days=30)
             date_from_ts = int(date_from.timestamp())
-            orders_map = supply_handler._fetch_orders_by_ids(order_ids, date_from_ts)
+            orders_map = await asyncio.to_thread(supply_handler._fetch_orders_by_ids, order_ids, date_from_ts)
 
             if not orders_map:
                 builder = self._build_keyboard([
@@ -1222,8 +1168,11 @@ class MaxHandler:
                 )
                 return
 
-            api_key = self._get_api_key_for_warehouse(warehouse)
-            wb_api = WildberriesAPI(api_key) if api_key else None
+            api_key = await self._get_api_key_for_warehouse(warehouse)
+            wb_api = (
+                WildberriesAPI(api_key, marketplace_session=supply_handler.session)
+                if api_key else None
+            )
 
             if not wb_api:
                 builder = self._build_keyboard([
@@ -1242,7 +1191,7 @@ class MaxHandler:
             for i in range(0, len(all_order_ids), batch_size):
                 batch = all_order_ids[i:i + batch_size]
                 try:
-                    batch_images = wb_api.get_sticker_images(batch)
+                    batch_images = await asyncio.to_thread(wb_api.get_sticker_images, batch)
                     sticker_images.update(batch_images)
                 except Exception as e:
                     logger.warning(f"Error fetching sticker images for batch: {e}")
@@ -1356,7 +1305,7 @@ class MaxHandler:
     async def _handle_order_selection(self, event: MessageCallback, order_id: str):
         chat_id = self._get_chat_id(event)
         try:
-            task = self.sheets_handler.get_task_by_order_id(order_id)
+            task = await asyncio.to_thread(self.sheets_handler.get_task_by_order_id, order_id)
             if not task:
                 await self.bot.send_message(
                     chat_id=chat_id,
@@ -1364,7 +1313,7 @@ class MaxHandler:
                 )
                 return
 
-            warehouse = self._get_warehouse_for_order(order_id)
+            warehouse = await self._get_warehouse_for_order(order_id)
 
             status_icon = "🟢" if task.get('status', 'new') == 'new' else "✅"
             status_text = "Новый" if task.get('status', 'new') == 'new' else "Завершен"
@@ -1419,9 +1368,9 @@ class MaxHandler:
     async def _handle_order_complete(self, event: MessageCallback, order_id: str):
         chat_id = self._get_chat_id(event)
         try:
-            success = self.sheets_handler.update_order_status(order_id, "completed")
+            success = await asyncio.to_thread(self.sheets_handler.update_order_status, order_id, "completed")
             if success:
-                task = self.sheets_handler.get_task_by_order_id(order_id)
+                task = await asyncio.to_thread(self.sheets_handler.get_task_by_order_id, order_id)
                 if task:
                     message_text = (
                         f"✅ Заказ №{task['order_id']}\n"
@@ -1433,7 +1382,7 @@ class MaxHandler:
                     if sticker and sticker != "Не получен":
                         message_text += f"🏷️ Стикер: {sticker}\n"
 
-                    warehouse = self._get_warehouse_for_order(order_id)
+                    warehouse = await self._get_warehouse_for_order(order_id)
                     rows = []
                     if warehouse:
                         rows.append([{"text": "◀️ Назад к списку", "payload": f"back_to_warehouse_{warehouse}"}])
@@ -1458,14 +1407,14 @@ class MaxHandler:
 
     async def _handle_view_all_orders(self, event: MessageCallback):
         try:
-            tasks = self.sheets_handler.get_tasks_from_sheet(
+            tasks = await asyncio.to_thread(self.sheets_handler.get_tasks_from_sheet,
                 warehouse=None,
                 limit=50,
                 status_filter="new"
             )
 
             if not tasks:
-                all_tasks = self.sheets_handler.get_tasks_from_sheet(
+                all_tasks = await asyncio.to_thread(self.sheets_handler.get_tasks_from_sheet,
                     warehouse=None,
                     limit=50,
                     status_filter=None
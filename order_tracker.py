@@ -2,12 +2,168 @@
 Order Tracker
 Tracks processed orders to avoid duplicates
 """
+import json
 import logging
-from typing import Set
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+from config import ORDER_TRACKER_DB
 from sheets_handler import SheetsHandler
 
 logger = logging.getLogger(__name__)
 
+# refresh() calls closer together than this reuse the last result (seconds)
+REFRESH_MIN_INTERVAL = 30.0
+
+
+def _as_order_id(value) -> Optional[int]:
+    """Parse a WB order ID (int or numeric string), None if not numeric"""
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_order_id_set(values: Iterable) -> Set[int]:
+    """Convert sheet values to a set of integer order IDs, skipping non-numeric"""
+    ids = {_as_order_id(v) for v in values}
+    ids.discard(None)
+    return ids
+
+
+class ProcessedOrderStore:
+    """
+    Local SQLite copy of the ProcessedOrders sheet.
+    Remembers how many sheet rows were merged so a refresh only reads the tail.
+    Also keeps the last Products sheet map so a restarted bot can start without it,
+    and orders that were notified but could not be written to the sheet yet.
+    """
+
+    def __init__(self, path: str = ORDER_TRACKER_DB):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed("
+            "id INTEGER PRIMARY KEY, ts INTEGER, warehouse TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS products("
+            "article TEXT PRIMARY KEY, title TEXT, photo_url TEXT, fetched_at INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS unrecorded(id INTEGER PRIMARY KEY, record TEXT)"
+        )
+        self._conn.commit()
+
+    def load_ids(self) -> Set[int]:
+        """All stored order IDs"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT id FROM processed")}
+
+    def synced_row(self) -> int:
+        """Last ProcessedOrders sheet row merged into the store (1 = header only)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'synced_row'"
+            ).fetchone()
+        return row[0] if row else 1
+
+    def synced_anchor(self) -> Optional[str]:
+        """Column A of the sheet row at synced_row when it was merged"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'synced_anchor'"
+            ).fetchone()
+        return None if row is None else str(row[0])
+
+    def add_many(
+        self,
+        rows: List[tuple],
+        synced_row: Optional[int] = None,
+        synced_anchor: Optional[str] = None,
+    ):
+        """Insert (order_id, warehouse) pairs and optionally advance synced_row"""
+        now = int(time.time())
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed(id, ts, warehouse) VALUES (?, ?, ?)",
+                [(order_id, now, warehouse) for order_id, warehouse in rows],
+            )
+            if synced_row is not None:
+                self._set_synced(synced_row, synced_anchor)
+
+    def replace_all(self, rows: List[tuple], synced_row: int, synced_anchor: Optional[str]):
+        """Replace all stored order IDs with a full read of the sheet"""
+        now = int(time.time())
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM processed")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed(id, ts, warehouse) VALUES (?, ?, ?)",
+                [(order_id, now, warehouse) for order_id, warehouse in rows],
+            )
+            self._set_synced(synced_row, synced_anchor)
+
+    def _set_synced(self, synced_row: int, synced_anchor: Optional[str]):
+        """Write the sync position (caller holds the lock and the transaction)"""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+            [("synced_row", synced_row), ("synced_anchor", synced_anchor or "")],
+        )
+
+    def load_unrecorded(self) -> Dict[int, Dict[str, Any]]:
+        """Notified orders still waiting for their Tasks/ProcessedOrders write"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, record FROM unrecorded").fetchall()
+        return {order_id: json.loads(record) for order_id, record in rows}
+
+    def add_unrecorded(self, records: Dict[int, Dict[str, Any]]):
+        """Remember notified orders whose sheet write failed"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO unrecorded(id, record) VALUES (?, ?)",
+                [
+                    (order_id, json.dumps(record, ensure_ascii=False))
+                    for order_id, record in records.items()
+                ],
+            )
+
+    def remove_unrecorded(self, order_ids: Iterable[int]):
+        """Forget orders that have been written to the sheet"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM unrecorded WHERE id = ?",
+                [(order_id,) for order_id in order_ids],
+            )
+
+    def load_products(self) -> Dict[str, Dict[str, str]]:
+        """Last saved Products map (same shape as SheetsHandler.get_products_map)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT article, title, photo_url FROM products").fetchall()
+        return {
+            article: {'photo_url': photo_url, 'title': title}
+            for article, title, photo_url in rows
+        }
+
+    def save_products(self, products: Dict[str, Dict[str, str]]):
+        """Replace the saved Products map"""
+        now = int(time.time())
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM products")
+            self._conn.executemany(
+                "INSERT INTO products(article, title, photo_url, fetched_at) VALUES (?, ?, ?, ?)",
+                [
+                    (article, info.get('title', ''), info.get('photo_url', ''), now)
+                    for article, info in products.items()
+                ],
+            )
+
 
 class OrderTracker:
     """Tracks processed orders using Google Sheets as database"""
@@ -20,18 +176,117 @@ class OrderTracker:
             sheets_handler: SheetsHandler instance for Google Sheets access
         """
         self.sheets_handler = sheets_handler
-        self.processed_ids: Set[str] = None
+        # WB order IDs are ints: int keys are smaller and hash faster than str
+        self.processed_ids: Set[int] = None
+        self.tasks_ids: Set[int] = set()
+        try:
+            self.store: Optional[ProcessedOrderStore] = ProcessedOrderStore()
+        except Exception as e:
+            logger.warning(f"Local order store unavailable, using full sheet reads: {e}")
+            self.store = None
+        # Orders already notified but not yet in the sheet (write pending or
+        # failed): treated as processed so they are not notified again, and
+        # written by record_orders
+        self.unrecorded: Dict[int, Dict[str, Any]] = {}
+        if self.store is not None:
+            try:
+                self.unrecorded = self.store.load_unrecorded()
+            except Exception as e:
+                logger.warning(f"Could not load unrecorded orders: {e}")
+        # record_orders runs in worker threads; one sheet write at a time
+        self._record_lock = threading.Lock()
+        self._last_refresh_ts = 0.0
         self._refresh_processed_ids()
 
     def _refresh_processed_ids(self):
-        """Refresh the set of processed order IDs from Google Sheets"""
+        """Refresh the sets of processed and Tasks order IDs from Google Sheets"""
+        self._last_refresh_ts = time.monotonic()
         try:
-            self.processed_ids = self.sheets_handler.get_processed_order_ids()
+            if self.store is not None:
+                self._sync_store()
+            else:
+                self.processed_ids = _to_order_id_set(
+                    self.sheets_handler.get_processed_order_ids()
+                )
             logger.info(f"Refreshed processed order IDs: {len(self.processed_ids)} orders")
         except Exception as e:
             logger.error(f"Error refreshing processed order IDs: {e}")
             if self.processed_ids is None:
                 self.processed_ids = set()
+        
+        # Order IDs already in Tasks sheet (might be processed but not marked).
+        # One column read here replaces a Sheets lookup per is_processed() miss.
+        try:
+            self.tasks_ids = _to_order_id_set(
+                self.sheets_handler.get_existing_task_order_ids()
+            )
+            logger.info(f"Refreshed Tasks order IDs: {len(self.tasks_ids)} orders")
+        except Exception as e:
+            logger.error(f"Error refreshing Tasks order IDs: {e}")
+
+    @staticmethod
+    def _parse_processed_rows(rows: List[List[str]]) -> List[tuple]:
+        """(order_id, warehouse) pairs from ProcessedOrders rows, skipping non-numeric"""
+        parsed = []
+        for row in rows:
+            order_id = _as_order_id(row[0]) if row else None
+            if order_id is not None:
+                warehouse = str(row[1]).strip() if len(row) > 1 else ""
+                parsed.append((order_id, warehouse))
+        return parsed
+
+    @staticmethod
+    def _row_anchor(row: List[str]) -> str:
+        """Column A of a sheet row as text, used to check the sync position"""
+        return str(row[0]).strip() if row else ""
+
+    def _sync_store(self):
+        """Merge ProcessedOrders rows added since the last sync into the local store"""
+        if self.processed_ids is None:
+            self.processed_ids = self.store.load_ids()
+        
+        synced_row = self.store.synced_row()
+        if synced_row <= 1:
+            self._resync_store()
+            return
+        
+        # Re-read the last merged row too: if it no longer holds the same order,
+        # rows were deleted or cleared and synced_row points past the real data
+        tail = self.sheets_handler.get_processed_orders_tail(synced_row)
+        if tail is None:
+            return
+        if not tail or self._row_anchor(tail[0]) != self.store.synced_anchor():
+            logger.warning("ProcessedOrders sheet shrank or shifted, rebuilding local store")
+            self._resync_store()
+            return
+        tail = tail[1:]
+        if not tail:
+            return
+        
+        new_rows = self._parse_processed_rows(tail)
+        self.store.add_many(
+            new_rows,
+            synced_row=synced_row + len(tail),
+            synced_anchor=self._row_anchor(tail[-1]),
+        )
+        self.processed_ids.update(order_id for order_id, _ in new_rows)
+        logger.debug(f"Merged {len(new_rows)} new ProcessedOrders rows into local store")
+
+    def _resync_store(self):
+        """Rebuild the local store and processed_ids from a full ProcessedOrders read"""
+        # Hold off record_orders so its writes are either in this read or applied after
+        with self._record_lock:
+            rows = self.sheets_handler.get_processed_orders_tail(2)
+            if rows is None:
+                return
+            parsed = self._parse_processed_rows(rows)
+            self.store.replace_all(
+                parsed,
+                synced_row=1 + len(rows),
+                synced_anchor=self._row_anchor(rows[-1]) if rows else "",
+            )
+            self.processed_ids = {order_id for order_id, _ in parsed}
+        logger.info(f"Rebuilt local store from {len(parsed)} ProcessedOrders rows")
 
     def is_processed(self, order_id: int) -> bool:
         """
@@ -47,50 +302,144 @@ class OrderTracker:
         if self.processed_ids is None:
             self._refresh_processed_ids()
         
-        order_id_str = str(order_id)
+        order_id_int = _as_order_id(order_id)
+        if order_id_int is None:
+            return False
         
         # Check ProcessedOrders sheet
-        if order_id_str in self.processed_ids:
+        if order_id_int in self.processed_ids:
             return True
         
         # Also check if order exists in Tasks sheet (might be processed but not marked)
-        try:
-            if self.sheets_handler.order_exists_in_tasks(order_id):
-                logger.debug(f"Order {order_id} found in Tasks sheet, treating as processed")
-                return True
-        except Exception as e:
-            logger.warning(f"Error checking Tasks sheet for order {order_id}: {e}")
+        if order_id_int in self.tasks_ids:
+            logger.debug(f"Order {order_id} found in Tasks sheet, treating as processed")
+            return True
+        
+        # Notified already, sheet write still pending
+        if order_id_int in self.unrecorded:
+            return True
         
         return False
 
-    def mark_processed(self, order_id: int, warehouse: str, api_key: str):
+    def record_orders(self, orders: List[Dict[str, Any]]) -> bool:
         """
-        Mark an order as processed
+        Add orders to Tasks and mark them processed in a single sheet write;
+        orders whose earlier write failed are retried in the same request.
+        If the write fails, the orders are kept as unrecorded (in memory and in
+        the local store) so they are not notified again.
         
         Args:
-            order_id: Order ID
-            warehouse: Warehouse name
-            api_key: API key used
+            orders: List of order dictionaries with keys:
+                   order_id, warehouse, api_key, photo_url, product_name, article, sticker
+            
+        Returns:
+            True if written (or nothing new to write), False on error
         """
-        try:
-            order_id_str = str(order_id)
+        with self._record_lock:
+            pending = []
+            seen: Set[int] = set()
+            already_recorded = []
+            for order in list(self.unrecorded.values()) + list(orders):
+                order_id_int = _as_order_id(order["order_id"])
+                if order_id_int is not None:
+                    if order_id_int in seen:
+                        continue
+                    seen.add(order_id_int)
+                if self.processed_ids is not None and order_id_int in self.processed_ids:
+                    logger.debug(f"Order {order['order_id']} already marked as processed in cache")
+                    if order_id_int in self.unrecorded:
+                        already_recorded.append(order_id_int)
+                    continue
+                pending.append(order)
             
-            # Skip if already in cache (already marked)
-            if self.processed_ids is not None and order_id_str in self.processed_ids:
-                logger.debug(f"Order {order_id} already marked as processed in cache")
-                return
+            if already_recorded:
+                self._forget_unrecorded(already_recorded)
+            if not pending:
+                return True
             
-            self.sheets_handler.mark_order_processed(order_id, warehouse, api_key)
+            try:
+                written = self.sheets_handler.process_orders(pending)
+            except Exception as e:
+                logger.error(f"Error recording orders to Google Sheets: {e}")
+                written = False
+            if not written:
+                self._keep_unrecorded(pending)
+                return False
             
             # Update local cache immediately
-            if self.processed_ids is not None:
-                self.processed_ids.add(order_id_str)
-            
-            logger.debug(f"Marked order {order_id} as processed")
-        except Exception as e:
-            logger.error(f"Error marking order as processed: {e}")
+            stored = []
+            for order in pending:
+                order_id_int = _as_order_id(order["order_id"])
+                if order_id_int is None:
+                    continue
+                if self.processed_ids is not None:
+                    self.processed_ids.add(order_id_int)
+                self.tasks_ids.add(order_id_int)
+                stored.append((order_id_int, order["warehouse"]))
+            if self.store is not None and stored:
+                self.store.add_many(stored)
+            self._forget_unrecorded([order_id for order_id, _ in stored if order_id in self.unrecorded])
+            return True
 
-    def refresh(self):
-        """Manually refresh processed order IDs from Google Sheets"""
-        self._refresh_processed_ids()
+    def mark_notified(self, order: Dict[str, Any]):
+        """
+        Mark an order as handled locally before its sheet write; it counts as
+        processed from now on and is written by the next record_orders call
+        
+        Args:
+            order: Order dictionary (same keys as for record_orders)
+        """
+        order_id_int = _as_order_id(order["order_id"])
+        if order_id_int is not None:
+            self.unrecorded[order_id_int] = order
+
+    def retry_unrecorded(self) -> bool:
+        """
+        Write orders marked by mark_notified or kept after a failed sheet write
+        
+        Returns:
+            True if nothing is left to write, False if the write failed again
+        """
+        if not self.unrecorded:
+            return True
+        logger.info(f"Writing {len(self.unrecorded)} notified orders to Google Sheets")
+        return self.record_orders([])
+
+    def _keep_unrecorded(self, orders: List[Dict[str, Any]]):
+        """Remember notified orders whose sheet write failed"""
+        kept = {}
+        for order in orders:
+            order_id_int = _as_order_id(order["order_id"])
+            if order_id_int is not None:
+                kept[order_id_int] = order
+        self.unrecorded.update(kept)
+        logger.error(f"Sheet write failed, keeping {len(kept)} notified orders for retry")
+        if self.store is not None and kept:
+            try:
+                self.store.add_unrecorded(kept)
+            except Exception as e:
+                logger.warning(f"Could not save unrecorded orders: {e}")
 
+    def _forget_unrecorded(self, order_ids: List[int]):
+        """Drop orders from the unrecorded set once they are in the sheet"""
+        if not order_ids:
+            return
+        for order_id in order_ids:
+            self.unrecorded.pop(order_id, None)
+        if self.store is not None:
+            try:
+                self.store.remove_unrecorded(order_ids)
+            except Exception as e:
+                logger.warning(f"Could not update unrecorded orders: {e}")
+
+    def refresh(self, force: bool = False):
+        """
+        Manually refresh processed and Tasks order IDs from Google Sheets
+        
+        Args:
+            force: Refresh even if the last refresh was under REFRESH_MIN_INTERVAL ago
+        """
+        if not force and time.monotonic() - self._last_refresh_ts < REFRESH_MIN_INTERVAL:
+            logger.debug("Processed order IDs refreshed recently, skipping")
+            return
+        self._refresh_processed_ids()
@@ -2,13 +2,18 @@
 PDF Generator Module
 Generates PDF files from TasksForPDF sheet
 """
+import atexit
 import logging
 import os
-import re
+import shutil
 import tempfile
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from pathlib import Path
 from typing import List, Dict, Optional
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
@@ -39,90 +44,218 @@ import os
 
 logger = logging.getLogger(__name__)
 
+# Image downloads are network-bound, so they run in a thread pool before the
+# (single-threaded) ReportLab assembly pass.
+IMAGE_DOWNLOAD_WORKERS = 16
+
+# Product photos are rendered in a 150 mm box; at 150 dpi that is ~886 px,
+# so larger originals are downscaled before embedding to keep PDFs small.
+IMAGE_RENDER_MM = 150
+IMAGE_MAX_PX = 900
+IMAGE_JPEG_QUALITY = 80
+
+
+# Articles repeat a lot across orders (same SKU sold many times), so sort keys
+# are memoized; shared with telegram_handler and max_handler
+@lru_cache(maxsize=2048)
+def extract_article_number(article: str) -> int:
+    """
+    Extract numeric value from article/Offer ID for sorting.
+    
+    Examples:
+        "р20-п5-33" -> 20
+        "р25-п5-33" -> 25
+        "мд33-п2-30" -> 33
+        
+    Args:
+        article: Article string (e.g., "р20-п5-33")
+        
+    Returns:
+        Extracted number (1-99) or 999 if not found (for sorting)
+    """
+    if not article:
+        return 999
+    
+    article = str(article).strip()
+    n = len(article)
+    
+    # Single pass instead of regex searches: the number must start within the
+    # first 3 characters (after 0-2 non-digit prefix chars), without a leading zero
+    i = 0
+    while i < n and i < 3 and not "0" <= article[i] <= "9":
+        i += 1
+    if i == n or i == 3 or article[i] == "0":
+        return 999
+    
+    # Read the digit run, giving up as soon as it exceeds 99
+    number = 0
+    while i < n and "0" <= article[i] <= "9":
+        number = number * 10 + (ord(article[i]) - 48)
+        if number > 99:
+            return 999
+        i += 1
+    return number
+
+
+def _image_session() -> requests.Session:
+    """Shared keep-alive session sized for the download pool"""
+    s = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=IMAGE_DOWNLOAD_WORKERS,
+        pool_maxsize=IMAGE_DOWNLOAD_WORKERS * 2,
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+# Reused across downloads so TLS handshakes to the CDN are amortized
+_IMAGE_SESSION = _image_session()
+atexit.register(_IMAGE_SESSION.close)
+
+
+def _download_raw_image(image_url: str) -> bytes:
+    """HTTP GET with retries; raises the last error if every attempt fails"""
+    last_err: Optional[BaseException] = None
+    for attempt in range(PRODUCT_IMAGE_HTTP_RETRIES):
+        try:
+            response = _IMAGE_SESSION.get(
+                image_url,
+                timeout=(20, PRODUCT_IMAGE_HTTP_TIMEOUT),
+                headers=image_request_headers(image_url),
+            )
+            response.raise_for_status()
+            if response.content:
+                return response.content
+            last_err = ValueError("empty response body")
+        except Exception as e:
+            last_err = e
+        if attempt + 1 < PRODUCT_IMAGE_HTTP_RETRIES:
+            time.sleep(1.5 * (attempt + 1))
+    raise last_err or ValueError("no download attempts made")
+
+
+def _reencode_jpeg(raw: bytes, max_px: int = IMAGE_MAX_PX) -> bytes:
+    """Re-encode image bytes as RGB JPEG suitable for ReportLab"""
+    img = PILImage.open(BytesIO(raw))
+    
+    # Fast path: RGB JPEG already within the render size needs no decode/re-encode.
+    # Image.open only parses the header, so this probe is cheap.
+    if (
+        raw[:3] == b'\xff\xd8\xff'
+        and img.mode == 'RGB'
+        and max(img.size) <= max_px
+    ):
+        img.close()
+        return raw
+    
+    # Convert to RGB if necessary (for JPEG)
+    if img.mode != 'RGB':
+        if img.mode == 'P' and 'transparency' in img.info:
+            img = img.convert('RGBA')
+        if img.mode in ('RGBA', 'LA') and img.getchannel('A').getextrema()[0] < 255:
+            # Real transparency: composite onto white background
+            rgb_img = PILImage.new('RGB', img.size, (255, 255, 255))
+            rgb_img.paste(img, mask=img.getchannel('A'))
+            img = rgb_img
+        else:
+            # Opaque image: a plain mode conversion is enough
+            img = img.convert('RGB')
+    
+    # Downscale to the final render size (aspect ratio is preserved)
+    img.thumbnail((max_px, max_px), PILImage.Resampling.LANCZOS)
+    
+    img_bytes = BytesIO()
+    img.save(
+        img_bytes,
+        format='JPEG',
+        quality=IMAGE_JPEG_QUALITY,
+        optimize=False,
+        progressive=False,
+    )
+    return img_bytes.getvalue()
+
+
+def _fetch_jpeg_bytes(image_url: str) -> bytes:
+    """
+    Download and re-encode an image.
+    Not memoized: generate_pdf_from_tasks dedupes URLs per document, so the
+    encoded images are freed once the PDF is built.
+    """
+    return _reencode_jpeg(_download_raw_image(image_url))
+
+
+_UNICODE_FONT: Optional[str] = None
+_UNICODE_FONT_TRIED = False
+
+
+def _ensure_unicode_font() -> Optional[str]:
+    """
+    Register a Unicode CID font for Russian characters once per process.
+    pdfmetrics keeps a global registry, so repeated registration is wasted work.
+
+    Returns:
+        Registered font name, or None if no font could be registered
+    """
+    global _UNICODE_FONT, _UNICODE_FONT_TRIED
+    if _UNICODE_FONT_TRIED:
+        return _UNICODE_FONT
+    _UNICODE_FONT_TRIED = True
+
+    # Try different Unicode CID fonts that support Cyrillic
+    font_options = ['HeiseiMin-W3', 'HeiseiKakuGo-W5', 'KozMinPro-Regular']
+    for font_name in font_options:
+        try:
+            pdfmetrics.registerFont(UnicodeCIDFont(font_name))
+            _UNICODE_FONT = font_name
+            logger.info(f"Registered Unicode font: {font_name}")
+            return font_name
+        except Exception:
+            continue
+    logger.warning("Could not register Unicode font, using default")
+    return None
+
 
 class PDFGenerator:
     """Generates PDF files from order data"""
     
     def __init__(self):
         """Initialize PDF generator"""
-        self.temp_dir = tempfile.mkdtemp()
+        self._temp_dir: Optional[str] = None
         # Register Unicode font for Russian characters
-        # Use built-in CID fonts that support Cyrillic
-        self.unicode_font_name = None
-        try:
-            # Try different Unicode CID fonts that support Cyrillic
-            font_options = ['HeiseiMin-W3', 'HeiseiKakuGo-W5', 'KozMinPro-Regular']
-            for font_name in font_options:
-                try:
-                    pdfmetrics.registerFont(UnicodeCIDFont(font_name))
-                    self.unicode_font_name = font_name
-                    logger.info(f"Registered Unicode font: {font_name}")
-                    break
-                except Exception:
-                    continue
-            if not self.unicode_font_name:
-                logger.warning("Could not register Unicode font, using default")
-        except Exception as e:
-            logger.warning(f"Error registering Unicode font: {e}")
-        logger.info(f"PDF generator initialized with temp dir: {self.temp_dir}")
+        self.unicode_font_name = _ensure_unicode_font()
+
+    @property
+    def temp_dir(self) -> str:
+        """Temporary directory, created on first use"""
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp()
+            logger.info(f"PDF generator temp dir: {self._temp_dir}")
+        return self._temp_dir
     
     def _download_image(
         self, image_url: str, article: str = ""
-    ) -> Optional[BytesIO]:
+    ) -> Optional[bytes]:
         """
         Load image: local cache by vendor article, else HTTP with retries.
+        Returns encoded JPEG bytes; callers wrap them in a fresh BytesIO.
         """
         if not image_url or not image_url.strip():
             return None
 
-        raw: Optional[bytes] = None
         art = (article or "").strip()
-        if art:
-            raw = read_cached_image(art)
-
-        if not raw:
-            last_err: Optional[BaseException] = None
-            for attempt in range(PRODUCT_IMAGE_HTTP_RETRIES):
-                try:
-                    response = requests.get(
-                        image_url.strip(),
-                        timeout=(20, PRODUCT_IMAGE_HTTP_TIMEOUT),
-                        headers=image_request_headers(image_url),
-                    )
-                    response.raise_for_status()
-                    raw = response.content
-                    break
-                except Exception as e:
-                    last_err = e
-                    if attempt + 1 < PRODUCT_IMAGE_HTTP_RETRIES:
-                        time.sleep(1.5 * (attempt + 1))
-            if not raw:
-                logger.warning(
-                    "Error downloading image from %s: %s",
-                    image_url,
-                    last_err,
-                )
+        raw = read_cached_image(art) if art else None
+        if raw:
+            try:
+                return _reencode_jpeg(raw)
+            except Exception as e:
+                logger.warning("Error processing image from %s: %s", image_url, e)
                 return None
 
         try:
-            img = PILImage.open(BytesIO(raw))
-            
-            # Convert to RGB if necessary (for JPEG)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                rgb_img = PILImage.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = rgb_img
-            
-            # Save to BytesIO
-            img_bytes = BytesIO()
-            img.save(img_bytes, format='JPEG', quality=85)
-            img_bytes.seek(0)
-
-            return img_bytes
+            return _fetch_jpeg_bytes(image_url.strip())
         except Exception as e:
-            logger.warning("Error processing image from %s: %s", image_url, e)
+            logger.warning("Error loading image from %s: %s", image_url, e)
             return None
     
     def generate_pdf_from_tasks(
@@ -149,8 +282,10 @@ class PDFGenerator:
                 logger.warning("No tasks provided for PDF generation")
                 return False
             
+            # Build in memory and write the file with a single call
+            pdf_buffer = BytesIO()
             doc = SimpleDocTemplate(
-                output_path,
+                pdf_buffer,
                 pagesize=A4,
                 rightMargin=15*mm,
                 leftMargin=15*mm,
@@ -184,64 +319,46 @@ class PDFGenerator:
             )
             
             # Sort tasks by article (Артикул продавца) - extract number and sort ascending
-            def extract_article_number(article: str) -> int:
-                """
-                Extract numeric value from article/Offer ID for sorting.
-                
-                Examples:
-                    "р20-п5-33" -> 20
-                    "р25-п5-33" -> 25
-                    "мд33-п2-30" -> 33
-                """
-                if not article:
-                    return 999
-                
-                article = str(article).strip()
-                
-                # Strategy: Remove first 1-2 NON-DIGIT characters, then find first number
-                # Try removing 2 non-digit chars first
-                if len(article) >= 2 and not article[0].isdigit() and not article[1].isdigit():
-                    remaining = article[2:]
-                    if remaining and remaining[0].isdigit() and remaining[0] != '0':
-                        # Extract first number
-                        match = re.search(r'\d+', remaining)
-                        if match:
-                            number = int(match.group())
-                            if 1 <= number <= 99:
-                                return number
-                
-                # Try removing 1 non-digit char
-                if len(article) >= 1 and not article[0].isdigit():
-                    remaining = article[1:]
-                    if remaining and remaining[0].isdigit() and remaining[0] != '0':
-                        # Extract first number
-                        match = re.search(r'\d+', remaining)
-                        if match:
-                            number = int(match.group())
-                            if 1 <= number <= 99:
-                                return number
-                
-                # If article starts with a digit, try to extract directly
-                if article and article[0].isdigit() and article[0] != '0':
-                    match = re.search(r'\d+', article)
-                    if match:
-                        number = int(match.group())
-                        if 1 <= number <= 99:
-                            return number
-                
-                return 999
+            # Compute each sort key once, then sort indices (stable, no per-task closure)
+            sort_keys = [
+                extract_article_number(str(task.get('article') or '').strip())
+                for task in tasks
+            ]
+            order = sorted(range(len(tasks)), key=sort_keys.__getitem__)
+            sorted_tasks = [tasks[i] for i in order]
+            logger.info(f"Generating PDF with {len(sorted_tasks)} tasks")
             
-            def get_sort_key(task):
-                article = str(task.get('article', '')).strip()
-                return extract_article_number(article)
+            # Download all images concurrently up front.
+            # Tasks for the same SKU share one photo: fetch each (url, article)
+            # once for this document; nothing is kept after the PDF is built
+            image_keys = [
+                (
+                    str(task.get('photo_url', '')).strip(),
+                    str(task.get('article', '')).strip(),
+                )
+                for task in sorted_tasks
+            ]
+            unique_keys = list(dict.fromkeys(key for key in image_keys if key[0]))
             
-            sorted_tasks = sorted(tasks, key=get_sort_key)
-            logger.info(f"Generating PDF with {len(sorted_tasks)} tasks")
+            def load_image(key):
+                try:
+                    return self._download_image(*key)
+                except Exception as e:
+                    logger.warning(f"Error downloading image {key[0]}: {e}")
+                    return None
+            
+            with ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_WORKERS) as executor:
+                images_by_key = dict(zip(unique_keys, executor.map(load_image, unique_keys)))
+            
+            # Fresh BytesIO per task: ReportLab consumes the stream
+            task_images = [
+                BytesIO(images_by_key[key]) if images_by_key.get(key) else None
+                for key in image_keys
+            ]
             
             # Add title
             title_para = Paragraph(str(title), title_style)
-            elements.append(title_para)
-            elements.append(Spacer(1, 12))
+            elements.extend((title_para, Spacer(1, 12)))
             
             # Escape and encode text properly for Unicode
             def safe_text(text):
@@ -270,25 +387,30 @@ class PDFGenerator:
                     
                     logger.info(f"Processing task {idx}/{len(sorted_tasks)}: order_id={order_id}, article={article}")
                     
-                    # Download and add image if available
+                    # Add image if available (downloaded above)
                     if photo_url:
                         try:
-                            img_data = self._download_image(photo_url, article)
+                            img_data = task_images[idx - 1]
                             if img_data:
                                 # Resize image to fit on page (max width 150mm)
-                                img = Image(img_data, width=150*mm, height=150*mm, kind='proportional')
-                                elements.append(img)
-                                elements.append(Spacer(1, 5))
+                                img = Image(
+                                    img_data,
+                                    width=IMAGE_RENDER_MM*mm,
+                                    height=IMAGE_RENDER_MM*mm,
+                                    kind='proportional',
+                                )
+                                elements.extend((img, Spacer(1, 5)))
                         except Exception as e:
                             logger.warning(f"Error adding image for order {order_id}: {e}")
                             # Continue without image
                     
-                    # Use Paragraph for Unicode support
+                    # Static labels are drawn as plain strings (font set via FONTNAME below);
+                    # only values, which may wrap, go through Paragraph
                     order_data_formatted = [
-                        [Paragraph(safe_text('№ задания:'), normal_style), Paragraph(safe_text(order_id), normal_style)],
-                        [Paragraph(safe_text('Наименование:'), normal_style), Paragraph(safe_text(product_name or 'Не указано'), normal_style)],
-                        [Paragraph(safe_text('Артикул продавца:'), normal_style), Paragraph(safe_text(article or 'Не указано'), normal_style)],
-                        [Paragraph(safe_text('Стикер:'), normal_style), Paragraph(safe_text(sticker or 'Не указано'), normal_style)],
+                        ['№ задания:', Paragraph(safe_text(order_id), normal_style)],
+                        ['Наименование:', Paragraph(safe_text(product_name or 'Не указано'), normal_style)],
+                        ['Артикул продавца:', Paragraph(safe_text(article or 'Не указано'), normal_style)],
+                        ['Стикер:', Paragraph(safe_text(sticker or 'Не указано'), normal_style)],
                     ]
                     
                     table = Table(order_data_formatted, colWidths=[50*mm, 120*mm])
@@ -297,6 +419,7 @@ class PDFGenerator:
                         ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
                         ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
                         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                        ('FONTNAME', (0, 0), (-1, -1), unicode_font),
                         ('FONTSIZE', (0, 0), (-1, -1), 10),
                         ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
                         ('TOPPADDING', (0, 0), (-1, -1), 8),
@@ -308,9 +431,12 @@ class PDFGenerator:
                     
                     # Add separator between orders (except last one)
                     if idx < len(sorted_tasks):
-                        elements.append(Spacer(1, 15))
-                        elements.append(Paragraph("_" * 80, normal_style))
-                        elements.append(Spacer(1, 15))
+                        # Fresh flowables each time: ReportLab keeps layout state on them
+                        elements.extend((
+                            Spacer(1, 15),
+                            Paragraph("_" * 80, normal_style),
+                            Spacer(1, 15),
+                        ))
                         
                 except Exception as e:
                     logger.error(f"Error processing task {idx} (order_id={task.get('order_id', 'unknown')}): {e}")
@@ -321,6 +447,7 @@ class PDFGenerator:
             
             # Build PDF
             doc.build(elements)
+            Path(output_path).write_bytes(pdf_buffer.getvalue())
             logger.info(f"Successfully generated PDF: {output_path}")
             return True
             
@@ -361,8 +488,9 @@ class PDFGenerator:
             # SimpleDocTemplate uses a default Frame padding, which can
             # shrink the usable area and make 58x40mm images \"too large\".
             # Use BaseDocTemplate + Frame with zero paddings.
+            pdf_buffer = BytesIO()
             doc = BaseDocTemplate(
-                output_path,
+                pdf_buffer,
                 pagesize=(sticker_width, sticker_height),
                 rightMargin=0,
                 leftMargin=0,
@@ -383,38 +511,6 @@ class PDFGenerator:
             doc.addPageTemplates([PageTemplate(id="Sticker", frames=[frame])])
 
             # Sort by article like we do in chat lists (extract shelf number)
-            def extract_article_number(article: str) -> int:
-                if not article:
-                    return 999
-                article = str(article).strip()
-                if (
-                    len(article) >= 2
-                    and not article[0].isdigit()
-                    and not article[1].isdigit()
-                ):
-                    remaining = article[2:]
-                    if remaining and remaining[0].isdigit() and remaining[0] != "0":
-                        match = re.search(r"\d+", remaining)
-                        if match:
-                            number = int(match.group())
-                            if 1 <= number <= 99:
-                                return number
-                if len(article) >= 1 and not article[0].isdigit():
-                    remaining = article[1:]
-                    if remaining and remaining[0].isdigit() and remaining[0] != "0":
-                        match = re.search(r"\d+", remaining)
-                        if match:
-                            number = int(match.group())
-                            if 1 <= number <= 99:
-                                return number
-                if article and article[0].isdigit() and article[0] != "0":
-                    match = re.search(r"\d+", article)
-                    if match:
-                        number = int(match.group())
-                        if 1 <= number <= 99:
-                            return number
-                return 999
-
             sorted_stickers = sorted(
                 sticker_data,
                 key=lambda x: extract_article_number(str(x.get("article", "")).strip()),
@@ -446,6 +542,7 @@ class PDFGenerator:
                     elements.append(PageBreak())
 
             doc.build(elements)
+            Path(output_path).write_bytes(pdf_buffer.getvalue())
             logger.info(f"Successfully generated stickers PDF: {output_path}")
             return True
 
@@ -456,8 +553,7 @@ class PDFGenerator:
     def cleanup(self):
         """Cleanup temporary files"""
         try:
-            import shutil
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
+            if self._temp_dir and os.path.exists(self._temp_dir):
+                shutil.rmtree(self._temp_dir)
         except Exception as e:
             logger.warning(f"Error cleaning up temp directory: {e}")
@@ -3,19 +3,26 @@ Google Sheets Handler
 Manages all Google Sheets operations including reading API keys, 
 writing orders, and tracking processed orders
 """
+import asyncio
+import heapq
+import re
 import time
+import random
 import logging
+import shutil
+import threading
+import traceback
 import gspread
 import os
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict, Optional, Set, Any
+from operator import itemgetter
+from sys import intern
+from typing import List, Dict, Optional, Set, Any, Tuple, Iterator, Sequence
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from functools import wraps
-import io
-import requests
-from google.auth.transport.requests import Request as GoogleRequest
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import (
     GOOGLE_SHEETS_ID,
     GOOGLE_SERVICE_ACCOUNT_JSON,
@@ -25,71 +32,211 @@ from config import (
     SHEET_PROCESSED_ORDERS,
     SHEET_PRODUCTS,
     SHEET_TASKS_FOR_PDF,
+    SHEETS_CACHE_TTL,
 )
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting: Google Sheets allows 60 read requests per minute per user
-# We'll limit to ~30 requests per minute to be safe (more conservative)
-SHEETS_MIN_DELAY = 2.0  # Minimum delay between requests (seconds)
-last_request_time = 0
+# Rate limiting: Google Sheets allows 60 read and 60 write requests per minute
+# per user. Token buckets allow short bursts and only wait once tokens run out;
+# burst + refill stays within 60 requests in any minute.
+SHEETS_BURST = 10  # Requests that may go out back to back
+SHEETS_READS_PER_MINUTE = 50
+SHEETS_WRITES_PER_MINUTE = 50
 
 
-def rate_limit(func):
-    """Decorator to rate limit Google Sheets API calls"""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        global last_request_time
-        current_time = time.time()
-        time_since_last = current_time - last_request_time
-        
-        if time_since_last < SHEETS_MIN_DELAY:
-            sleep_time = SHEETS_MIN_DELAY - time_since_last
-            time.sleep(sleep_time)
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1):
+        """Take tokens, sleeping until enough have been refilled"""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def drain(self):
+        """Drop all tokens (after a 429 the quota window is known to be used up)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = 0
+
+
+_read_bucket = TokenBucket(SHEETS_READS_PER_MINUTE / 60.0, SHEETS_BURST)
+_write_bucket = TokenBucket(SHEETS_WRITES_PER_MINUTE / 60.0, SHEETS_BURST)
+
+
+SHEETS_WRITE_MAX_ATTEMPTS = 6
+SHEETS_MAX_RETRIES = 6
+SHEETS_BACKOFF_BASE = 1.0
+SHEETS_BACKOFF_MAX = 64.0
+
+
+# Tasks sheet columns A-F
+TASKS_HEADERS = ["№ задания", "Фото", "Наименование", "Артикул продавца", "Стикер", "Статус"]
+
+# TasksForPDF row 1: A1 formula for automatic image insertion + headers for columns B-F
+TASKS_FOR_PDF_HEADER_ROW = [
+    '={"Изображение";ARRAYFORMULA(IF(C2:C="";;IMAGE(C2:C;4;350;350)))}',
+    "№ задания",
+    "Фото URL",
+    "Наименование",
+    "Артикул продавца",
+    "Стикер",
+]
+
+
+def _iter_columns(rows: List[List[Any]], names: Sequence[str]) -> Iterator[Tuple[Any, ...]]:
+    """
+    Yield the named columns of each data row of a 2D values array.
+    Column positions are resolved from the header row once; cells are then
+    taken with a single itemgetter call per row instead of per-field dict lookups.
+    
+    Args:
+        rows: Values with the header in the first row
+        names: Header names to extract (unknown headers yield "")
         
-        last_request_time = time.time()
+    Yields:
+        Tuple of cell values in the order of names
+    """
+    if not rows:
+        return
+    headers = [str(h).strip() for h in rows[0]]
+    width = len(headers)
+    # Headers missing from the sheet read an extra always-empty column
+    positions = [headers.index(name) if name in headers else width for name in names]
+    reshape_all = width in positions
+    get = itemgetter(*positions) if len(positions) > 1 else (lambda row: (row[positions[0]],))
+    padding = [""] * (width + 1)
+    for row in rows[1:]:
+        # The API trims trailing empty cells, so pad short rows
+        if reshape_all or len(row) < width:
+            row = row[:width] + padding[min(len(row), width):]
+        yield get(row)
+
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    """Check whether a Sheets API error is a 429 / quota error"""
+    error_str = str(e)
+    if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "RATE_LIMIT_EXCEEDED" in error_str:
+        return True
+    
+    response = getattr(e, 'response', None)
+    # Error may carry a dict with the rate limit code
+    if isinstance(response, dict):
+        return response.get('code') == 429 or response.get('status') == 'RESOURCE_EXHAUSTED'
+    # gspread.exceptions.APIError carries the requests.Response
+    return getattr(response, 'status_code', None) == 429
+
+
+def _retry_after_seconds(e: Exception) -> float:
+    """Retry-After header of a failed Sheets response in seconds (0 if absent)"""
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _backoff_delay(e: Exception, attempt: int) -> float:
+    """
+    Seconds to wait before retrying a 429.
+    Uses the server's Retry-After if present, else exponential backoff with
+    full jitter so concurrent callers do not retry in lockstep.
+    
+    Args:
+        e: The rate limit error
+        attempt: 0-based retry number
+    """
+    retry_after = _retry_after_seconds(e)
+    if retry_after:
+        return retry_after
+    return random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt))
+
+
+def call_with_backoff(func, *args, max_attempts: int = SHEETS_WRITE_MAX_ATTEMPTS, **kwargs):
+    """
+    Call a Sheets write, retrying 429s with exponential backoff (see _backoff_delay)
+    so a throttled batch is delayed instead of lost.
+    
+    Args:
+        func: Sheets call, e.g. worksheet.append_rows
+        max_attempts: Total attempts before the error is re-raised
         
-        # Retry logic for 429 errors
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                # Check if it's a rate limit error
-                is_rate_limit = False
-                error_str = str(e)
-                
-                # Check error message
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "RATE_LIMIT_EXCEEDED" in error_str:
-                    is_rate_limit = True
-                
-                # Check if error is a dict with rate limit code
-                if hasattr(e, 'response') and isinstance(e.response, dict):
-                    if e.response.get('code') == 429 or e.response.get('status') == 'RESOURCE_EXHAUSTED':
-                        is_rate_limit = True
-                
-                if is_rate_limit:
-                    if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 5  # Exponential backoff
-                        logger.warning(
-                            f"Rate limit hit for {func.__name__}. "
-                            f"Waiting {wait_time}s before retry "
-                            f"{attempt + 1}/{max_retries}"
-                        )
-                        time.sleep(wait_time)
-                        last_request_time = time.time()
-                        continue
+    Returns:
+        Result of func
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not _is_rate_limit_error(e) or attempt == max_attempts:
+                raise
+            wait_time = _backoff_delay(e, attempt)
+            logger.warning(
+                f"Rate limit hit for {getattr(func, '__name__', 'sheets call')}. "
+                f"Waiting {wait_time:.1f}s before retry {attempt}/{max_attempts - 1}"
+            )
+            time.sleep(wait_time)
+
+
+def _rate_limited(bucket: TokenBucket):
+    """Build a decorator that takes a token from `bucket` per Sheets call"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Retry logic for 429 errors
+            max_retries = SHEETS_MAX_RETRIES
+            for attempt in range(max_retries):
+                bucket.acquire()
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if _is_rate_limit_error(e):
+                        if attempt < max_retries - 1:
+                            # Quota window is exhausted: empty the bucket so other
+                            # callers wait too
+                            bucket.drain()
+                            wait_time = _backoff_delay(e, attempt)
+                            logger.warning(
+                                f"Rate limit hit for {func.__name__}. "
+                                f"Waiting {wait_time:.1f}s before retry "
+                                f"{attempt + 1}/{max_retries}"
+                            )
+                            time.sleep(wait_time)
+                            continue
+                        else:
+                            logger.error(
+                                f"Rate limit exceeded for {func.__name__} "
+                                f"after {max_retries} retries"
+                            )
+                            raise
                     else:
-                        logger.error(
-                            f"Rate limit exceeded for {func.__name__} "
-                            f"after {max_retries} retries"
-                        )
+                        # Not a rate limit error, re-raise immediately
                         raise
-                else:
-                    # Not a rate limit error, re-raise immediately
-                    raise
-        return None
-    return wrapper
+            return None
+        return wrapper
+    return decorator
+
+
+# Decorators to rate limit Google Sheets API reads / writes
+rate_limit = _rate_limited(_read_bucket)
+rate_limit_write = _rate_limited(_write_bucket)
 
 
 class SheetsHandler:
@@ -106,16 +253,35 @@ class SheetsHandler:
                 GOOGLE_SERVICE_ACCOUNT_JSON, scopes=scope
             )
             self.client = gspread.authorize(creds)
+            # gspread talks through one AuthorizedSession (a requests.Session that
+            # refreshes the token itself); widen its pool so concurrent reads from
+            # worker threads reuse kept-alive TLS connections
+            self.session = self.client.session
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, pool_block=False)
+            self.session.mount("https://", adapter)
+            # PDF exports (Drive API and direct URL) retry transient errors at the
+            # connection level; Sheets API calls keep their own backoff
+            # (longest mount prefix wins)
+            export_retry = Retry(
+                total=3,
+                backoff_factor=2,
+                status_forcelist=[429, 500, 502, 503, 504],
+            )
+            export_adapter = HTTPAdapter(pool_maxsize=4, max_retries=export_retry)
+            self.session.mount("https://www.googleapis.com/drive/", export_adapter)
+            self.session.mount("https://docs.google.com/", export_adapter)
             self.spreadsheet = self.client.open_by_key(GOOGLE_SHEETS_ID)
-            # Initialize Google Drive API for PDF export with increased timeout
-            # Create HTTP object with longer timeout
-            import google_auth_httplib2
-            import httplib2
-            http = httplib2.Http(timeout=300)  # 5 minutes timeout
-            http = google_auth_httplib2.AuthorizedHttp(creds, http=http)
-            # Use only http (not credentials) since http is already authorized
-            self.drive_service = build('drive', 'v3', http=http)
             self.creds = creds  # Store for direct URL access
+            # Read cache: A1 range -> (fetched_at, 2D values)
+            self._cache: Dict[str, Tuple[float, Any]] = {}
+            # Bumped by _invalidate; a fetch that overlaps a write is not cached
+            self._cache_generation = 0
+            # Parsed results: name -> (source rows objects, value); see _derived
+            self._derived_cache: Dict[str, Tuple[Tuple[Any, ...], Any]] = {}
+            # Sheets whose header row is known to be in place
+            self._headers_ok: Set[str] = set()
+            # Tasks column A index: order_id -> sheet row (loaded on first use)
+            self._tasks_index: Optional[Dict[str, int]] = None
             logger.info(f"Successfully connected to Google Sheet: {GOOGLE_SHEETS_ID}")
             
             # Ensure required sheets exist
@@ -126,35 +292,30 @@ class SheetsHandler:
 
     def _ensure_sheets_exist(self):
         """Ensure all required sheets exist, create if missing"""
-        existing_sheets = [sheet.title for sheet in self.spreadsheet.worksheets()]
+        self._refresh_worksheets()
+        existing_sheets = list(self._ws)
         
         # Create Tasks sheet if it doesn't exist
         if SHEET_TASKS not in existing_sheets:
-            self.spreadsheet.add_worksheet(
+            task_sheet = self.spreadsheet.add_worksheet(
                 title=SHEET_TASKS,
                 rows=1000,
                 cols=10,
             )
-            task_sheet = self.spreadsheet.worksheet(SHEET_TASKS)
+            self._ws[SHEET_TASKS] = task_sheet
             # Set headers in row 1 (A1-F1)
-            task_sheet.update("A1:F1", [[
-                "№ задания",
-                "Фото",
-                "Наименование",
-                "Артикул продавца",
-                "Стикер",
-                "Статус",
-            ]], value_input_option='USER_ENTERED')
+            task_sheet.update("A1:F1", [TASKS_HEADERS], value_input_option='USER_ENTERED')
+            self._headers_ok.add(SHEET_TASKS)
             logger.info(f"Created sheet: {SHEET_TASKS}")
         
         # Create ProcessedOrders sheet if it doesn't exist
         if SHEET_PROCESSED_ORDERS not in existing_sheets:
-            self.spreadsheet.add_worksheet(
+            processed_sheet = self.spreadsheet.add_worksheet(
                 title=SHEET_PROCESSED_ORDERS,
                 rows=1000,
                 cols=10,
             )
-            processed_sheet = self.spreadsheet.worksheet(SHEET_PROCESSED_ORDERS)
+            self._ws[SHEET_PROCESSED_ORDERS] = processed_sheet
             # Set headers
             processed_sheet.append_row([
                 "Order ID",
@@ -166,12 +327,12 @@ class SheetsHandler:
         
         # Create Products sheet if it doesn't exist
         if SHEET_PRODUCTS not in existing_sheets:
-            self.spreadsheet.add_worksheet(
+            products_sheet = self.spreadsheet.add_worksheet(
                 title=SHEET_PRODUCTS,
                 rows=1000,
                 cols=10,
             )
-            products_sheet = self.spreadsheet.worksheet(SHEET_PRODUCTS)
+            self._ws[SHEET_PRODUCTS] = products_sheet
             # Set headers in row 1 (A1-C1)
             products_sheet.update("A1:C1", [[
                 "Артикул продавца",
@@ -182,29 +343,119 @@ class SheetsHandler:
         
         # Create TasksForPDF sheet if it doesn't exist
         if SHEET_TASKS_FOR_PDF not in existing_sheets:
-            self.spreadsheet.add_worksheet(
+            pdf_sheet = self.spreadsheet.add_worksheet(
                 title=SHEET_TASKS_FOR_PDF,
                 rows=1000,
                 cols=10,
             )
-            pdf_sheet = self.spreadsheet.worksheet(SHEET_TASKS_FOR_PDF)
+            self._ws[SHEET_TASKS_FOR_PDF] = pdf_sheet
             
-            # Set formula in A1 for automatic image insertion
-            # Formula: ={"Изображение";ARRAYFORMULA(IF(C2:C="";;IMAGE(C2:C;4;350;350)))}
-            formula = '={"Изображение";ARRAYFORMULA(IF(C2:C="";;IMAGE(C2:C;4;350;350)))}'
-            pdf_sheet.update("A1", [[formula]], value_input_option='USER_ENTERED')
-            
-            # Set headers in row 1 for columns B-F
-            pdf_sheet.update("B1:F1", [[
-                "№ задания",
-                "Фото URL",
-                "Наименование",
-                "Артикул продавца",
-                "Стикер",
-            ]], value_input_option='USER_ENTERED')
+            # Set A1 image formula and B-F headers in one write
+            pdf_sheet.update("A1:F1", [TASKS_FOR_PDF_HEADER_ROW], value_input_option='USER_ENTERED')
             
             logger.info(f"Created sheet: {SHEET_TASKS_FOR_PDF} with image formula")
 
+    def _refresh_worksheets(self):
+        """Reload the title -> Worksheet map (one metadata request)"""
+        self._ws = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+
+    def get_worksheet(self, name: str) -> gspread.Worksheet:
+        """
+        Get a worksheet by title without a metadata request per call.
+        The map is filled once at startup and reloaded only on a miss.
+        
+        Args:
+            name: Sheet title
+            
+        Returns:
+            gspread Worksheet
+            
+        Raises:
+            gspread.exceptions.WorksheetNotFound: If no sheet has this title
+        """
+        ws = self._ws.get(name)
+        if ws is None:
+            self._refresh_worksheets()
+            ws = self._ws.get(name)
+            if ws is None:
+                raise gspread.exceptions.WorksheetNotFound(name)
+        return ws
+
+    def _batch_get(self, ranges: List[str]) -> List[List[List[Any]]]:
+        """
+        Read several ranges with one values.batchGet request.
+        Ranges fetched less than SHEETS_CACHE_TTL seconds ago are served from
+        memory; only a real fetch is rate limited.
+        
+        Args:
+            ranges: A1 ranges, e.g. ["Access!A:Z", "WB!A:Z"]
+            
+        Returns:
+            2D value arrays in the same order as ranges (empty list for empty ranges)
+        """
+        now = time.time()
+        cached = [self._cache.get(r) for r in ranges]
+        if all(entry and now - entry[0] < SHEETS_CACHE_TTL for entry in cached):
+            return [entry[1] for entry in cached]
+        
+        generation = self._cache_generation
+        values = self._fetch_ranges(ranges)
+        if generation != self._cache_generation:
+            # A write finished while we were reading: the values may predate it
+            return values
+        fetched_at = time.time()
+        for r, v in zip(ranges, values):
+            self._cache[r] = (fetched_at, v)
+        return values
+
+    @rate_limit
+    def _fetch_ranges(self, ranges: List[str]) -> List[List[List[Any]]]:
+        """Fetch ranges from the Sheets API (no cache)"""
+        response = self.spreadsheet.values_batch_get(
+            ranges=ranges,
+            params={"valueRenderOption": "UNFORMATTED_VALUE"},
+        )
+        value_ranges = response.get("valueRanges", [])
+        return [vr.get("values", []) for vr in value_ranges]
+
+    def _invalidate(self, *sheet_names: str):
+        """
+        Drop cached ranges of the given sheets after a write.
+        Called once the write request has returned (or failed), so a concurrent
+        read cannot re-cache the pre-write values.
+        """
+        self._cache_generation += 1
+        prefixes = tuple(f"{name}!" for name in sheet_names)
+        for key in [k for k in list(self._cache) if k.startswith(prefixes)]:
+            self._cache.pop(key, None)
+
+    def _derived(self, name: str, sources: Tuple[Any, ...], build):
+        """
+        Reuse a value built from cached sheet rows until those rows are refetched.
+        _batch_get returns the same list objects while a range is cached, so an
+        identity check is enough to tell whether the rows changed.
+        
+        Args:
+            name: Cache key of the derived value
+            sources: Row lists the value is built from
+            build: Called with *sources on a miss
+            
+        Returns:
+            The shared value (callers must not modify it)
+        """
+        entry = self._derived_cache.get(name)
+        if entry is not None and len(entry[0]) == len(sources) and all(
+            old is new for old, new in zip(entry[0], sources)
+        ):
+            return entry[1]
+        value = build(*sources)
+        self._derived_cache[name] = (sources, value)
+        return value
+
+    def _get_rows(self, sheet_name: str) -> List[List[Any]]:
+        """Read a whole sheet (header row first) with a single values request"""
+        return self._batch_get([f"{sheet_name}!A:Z"])[0]
+
     @rate_limit
     def log_user_contact(self, chat_id: int, username: str = "",
                          first_name: str = ""):
@@ -214,17 +465,16 @@ class SheetsHandler:
         """
         sheet_name = "Users"
         try:
-            existing = [s.title for s in self.spreadsheet.worksheets()]
-            if sheet_name not in existing:
-                self.spreadsheet.add_worksheet(
+            try:
+                ws = self.get_worksheet(sheet_name)
+            except gspread.exceptions.WorksheetNotFound:
+                ws = self.spreadsheet.add_worksheet(
                     title=sheet_name, rows=1000, cols=5)
-                ws = self.spreadsheet.worksheet(sheet_name)
+                self._ws[sheet_name] = ws
                 ws.update("A1:D1", [[
                     "Chat_id", "Username", "Имя", "Дата",
                 ]], value_input_option='USER_ENTERED')
                 logger.info(f"Created sheet: {sheet_name}")
-            else:
-                ws = self.spreadsheet.worksheet(sheet_name)
 
             try:
                 cell = ws.find(str(chat_id), in_column=1)
@@ -233,7 +483,6 @@ class SheetsHandler:
             except Exception:
                 pass
 
-            from datetime import datetime
             values = ws.col_values(1)
             next_row = len(values) + 1 if len(values) >= 1 else 2
             ws.update(f"A{next_row}:D{next_row}", [[
@@ -248,7 +497,6 @@ class SheetsHandler:
         except Exception as e:
             logger.error(f"Error logging user contact: {e}")
 
-    @rate_limit
     def get_warehouse_api_keys(self) -> List[Dict[str, str]]:
         """
         Read warehouse and API key information from WB sheet
@@ -257,34 +505,58 @@ class SheetsHandler:
             List of dictionaries with keys: city, warehouse, api_key
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_WB)
-            records = sheet.get_all_records()
-            
-            result = []
-            for record in records:
-                city_raw = record.get("Город", "")
-                city = str(city_raw).strip() if city_raw else ""
-                
-                warehouse_raw = record.get("Название склада", "")
-                warehouse = str(warehouse_raw).strip() if warehouse_raw else ""
-                
-                api_key_raw = record.get("API_KEY", "")
-                api_key = str(api_key_raw).strip() if api_key_raw else ""
-                
-                if warehouse and api_key:
-                    result.append({
-                        "city": city,
-                        "warehouse": warehouse,
-                        "api_key": api_key,
-                    })
-            
-            logger.info(f"Loaded {len(result)} warehouse API keys from sheet")
-            return result
+            return self._derived(
+                "warehouse_api_keys", (self._get_rows(SHEET_WB),), self._parse_warehouse_api_keys
+            )
         except Exception as e:
             logger.error(f"Error reading warehouse API keys: {e}")
             return []
 
-    @rate_limit
+    def get_warehouse_index(self) -> Dict[str, Dict[str, str]]:
+        """
+        Index of the WB sheet by warehouse name (first row wins, like a scan)
+        
+        Returns:
+            Dictionary mapping warehouse name to {city, warehouse, api_key}
+        """
+        try:
+            return self._derived(
+                "warehouse_index", (self._get_rows(SHEET_WB),), self._build_warehouse_index
+            )
+        except Exception as e:
+            logger.error(f"Error reading warehouse API keys: {e}")
+            return {}
+
+    @classmethod
+    def _build_warehouse_index(cls, rows: List[List[Any]]) -> Dict[str, Dict[str, str]]:
+        """Build warehouse -> WB sheet entry from WB sheet values"""
+        index = {}
+        for item in cls._parse_warehouse_api_keys(rows):
+            index.setdefault(item["warehouse"], item)
+        return index
+
+    @staticmethod
+    def _parse_warehouse_api_keys(rows: List[List[Any]]) -> List[Dict[str, str]]:
+        """Build city/warehouse/api_key entries from WB sheet values"""
+        result = []
+        columns = ("Город", "Название склада", "API_KEY")
+        for city_raw, warehouse_raw, api_key_raw in _iter_columns(rows, columns):
+            city = str(city_raw).strip() if city_raw else ""
+            
+            warehouse = str(warehouse_raw).strip() if warehouse_raw else ""
+            
+            api_key = str(api_key_raw).strip() if api_key_raw else ""
+            
+            if warehouse and api_key:
+                result.append({
+                    "city": city,
+                    "warehouse": warehouse,
+                    "api_key": api_key,
+                })
+        
+        logger.info(f"Loaded {len(result)} warehouse API keys from sheet")
+        return result
+
     def get_warehouse_access(self) -> Dict[str, List[int]]:
         """
         Read warehouse access permissions from Access sheet
@@ -293,44 +565,42 @@ class SheetsHandler:
             Dictionary mapping warehouse name to list of chat_ids
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_ACCESS)
-            records = sheet.get_all_records()
-            
-            result = {}
-            for record in records:
-                warehouse_raw = record.get("Название склада", "")
-                warehouse = str(warehouse_raw).strip() if warehouse_raw else ""
-                
-                chat_id_raw = record.get("Chat_id", "")
-                # Handle both string and integer values from Google Sheets
-                if isinstance(chat_id_raw, (int, float)):
-                    chat_id = int(chat_id_raw)
-                else:
-                    chat_id_str = str(chat_id_raw).strip() if chat_id_raw else ""
-                    if not chat_id_str:
-                        continue
-                    try:
-                        chat_id = int(chat_id_str)
-                    except (ValueError, TypeError):
-                        logger.warning(
-                            f"Invalid chat_id '{chat_id_raw}' for warehouse "
-                            f"'{warehouse}'"
-                        )
-                        continue
-                
-                if warehouse and chat_id:
-                    if warehouse not in result:
-                        result[warehouse] = []
-                    # Avoid adding duplicate chat_ids to the same warehouse
-                    if chat_id not in result[warehouse]:
-                        result[warehouse].append(chat_id)
-            
-            logger.info(f"Loaded access for {len(result)} warehouses")
-            return result
+            return self._derived(
+                "warehouse_access", (self._get_rows(SHEET_ACCESS),), self._parse_warehouse_access
+            )
         except Exception as e:
             logger.error(f"Error reading warehouse access: {e}")
             return {}
 
+    @staticmethod
+    def _parse_warehouse_access(rows: List[List[Any]]) -> Dict[str, List[int]]:
+        """Build warehouse -> chat_ids mapping from Access sheet values"""
+        result = defaultdict(set)  # sets dedupe chat_ids per warehouse
+        for warehouse_raw, chat_id_raw in _iter_columns(rows, ("Название склада", "Chat_id")):
+            warehouse = str(warehouse_raw).strip() if warehouse_raw else ""
+            
+            # Handle both string and integer values from Google Sheets
+            if isinstance(chat_id_raw, (int, float)):
+                chat_id = int(chat_id_raw)
+            else:
+                chat_id_str = str(chat_id_raw).strip() if chat_id_raw else ""
+                if not chat_id_str:
+                    continue
+                try:
+                    chat_id = int(chat_id_str)
+                except (ValueError, TypeError):
+                    logger.warning(
+                        f"Invalid chat_id '{chat_id_raw}' for warehouse "
+                        f"'{warehouse}'"
+                    )
+                    continue
+            
+            if warehouse and chat_id:
+                result[warehouse].add(chat_id)
+        
+        logger.info(f"Loaded access for {len(result)} warehouses")
+        return {warehouse: sorted(chat_ids) for warehouse, chat_ids in result.items()}
+
     def get_user_access(self) -> Dict[int, Dict[str, List[str]]]:
         """
         Get user access organized by chat_id
@@ -339,36 +609,74 @@ class SheetsHandler:
             Dictionary mapping chat_id to dict with cities and warehouses
             Structure: {chat_id: {"cities": [...], "warehouses": [...]}}
         """
-        warehouse_access = self.get_warehouse_access()
-        warehouse_api_keys = self.get_warehouse_api_keys()
+        # Access and WB sheets are read with a single batchGet; every callback
+        # checks access, so the result is rebuilt only when the rows were refetched
+        try:
+            access_rows, wb_rows = self._batch_get(
+                [f"{SHEET_ACCESS}!A:Z", f"{SHEET_WB}!A:Z"]
+            )
+            return self._derived("user_access", (access_rows, wb_rows), self._build_user_access)
+        except Exception as e:
+            logger.error(f"Error reading user access: {e}")
+            return {}
+
+    @classmethod
+    def _build_user_access(
+        cls, access_rows: List[List[Any]], wb_rows: List[List[Any]]
+    ) -> Dict[int, Dict[str, List[str]]]:
+        """Build chat_id -> {cities, warehouses} from Access and WB sheet values"""
+        warehouse_access = cls._parse_warehouse_access(access_rows)
+        warehouse_api_keys = cls._parse_warehouse_api_keys(wb_rows)
         
         # Create warehouse -> city mapping
-        warehouse_to_city = {}
-        for item in warehouse_api_keys:
-            warehouse_to_city[item["warehouse"]] = item["city"]
+        warehouse_to_city = {item["warehouse"]: item["city"] for item in warehouse_api_keys}
         
-        # Organize by chat_id (support multiple warehouses per user)
-        result = {}
+        # Organize by chat_id (support multiple warehouses per user; sets avoid duplicates)
+        access = defaultdict(lambda: {"cities": set(), "warehouses": set()})
         for warehouse, chat_ids in warehouse_access.items():
             city = warehouse_to_city.get(warehouse, "")
             for chat_id in chat_ids:
-                if chat_id not in result:
-                    result[chat_id] = {
-                        "cities": set(),
-                        "warehouses": set(),  # Use set to avoid duplicates
-                    }
-                result[chat_id]["warehouses"].add(warehouse)
+                user = access[chat_id]
+                user["warehouses"].add(warehouse)
                 if city:
-                    result[chat_id]["cities"].add(city)
+                    user["cities"].add(city)
         
         # Convert sets to sorted lists
-        for chat_id in result:
-            result[chat_id]["cities"] = sorted(list(result[chat_id]["cities"]))
-            result[chat_id]["warehouses"] = sorted(list(result[chat_id]["warehouses"]))
-        
-        return result
+        return {
+            chat_id: {
+                "cities": sorted(user["cities"]),
+                "warehouses": sorted(user["warehouses"]),
+            }
+            for chat_id, user in access.items()
+        }
+
+    # Async variants for bot handlers: run the blocking read in a worker thread
+    # so the event loop keeps serving other updates during the HTTP round trip
+
+    async def aget_user_access(self) -> Dict[int, Dict[str, List[str]]]:
+        """Async get_user_access"""
+        return await asyncio.to_thread(self.get_user_access)
+
+    async def aget_warehouse_api_keys(self) -> List[Dict[str, str]]:
+        """Async get_warehouse_api_keys"""
+        return await asyncio.to_thread(self.get_warehouse_api_keys)
+
+    async def aget_warehouse_index(self) -> Dict[str, Dict[str, str]]:
+        """Async get_warehouse_index"""
+        return await asyncio.to_thread(self.get_warehouse_index)
+
+    async def aget_products_map(self) -> Dict[str, Dict[str, str]]:
+        """Async get_products_map"""
+        return await asyncio.to_thread(self.get_products_map)
+
+    async def aget_processed_order_warehouses(self) -> Dict[str, str]:
+        """Async get_processed_order_warehouses"""
+        return await asyncio.to_thread(self.get_processed_order_warehouses)
+
+    async def aget_warehouse_access(self) -> Dict[str, List[int]]:
+        """Async get_warehouse_access"""
+        return await asyncio.to_thread(self.get_warehouse_access)
 
-    @rate_limit
     def get_processed_order_ids(self) -> Set[str]:
         """
         Get set of all processed order IDs from ProcessedOrders sheet
@@ -377,21 +685,14 @@ class SheetsHandler:
             Set of order ID strings
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_PROCESSED_ORDERS)
-            
-            # Check if sheet has data (more than header row)
-            if sheet.row_count <= 1:
+            # One values.batchGet on column A (Order ID): no worksheet metadata
+            # fetch, no possibly stale row_count check, no per-row dicts
+            rows = self._batch_get([f"{SHEET_PROCESSED_ORDERS}!A2:A"])[0]
+            if not rows:
                 logger.debug("ProcessedOrders sheet is empty")
                 return set()
             
-            records = sheet.get_all_records()
-            
-            processed_ids = set()
-            for record in records:
-                order_id_raw = record.get("Order ID", "")
-                order_id = str(order_id_raw).strip() if order_id_raw else ""
-                if order_id:
-                    processed_ids.add(order_id)
+            processed_ids = {str(row[0]).strip() for row in rows if row and str(row[0]).strip()}
             
             logger.info(f"Loaded {len(processed_ids)} processed order IDs")
             return processed_ids
@@ -399,33 +700,97 @@ class SheetsHandler:
             logger.error(f"Error reading processed orders: {e}")
             return set()
 
+    def get_processed_order_warehouses(self) -> Dict[str, str]:
+        """
+        Map processed order IDs to their warehouse (ProcessedOrders columns A-B)
+        
+        Returns:
+            Dictionary mapping order ID string to warehouse name
+        """
+        try:
+            # Rows come from the read cache; the dict is built once per fetch
+            # instead of once per looked-up order
+            rows = self._batch_get([f"{SHEET_PROCESSED_ORDERS}!A2:B"])[0]
+            return self._derived(
+                "processed_order_warehouses", (rows,), self._build_processed_order_warehouses
+            )
+        except Exception as e:
+            logger.error(f"Error reading processed order warehouses: {e}")
+            return {}
+
+    @staticmethod
+    def _build_processed_order_warehouses(rows: List[List[Any]]) -> Dict[str, str]:
+        """Build order ID -> warehouse from ProcessedOrders A:B values"""
+        return {
+            str(row[0]).strip(): str(row[1]).strip()
+            for row in rows
+            if len(row) > 1 and str(row[0]).strip()
+        }
+
     @rate_limit
-    def mark_order_processed(self, order_id: int, warehouse: str, api_key: str):
+    def get_processed_orders_tail(self, start_row: int) -> Optional[List[List[str]]]:
         """
-        Mark an order as processed in ProcessedOrders sheet
+        Read ProcessedOrders rows from start_row to the end of the sheet
         
         Args:
-            order_id: Order ID
-            warehouse: Warehouse name
-            api_key: API key used (first 20 chars for privacy)
+            start_row: First sheet row to read (1-based, row 1 is the header)
+            
+        Returns:
+            List of [Order ID, Warehouse] rows (short or empty rows as read),
+            or None if the read failed (so callers can tell it from an empty tail)
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_PROCESSED_ORDERS)
-            
-            # Truncate API key for privacy
-            api_key_short = api_key[:20] + "..." if len(api_key) > 20 else api_key
-            
-            sheet.append_row([
-                str(order_id),
-                warehouse,
-                api_key_short,
-                datetime.now().isoformat(),
-            ])
-            logger.debug(f"Marked order {order_id} as processed")
+            sheet = self.get_worksheet(SHEET_PROCESSED_ORDERS)
+            return sheet.get(f"A{start_row}:B")
         except Exception as e:
-            logger.error(f"Error marking order as processed: {e}")
+            logger.error(f"Error reading ProcessedOrders from row {start_row}: {e}")
+            return None
+
+    @staticmethod
+    def _processed_row(order_id: int, warehouse: str, api_key: str) -> List[str]:
+        """Build a ProcessedOrders row: Order ID, Warehouse, API Key, Processed Date"""
+        # Truncate API key for privacy
+        api_key_short = api_key[:20] + "..." if len(api_key) > 20 else api_key
+        return [
+            str(order_id),
+            warehouse,
+            api_key_short,
+            datetime.now().isoformat(),
+        ]
+
+    def _ensure_tasks_headers(self, sheet: gspread.Worksheet):
+        """Write Tasks headers if row 1 is incomplete; reads row 1 only on the first call"""
+        if SHEET_TASKS in self._headers_ok:
+            return
+        header_row = sheet.row_values(1)
+        if not header_row or len(header_row) < 6:
+            # Write headers in row 1
+            sheet.update("A1:F1", [TASKS_HEADERS], value_input_option='USER_ENTERED')
+        self._headers_ok.add(SHEET_TASKS)
+
+    @staticmethod
+    def _index_task_rows(values: List[str]) -> Dict[str, int]:
+        """Map order IDs from Tasks column A values to their sheet rows (header skipped)"""
+        index = {}
+        for row, value in enumerate(values[1:], start=2):
+            order_id = str(value).strip()
+            if order_id:
+                index[order_id] = row
+        return index
 
     @rate_limit
+    def _load_tasks_index(self) -> Dict[str, int]:
+        """Read Tasks column A once and rebuild the order_id -> row index"""
+        values = self.get_worksheet(SHEET_TASKS).col_values(1)
+        self._tasks_index = self._index_task_rows(values)
+        return self._tasks_index
+
+    def _get_tasks_index(self) -> Dict[str, int]:
+        """Tasks order_id -> row index, loading it on first use"""
+        if self._tasks_index is None:
+            return self._load_tasks_index()
+        return self._tasks_index
+
     def order_exists_in_tasks(self, order_id: int) -> bool:
         """
         Check if an order already exists in Tasks sheet
@@ -437,19 +802,31 @@ class SheetsHandler:
             True if order exists, False otherwise
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
-            # Check if order ID exists in column A
-            try:
-                cell = sheet.find(str(order_id), in_column=1)
-                return cell is not None
-            except gspread.exceptions.CellNotFound:
-                return False
+            # Local index of column A, kept up to date by our own writes
+            return str(order_id).strip() in self._get_tasks_index()
         except Exception as e:
             logger.error(f"Error checking if order exists in Tasks: {e}")
             # If error, assume it doesn't exist to avoid skipping valid orders
             return False
 
     @rate_limit
+    def get_existing_task_order_ids(self) -> Set[str]:
+        """
+        Get set of all order IDs present in Tasks sheet (column A)
+        
+        Returns:
+            Set of order ID strings
+        """
+        try:
+            sheet = self.get_worksheet(SHEET_TASKS)
+            values = sheet.col_values(1)
+            # Fresh column read: also resync the local row index
+            self._tasks_index = self._index_task_rows(values)
+            return set(self._tasks_index)
+        except Exception as e:
+            logger.error(f"Error reading order IDs from Tasks: {e}")
+            return set()
+
     def add_order_to_tasks(
         self,
         order_id: int,
@@ -468,51 +845,97 @@ class SheetsHandler:
             article: Seller article/vendor code
             sticker: Sticker string (partA + partB)
         """
+        # Same dedup-and-append path as batches: one write, no extra reads
+        self.add_orders_to_tasks_batch([{
+            "order_id": order_id,
+            "photo_url": photo_url or "",
+            "product_name": product_name or "",
+            "article": article or "",
+            "sticker": sticker or "",
+        }])
+
+    @rate_limit_write
+    def process_orders(self, orders: List[Dict[str, Any]]) -> bool:
+        """
+        Add orders to Tasks and mark them processed with one spreadsheets.batchUpdate
+        for the whole list (one write against the per-minute quota)
+        
+        Args:
+            orders: List of order dictionaries with keys:
+                   order_id, warehouse, api_key, photo_url, product_name, article, sticker
+            
+        Returns:
+            True if written (or nothing to write), False on error
+        """
+        if not orders:
+            return True
+        
         try:
-            # Check if order already exists to prevent duplicates
-            if self.order_exists_in_tasks(order_id):
-                logger.warning(f"Order {order_id} already exists in Tasks sheet, skipping")
-                return
+            tasks_index = self._get_tasks_index()
+            next_row = max(tasks_index.values(), default=1) + 1
+            new_task_rows: Dict[str, int] = {}
+            tasks_rows = []
+            processed_rows = []
             
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
+            for order in orders:
+                order_id = order["order_id"]
+                order_key = str(order_id)
+                if order_key in tasks_index or order_key in new_task_rows:
+                    logger.warning(f"Order {order_id} already exists in Tasks sheet, skipping Tasks row")
+                else:
+                    # Tasks row as add_order_to_tasks writes it (Status defaults to "new")
+                    tasks_values = [
+                        {"numberValue": int(order_id)} if order_key.isdigit()
+                        else {"stringValue": order_key},
+                        {"stringValue": order.get("photo_url") or ""},
+                        {"stringValue": order.get("product_name") or ""},
+                        {"stringValue": order.get("article") or ""},
+                        {"stringValue": order.get("sticker") or ""},
+                        {"stringValue": "new"},
+                    ]
+                    tasks_rows.append({"values": [{"userEnteredValue": v} for v in tasks_values]})
+                    new_task_rows[order_key] = next_row
+                    next_row += 1
+                
+                processed_rows.append({
+                    "values": [
+                        {"userEnteredValue": {"stringValue": v}}
+                        for v in self._processed_row(order_id, order["warehouse"], order["api_key"])
+                    ]
+                })
             
-            # Ensure headers exist in row 1 (A1-F1)
-            header_row = sheet.row_values(1)
-            if not header_row or len(header_row) < 6:
-                # Write headers in row 1
-                sheet.update("A1:F1", [[
-                    "№ задания",
-                    "Фото",
-                    "Наименование",
-                    "Артикул продавца",
-                    "Стикер",
-                    "Статус",
-                ]], value_input_option='USER_ENTERED')
+            requests_body = []
+            if tasks_rows:
+                self._ensure_tasks_headers(self.get_worksheet(SHEET_TASKS))
+                requests_body.append({
+                    "appendCells": {
+                        "sheetId": self.get_worksheet(SHEET_TASKS).id,
+                        "rows": tasks_rows,
+                        "fields": "userEnteredValue",
+                    }
+                })
+            requests_body.append({
+                "appendCells": {
+                    "sheetId": self.get_worksheet(SHEET_PROCESSED_ORDERS).id,
+                    "rows": processed_rows,
+                    "fields": "userEnteredValue",
+                }
+            })
             
-            # Find next empty row by checking column A (starting from row 2)
-            values = sheet.col_values(1)  # Get all values in column A
-            # If only header exists, next_row is 2, otherwise it's len(values) + 1
-            if len(values) <= 1:
-                next_row = 2
-            else:
-                next_row = len(values) + 1
+            self.spreadsheet.batch_update({"requests": requests_body})
             
-            # Write data in columns A-F starting from row 2 (Status defaults to "new")
-            range_name = f"A{next_row}:F{next_row}"
-            sheet.update(range_name, [[
-                str(order_id),
-                photo_url or "",
-                product_name or "",
-                article or "",
-                sticker or "",
-                "new",  # Default status
-            ]], value_input_option='USER_ENTERED')
-            logger.info(f"Added order {order_id} to Tasks sheet (row {next_row})")
+            tasks_index.update(new_task_rows)
+            if new_task_rows:
+                logger.info(f"Added {len(new_task_rows)} orders to Tasks sheet")
+            logger.debug(f"Marked {len(processed_rows)} orders as processed")
+            return True
         except Exception as e:
-            logger.error(f"Error adding order to Tasks sheet: {e}")
-            raise
+            logger.error(f"Error recording {len(orders)} orders to Google Sheets: {e}")
+            return False
+        finally:
+            self._invalidate(SHEET_TASKS, SHEET_PROCESSED_ORDERS)
 
-    @rate_limit
+    @rate_limit_write
     def add_orders_to_tasks_batch(
         self,
         orders: List[Dict[str, Any]],
@@ -533,49 +956,23 @@ class SheetsHandler:
                 logger.info("No orders to add to Tasks sheet")
                 return
             
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
-            
-            # Ensure headers exist in row 1 (A1-F1)
-            header_row = sheet.row_values(1)
-            if not header_row or len(header_row) < 6:
-                # Write headers in row 1
-                sheet.update("A1:F1", [[
-                    "№ задания",
-                    "Фото",
-                    "Наименование",
-                    "Артикул продавца",
-                    "Стикер",
-                    "Статус",
-                ]], value_input_option='USER_ENTERED')
+            sheet = self.get_worksheet(SHEET_TASKS)
             
-            # Get existing order IDs to avoid duplicates
-            existing_order_ids = set()
-            try:
-                existing_values = sheet.col_values(1)  # Column A has order IDs
-                # Skip header (row 1), get all order IDs
-                for value in existing_values[1:]:
-                    try:
-                        existing_order_ids.add(int(value))
-                    except (ValueError, TypeError):
-                        continue
-            except Exception as e:
-                logger.warning(f"Error reading existing order IDs: {e}")
+            # Ensure headers exist in row 1 (A1-F1), checked once per process
+            self._ensure_tasks_headers(sheet)
             
-            # Filter out orders that already exist
-            new_orders = []
-            for order in orders:
-                order_id = order.get('order_id')
-                if order_id and int(order_id) not in existing_order_ids:
-                    new_orders.append(order)
+            # Existing order IDs from the local Tasks index (column A is read
+            # only when the index is cold), to avoid duplicates
+            tasks_index = self._get_tasks_index()
+            new_orders = [
+                order for order in orders
+                if order.get('order_id') and str(order['order_id']).strip() not in tasks_index
+            ]
             
             if not new_orders:
                 logger.info(f"All {len(orders)} orders already exist in Tasks sheet, skipping")
                 return
             
-            # Find starting row for batch insert
-            values = sheet.col_values(1)
-            start_row = len(values) + 1 if len(values) > 1 else 2
-            
             # Prepare batch data (columns A-F)
             rows_to_write = []
             for order in new_orders:
@@ -588,18 +985,37 @@ class SheetsHandler:
                     'new',  # Default status
                 ])
             
-            # Write all rows in one batch update
+            # Append all rows in one values.append: Sheets picks the insertion row
+            # and reports it back, so no column read is needed
             if rows_to_write:
-                end_row = start_row + len(rows_to_write) - 1
-                range_name = f"A{start_row}:F{end_row}"
-                sheet.update(range_name, rows_to_write, value_input_option='USER_ENTERED')
-                logger.info(f"Added {len(rows_to_write)} orders to Tasks sheet in batch (rows {start_row}-{end_row})")
+                response = sheet.append_rows(
+                    rows_to_write,
+                    value_input_option='USER_ENTERED',
+                    insert_data_option='INSERT_ROWS',
+                    table_range='A1',
+                )
+                updated_range = response.get("updates", {}).get("updatedRange", "")
+                match = re.search(r"![A-Z]+(\d+)", updated_range)
+                if match:
+                    start_row = int(match.group(1))
+                    for row, row_values in enumerate(rows_to_write, start=start_row):
+                        tasks_index[row_values[0]] = row
+                    logger.info(
+                        f"Added {len(rows_to_write)} orders to Tasks sheet in batch "
+                        f"(rows {start_row}-{start_row + len(rows_to_write) - 1})"
+                    )
+                else:
+                    # Row numbers unknown: reload the index on next use
+                    self._tasks_index = None
+                    logger.info(f"Added {len(rows_to_write)} orders to Tasks sheet in batch")
         
         except Exception as e:
             logger.error(f"Error adding orders to Tasks sheet in batch: {e}")
             raise
+        finally:
+            self._invalidate(SHEET_TASKS)
 
-    @rate_limit
+    @rate_limit_write
     def update_order_status(self, order_id: str, status: str):
         """
         Update order status in Tasks sheet
@@ -609,12 +1025,19 @@ class SheetsHandler:
             status: New status (e.g., "new", "completed")
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
+            sheet = self.get_worksheet(SHEET_TASKS)
             
-            # Find the row with this order ID (check column A)
+            # Find the row with this order ID (local index of column A,
+            # server-side find only if the index does not know the order)
             try:
-                cell = sheet.find(str(order_id), in_column=1)
-                row = cell.row
+                row = self._get_tasks_index().get(str(order_id).strip())
+                if row is None:
+                    cell = sheet.find(str(order_id), in_column=1)
+                    if cell is None:
+                        logger.warning(f"Order {order_id} not found in Tasks sheet for status update")
+                        return False
+                    row = cell.row
+                    self._tasks_index[str(order_id).strip()] = row
                 
                 # Update status (column F, index 6)
                 sheet.update_cell(row, 6, status)
@@ -627,8 +1050,9 @@ class SheetsHandler:
         except Exception as e:
             logger.error(f"Error updating order status: {e}")
             return False
+        finally:
+            self._invalidate(SHEET_TASKS)
 
-    @rate_limit
     def get_tasks_from_sheet(
         self, 
         warehouse: Optional[str] = None, 
@@ -648,22 +1072,22 @@ class SheetsHandler:
             article, sticker, status
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
-            records = sheet.get_all_records()
+            # Tasks and (for the warehouse filter) ProcessedOrders in one batchGet
+            ranges = [f"{SHEET_TASKS}!A:Z"]
+            if warehouse:
+                ranges.append(f"{SHEET_PROCESSED_ORDERS}!A:Z")
+            value_ranges = self._batch_get(ranges)
             
             # Filter by warehouse if provided (we need to match via ProcessedOrders)
             warehouse_order_ids = set()
             if warehouse:
                 # Get order IDs for this warehouse from ProcessedOrders
                 try:
-                    processed_sheet = self.spreadsheet.worksheet(SHEET_PROCESSED_ORDERS)
-                    processed_records = processed_sheet.get_all_records()
+                    processed_rows = _iter_columns(value_ranges[1], ("Order ID", "Warehouse"))
                     
-                    for proc_record in processed_records:
-                        proc_warehouse_raw = proc_record.get("Warehouse", "")
+                    for order_id_raw, proc_warehouse_raw in processed_rows:
                         proc_warehouse = str(proc_warehouse_raw).strip() if proc_warehouse_raw else ""
                         if proc_warehouse == warehouse:
-                            order_id_raw = proc_record.get("Order ID", "")
                             order_id = str(order_id_raw).strip() if order_id_raw else ""
                             if order_id:
                                 warehouse_order_ids.add(order_id)
@@ -672,8 +1096,8 @@ class SheetsHandler:
             
             # Filter tasks
             tasks = []
-            for record in records:
-                order_id_raw = record.get("№ задания", "")
+            for values in _iter_columns(value_ranges[0], TASKS_HEADERS):
+                order_id_raw = values[0]
                 order_id = str(order_id_raw).strip() if order_id_raw else ""
                 
                 # Skip empty rows
@@ -684,36 +1108,41 @@ class SheetsHandler:
                 if warehouse and order_id not in warehouse_order_ids:
                     continue
                 
-                # Get status (default to "new" if not set)
-                status_raw = record.get("Статус", "")
-                status = str(status_raw).strip().lower() if status_raw else "new"
+                task = self._task_from_row(values)
                 
                 # Filter by status if specified
-                if status_filter and status != status_filter.lower():
+                if status_filter and task["status"] != status_filter.lower():
                     continue
                 
-                tasks.append({
-                    "order_id": order_id,
-                    "photo_url": str(record.get("Фото", "")).strip(),
-                    "product_name": str(record.get("Наименование", "")).strip(),
-                    "article": str(record.get("Артикул продавца", "")).strip(),
-                    "sticker": str(record.get("Стикер", "")).strip(),
-                    "status": status,
-                })
+                tasks.append(task)
             
-            # Sort by order_id (descending, most recent first) and limit
-            tasks = sorted(
+            # Most recent first (largest order_id), limited: a bounded heap instead
+            # of sorting every task when only `limit` of them are returned
+            return heapq.nlargest(
+                limit,
                 tasks,
-                key=lambda x: int(x.get("order_id", "0")) if x.get("order_id", "").isdigit() else 0,
-                reverse=True
-            )[:limit]
-            
-            return tasks
+                key=lambda x: int(x["order_id"]) if x["order_id"].isdigit() else 0,
+            )
         except Exception as e:
             logger.error(f"Error getting tasks from sheet: {e}")
             return []
     
-    @rate_limit
+    @staticmethod
+    def _task_from_row(values: Sequence[Any]) -> Dict[str, str]:
+        """Build a task dict from Tasks cells in TASKS_HEADERS order"""
+        order_id, photo_url, product_name, article, sticker, status_raw = values
+        # Get status (default to "new" if not set)
+        status = str(status_raw).strip().lower() if status_raw else "new"
+        
+        return {
+            "order_id": str(order_id).strip(),
+            "photo_url": str(photo_url).strip(),
+            "product_name": str(product_name).strip(),
+            "article": str(article).strip(),
+            "sticker": str(sticker).strip(),
+            "status": status,
+        }
+
     def get_task_by_order_id(self, order_id: str) -> Optional[Dict]:
         """
         Get a single task by order ID
@@ -725,32 +1154,26 @@ class SheetsHandler:
             Task dictionary or None if not found
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_TASKS)
-            records = sheet.get_all_records()
-            
             order_id_str = str(order_id).strip()
             
-            for record in records:
-                record_order_id = str(record.get("№ задания", "")).strip()
-                if record_order_id == order_id_str:
-                    status_raw = record.get("Статус", "")
-                    status = str(status_raw).strip().lower() if status_raw else "new"
-                    
-                    return {
-                        "order_id": record_order_id,
-                        "photo_url": str(record.get("Фото", "")).strip(),
-                        "product_name": str(record.get("Наименование", "")).strip(),
-                        "article": str(record.get("Артикул продавца", "")).strip(),
-                        "sticker": str(record.get("Стикер", "")).strip(),
-                        "status": status,
-                    }
+            # Known row: read just A{row}:F{row} instead of the whole sheet
+            row = self._tasks_index.get(order_id_str) if self._tasks_index is not None else None
+            if row is not None:
+                row_values = self._batch_get([f"{SHEET_TASKS}!A{row}:F{row}"])[0]
+                if row_values and str(row_values[0][0]).strip() == order_id_str:
+                    cells = row_values[0]
+                    return self._task_from_row(cells + [""] * (len(TASKS_HEADERS) - len(cells)))
+                # Index is stale (rows moved): fall back to the full scan
+            
+            for values in _iter_columns(self._get_rows(SHEET_TASKS), TASKS_HEADERS):
+                if str(values[0]).strip() == order_id_str:
+                    return self._task_from_row(values)
             
             return None
         except Exception as e:
             logger.error(f"Error getting task by order ID {order_id}: {e}")
             return None
 
-    @rate_limit
     def get_product_from_sheet(self, vendor_code: str) -> Optional[Dict[str, str]]:
         """
         Get product info (photo URL and title) from Products sheet by vendorCode
@@ -762,16 +1185,15 @@ class SheetsHandler:
             Dictionary with 'photo_url' and 'title' or None if not found
         """
         try:
-            sheet = self.spreadsheet.worksheet(SHEET_PRODUCTS)
-            records = sheet.get_all_records()
+            rows = self._get_rows(SHEET_PRODUCTS)
             
             vendor_code_lower = str(vendor_code).strip().lower()
             
-            for record in records:
-                record_vendor_code = str(record.get("Артикул продавца", "")).strip().lower()
-                if record_vendor_code == vendor_code_lower:
-                    photo_url = str(record.get("Фото", "")).strip()
-                    title = str(record.get("Наименование", "")).strip()
+            columns = ("Артикул продавца", "Фото", "Наименование")
+            for record_vendor_code, photo_url, title in _iter_columns(rows, columns):
+                if str(record_vendor_code).strip().lower() == vendor_code_lower:
+                    photo_url = str(photo_url).strip()
+                    title = str(title).strip()
                     return {
                         "photo_url": photo_url if photo_url else None,
                         "title": title if title else None,
@@ -782,7 +1204,29 @@ class SheetsHandler:
             logger.error(f"Error getting product from sheet: {e}")
             return None
     
-    @rate_limit
+    def get_products_map(self) -> Dict[str, Dict[str, str]]:
+        """
+        Load the whole Products sheet for fast per-order lookups
+        
+        Returns:
+            Dictionary mapping lowercased vendor code to {'photo_url', 'title'}
+        """
+        try:
+            rows = self._get_rows(SHEET_PRODUCTS)
+            columns = ("Артикул продавца", "Фото", "Наименование")
+            products = {}
+            for vendor_code, photo_url, title in _iter_columns(rows, columns):
+                vendor_code = str(vendor_code).strip().lower()
+                if vendor_code:
+                    products[vendor_code] = {
+                        'photo_url': str(photo_url).strip(),
+                        'title': str(title).strip(),
+                    }
+            return products
+        except Exception as e:
+            logger.error(f"Error loading products from sheet: {e}")
+            return {}
+
     def get_tasks_for_pdf(self, supply_id: Optional[str] = None) -> List[Dict]:
         """
         Get tasks from TasksForPDF sheet
@@ -801,25 +1245,35 @@ class SheetsHandler:
         try:
             # Check if sheet exists, if not use Tasks sheet
             try:
-                sheet = self.spreadsheet.worksheet(SHEET_TASKS_FOR_PDF)
-            except gspread.exceptions.WorksheetNotFound:
+                rows = self._batch_get([f"{SHEET_TASKS_FOR_PDF}!A:Z"])[0]
+            except gspread.exceptions.APIError as e:
+                # Unknown sheet names fail range parsing with a 400
+                if _is_rate_limit_error(e):
+                    raise
                 logger.warning(f"Sheet {SHEET_TASKS_FOR_PDF} not found, using {SHEET_TASKS} instead")
-                sheet = self.spreadsheet.worksheet(SHEET_TASKS)
+                rows = self._batch_get([f"{SHEET_TASKS}!A:Z"])[0]
+            if not rows:
+                return []
             
-            records = sheet.get_all_records()
+            # TasksForPDF has "Фото URL"; the Tasks fallback has "Фото"
+            headers = [str(h).strip() for h in rows[0]]
+            photo_header = "Фото URL" if "Фото URL" in headers else "Фото"
+            columns = ("№ задания", photo_header, "Наименование", "Артикул продавца", "Стикер")
             
             tasks = []
-            for record in records:
-                order_id = str(record.get("№ задания", "")).strip()
+            for order_id, photo_url, product_name, article, sticker in _iter_columns(rows, columns):
+                order_id = str(order_id).strip()
                 if not order_id:
                     continue
                 
+                # Product fields repeat across orders: intern them so equal
+                # values share one string object
                 tasks.append({
                     "order_id": order_id,
-                    "photo_url": str(record.get("Фото URL", record.get("Фото", ""))).strip(),
-                    "product_name": str(record.get("Наименование", "")).strip(),
-                    "article": str(record.get("Артикул продавца", "")).strip(),
-                    "sticker": str(record.get("Стикер", "")).strip(),
+                    "photo_url": intern(str(photo_url).strip()),
+                    "product_name": intern(str(product_name).strip()),
+                    "article": intern(str(article).strip()),
+                    "sticker": str(sticker).strip(),
                 })
             
             return tasks
@@ -827,7 +1281,7 @@ class SheetsHandler:
             logger.error(f"Error getting tasks for PDF: {e}")
             return []
     
-    @rate_limit
+    @rate_limit_write
     def write_tasks_to_pdf_sheet(self, tasks: List[Dict]):
         """
         Write tasks to TasksForPDF sheet for PDF generation
@@ -839,63 +1293,105 @@ class SheetsHandler:
         try:
             # Get or create TasksForPDF sheet
             try:
-                sheet = self.spreadsheet.worksheet(SHEET_TASKS_FOR_PDF)
+                sheet = self.get_worksheet(SHEET_TASKS_FOR_PDF)
             except gspread.exceptions.WorksheetNotFound:
                 # Create sheet if it doesn't exist
-                self.spreadsheet.add_worksheet(
+                sheet = self.spreadsheet.add_worksheet(
                     title=SHEET_TASKS_FOR_PDF,
                     rows=1000,
                     cols=10,
                 )
-                sheet = self.spreadsheet.worksheet(SHEET_TASKS_FOR_PDF)
-                
-                # Set formula in A1 for automatic image insertion
-                formula = '={"Изображение";ARRAYFORMULA(IF(C2:C="";;IMAGE(C2:C;4;350;350)))}'
-                sheet.update("A1", [[formula]], value_input_option='USER_ENTERED')
+                self._ws[SHEET_TASKS_FOR_PDF] = sheet
                 
-                # Set headers in row 1 for columns B-F
-                sheet.update("B1:F1", [[
-                    "№ задания",
-                    "Фото URL",
-                    "Наименование",
-                    "Артикул продавца",
-                    "Стикер",
-                ]], value_input_option='USER_ENTERED')
+                # Set A1 image formula and B-F headers in one write
+                sheet.update("A1:F1", [TASKS_FOR_PDF_HEADER_ROW], value_input_option='USER_ENTERED')
             
-            # Clear existing data (keep headers and formula)
-            # Delete rows 2 onwards
-            existing_values = sheet.get_all_values()
-            if len(existing_values) > 1:
-                # Delete rows starting from row 2
-                sheet.delete_rows(2, len(existing_values))
-            
-            if not tasks:
-                logger.info("No tasks to write to TasksForPDF sheet")
-                return
+            # Clear B2:F and write the new rows in one spreadsheets.batchUpdate
+            # (was get_all_values + delete_rows + update: three round-trips).
+            # The range clear keeps the A1 formula and headers in place.
+            requests_body = [{
+                "updateCells": {
+                    "range": {
+                        "sheetId": sheet.id,
+                        "startRowIndex": 1,
+                        "startColumnIndex": 1,
+                        "endColumnIndex": 6,
+                    },
+                    "fields": "userEnteredValue",
+                }
+            }]
             
             # Prepare data for writing (columns B-F, starting from row 2)
+            task_fields = itemgetter('order_id', 'photo_url', 'product_name', 'article', 'sticker')
             rows_to_write = []
-            for task in tasks:
+            for order_id, *texts in map(task_fields, tasks):
+                order_id = str(order_id)
                 row = [
-                    str(task.get('order_id', '')),
-                    str(task.get('photo_url', '')),
-                    str(task.get('product_name', '')),
-                    str(task.get('article', '')),
-                    str(task.get('sticker', '')),
+                    {"numberValue": int(order_id)} if order_id.isdigit()
+                    else {"stringValue": order_id},
                 ]
-                rows_to_write.append(row)
+                row.extend({"stringValue": str(text)} for text in texts)
+                rows_to_write.append({"values": [{"userEnteredValue": v} for v in row]})
+            
+            if rows_to_write:
+                # Grow the grid first if the rows don't fit
+                missing_rows = len(rows_to_write) + 1 - sheet.row_count
+                if missing_rows > 0:
+                    requests_body.append({
+                        "appendDimension": {
+                            "sheetId": sheet.id,
+                            "dimension": "ROWS",
+                            "length": missing_rows,
+                        }
+                    })
+                # Write data starting from B2 (A1 has formula, so data starts from row 2, column B)
+                requests_body.append({
+                    "updateCells": {
+                        "start": {"sheetId": sheet.id, "rowIndex": 1, "columnIndex": 1},
+                        "rows": rows_to_write,
+                        "fields": "userEnteredValue",
+                    }
+                })
+            
+            self.spreadsheet.batch_update({"requests": requests_body})
+            if rows_to_write and missing_rows > 0:
+                # Keep the cached grid size in step (as Worksheet.resize does)
+                sheet._properties["gridProperties"]["rowCount"] += missing_rows
             
-            # Write data starting from B2 (A1 has formula, so data starts from row 2, column B)
             if rows_to_write:
-                range_name = f"B2:F{len(rows_to_write) + 1}"
-                sheet.update(range_name, rows_to_write, value_input_option='USER_ENTERED')
                 logger.info(f"Wrote {len(rows_to_write)} tasks to TasksForPDF sheet")
+            else:
+                logger.info("No tasks to write to TasksForPDF sheet")
             
         except Exception as e:
             logger.error(f"Error writing tasks to TasksForPDF sheet: {e}")
             raise
+        finally:
+            self._invalidate(SHEET_TASKS_FOR_PDF)
     
     @rate_limit
+    def _download_to_file(self, url: str, output_path: str, params: Optional[Dict] = None) -> int:
+        """
+        Stream a GET response straight into a file through the shared session
+        (it adds/refreshes the Bearer token itself)
+        
+        Args:
+            url: Download URL
+            output_path: Path to write the body to
+            params: Query parameters
+            
+        Returns:
+            Size of the written file in bytes
+        """
+        # Download with timeout
+        with self.session.get(url, params=params, timeout=300, stream=True) as response:  # 5 minutes
+            response.raise_for_status()
+            # Copy the raw stream in 256KB blocks (decoded, in case of gzip)
+            response.raw.decode_content = True
+            with open(output_path, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=256 * 1024)
+        return os.path.getsize(output_path)
+
     def export_sheet_to_pdf(self, sheet_name: str, output_path: str, page_size: str = 'A4', orientation: str = 'portrait') -> bool:
         """
         Export Google Sheet to PDF (like CMD+P print)
@@ -915,7 +1411,7 @@ class SheetsHandler:
         for attempt in range(max_retries):
             try:
                 # Get sheet by name to get its GID
-                sheet = self.spreadsheet.worksheet(sheet_name)
+                sheet = self.get_worksheet(sheet_name)
                 sheet_gid = sheet.id  # Get the GID (sheet ID) within the spreadsheet
                 
                 # Get file ID from spreadsheet
@@ -923,36 +1419,15 @@ class SheetsHandler:
                 
                 logger.info(f"Exporting sheet '{sheet_name}' (GID: {sheet_gid}) to PDF (attempt {attempt + 1}/{max_retries})...")
                 
-                # Method 1: Try using Drive API with increased timeout
+                # Method 1: Try using Drive API export (one streamed GET)
                 try:
-                    request = self.drive_service.files().export_media(
-                        fileId=file_id,
-                        mimeType='application/pdf',
+                    file_size = self._download_to_file(
+                        f"https://www.googleapis.com/drive/v3/files/{file_id}/export",
+                        output_path,
+                        params={'mimeType': 'application/pdf'},
                     )
-                    
-                    # Download the PDF with timeout
-                    file_handle = io.BytesIO()
-                    downloader = MediaIoBaseDownload(file_handle, request, chunksize=1024*1024)  # 1MB chunks
-                    
-                    done = False
-                    last_progress = 0
-                    while done is False:
-                        status, done = downloader.next_chunk(num_retries=3)
-                        if status:
-                            progress = int(status.progress() * 100)
-                            if progress > last_progress:
-                                logger.debug(f"Download progress: {progress}%")
-                                last_progress = progress
-                    
-                    # Save to file
-                    file_handle.seek(0)
-                    pdf_data = file_handle.read()
-                    
-                    if len(pdf_data) > 0:
-                        with open(output_path, 'wb') as f:
-                            f.write(pdf_data)
-                        
-                        logger.info(f"Successfully exported sheet '{sheet_name}' (GID: {sheet_gid}) to PDF: {output_path} ({len(pdf_data)} bytes)")
+                    if file_size > 0:
+                        logger.info(f"Successfully exported sheet '{sheet_name}' (GID: {sheet_gid}) to PDF: {output_path} ({file_size} bytes)")
                         return True
                     else:
                         raise Exception("Downloaded PDF is empty")
@@ -961,15 +1436,6 @@ class SheetsHandler:
                     logger.warning(f"Drive API export failed: {api_error}, trying direct URL method...")
                     
                     # Method 2: Fallback to direct URL export
-                    # Refresh credentials for direct URL access
-                    if not self.creds.valid:
-                        self.creds.refresh(GoogleRequest())
-                    
-                    # Get access token
-                    self.creds.refresh(GoogleRequest())
-                    access_token = self.creds.token
-                    
-                    # Direct export URL
                     export_url = f"https://docs.google.com/spreadsheets/d/{file_id}/export"
                     params = {
                         'format': 'pdf',
@@ -983,27 +1449,7 @@ class SheetsHandler:
                         'gridlines': 'true',
                     }
                     
-                    headers = {
-                        'Authorization': f'Bearer {access_token}'
-                    }
-                    
-                    # Download with timeout
-                    response = requests.get(
-                        export_url,
-                        params=params,
-                        headers=headers,
-                        timeout=300,  # 5 minutes
-                        stream=True
-                    )
-                    response.raise_for_status()
-                    
-                    # Save to file
-                    with open(output_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    
-                    file_size = os.path.getsize(output_path)
+                    file_size = self._download_to_file(export_url, output_path, params=params)
                     if file_size > 0:
                         logger.info(f"Successfully exported sheet '{sheet_name}' via direct URL to PDF: {output_path} ({file_size} bytes)")
                         return True
@@ -1019,7 +1465,6 @@ class SheetsHandler:
                     time.sleep(retry_delay)
                 else:
                     logger.error(f"Failed to export sheet '{sheet_name}' to PDF after {max_retries} attempts")
-                    import traceback
                     logger.error(traceback.format_exc())
                     return False
         
@@ -2,11 +2,16 @@
 Supply Orders Module
 Fetches orders from supplies and syncs them with Tasks sheet
 """
+import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, Tuple, Iterator
+from config import WB_API_RETRY_ATTEMPTS, WB_API_RETRY_DELAY, WB_API_RATE_LIMIT_DELAY
 from sheets_handler import SheetsHandler
 from wb_api import WildberriesAPI
 
@@ -14,25 +19,82 @@ logger = logging.getLogger(__name__)
 
 WB_MARKETPLACE_API_BASE = "https://marketplace-api.wildberries.ru"
 
+# Parallel supply order-ID requests (WB marketplace API allows ~300 req/min)
+SUPPLY_FETCH_WORKERS = 4
+# Page size for /api/v3/orders; a shorter page is the last one
+ORDERS_PAGE_LIMIT = 1000
+
+# Pagination only pauses once X-Ratelimit-Remaining drops to this many requests
+RATE_LIMIT_HEADROOM = 5
+
+# How long fetch_orders_for_supplies results are shared between warehouses (seconds)
+ORDERS_CACHE_TTL = 120
+
+# How long warehouse name -> warehouse_id lookups are reused (seconds)
+WAREHOUSE_ID_CACHE_TTL = 300
+
+
+def format_supply_date(created_at: str) -> str:
+    """
+    Format a supply createdAt ("2024-01-15T10:30:00Z") as "15.01.2024"
+    
+    The date part of WB timestamps is fixed-width, so it is sliced directly
+    instead of being parsed with datetime.
+    
+    Args:
+        created_at: ISO 8601 timestamp from the supplies API
+        
+    Returns:
+        DD.MM.YYYY, or "" if the value does not start with a YYYY-MM-DD date
+    """
+    if (
+        len(created_at) < 10
+        or created_at[4] != "-"
+        or created_at[7] != "-"
+        or not (created_at[:4] + created_at[5:7] + created_at[8:10]).isdigit()
+    ):
+        return ""
+    return f"{created_at[8:10]}.{created_at[5:7]}.{created_at[:4]}"
+
 
 class SupplyOrdersHandler:
     """Handles fetching orders from supplies"""
     
-    def __init__(self, api_key: str, sheets_handler: SheetsHandler):
+    def __init__(
+        self,
+        api_key: str,
+        sheets_handler: SheetsHandler,
+        session: Optional[requests.Session] = None,
+    ):
         """
         Initialize Supply Orders Handler
         
         Args:
             api_key: Wildberries API key
             sheets_handler: SheetsHandler instance
+            session: Optional marketplace API session to share; handlers pass
+                self.session on to WildberriesAPI so both reuse one pool
         """
         self.api_key = api_key
         self.sheets_handler = sheets_handler
-        self.session = requests.Session()
+        self.session = session or requests.Session()
+        # Room for the parallel supply requests plus WildberriesAPI calls
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=10, pool_maxsize=20),
+        )
         self.session.headers.update({
             "Authorization": api_key,
             "Content-Type": "application/json",
         })
+        # warehouse name -> warehouse_id, rebuilt every WAREHOUSE_ID_CACHE_TTL
+        self._warehouse_id_cache: Dict[str, int] = {}
+        self._warehouse_cache_ts = 0.0
+        # max_age_days -> (fetched_at, orders_map) from fetch_orders_for_supplies
+        self._orders_cache: Dict[int, Tuple[float, Dict[int, Dict]]] = {}
+        # Last X-Ratelimit-Remaining / X-Ratelimit-Reset seen (None if WB sent none)
+        self._rate_remaining: Optional[int] = None
+        self._rate_reset: Optional[float] = None
     
     def fetch_supplies(
         self,
@@ -57,26 +119,42 @@ class SupplyOrdersHandler:
         }
         
         try:
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            response = self._get_with_retry(url, params=params)
+            return json.loads(response.content)
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching supplies: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Response: {e.response.text}")
             return {}
     
-    def fetch_all_incomplete_supplies(self, max_age_days: int = 7) -> List[Dict]:
+    def fetch_all_incomplete_supplies(
+        self, max_age_days: int = 7, limit: Optional[int] = None
+    ) -> List[Dict]:
         """
         Fetch all incomplete supplies not older than max_age_days
         
         Args:
             max_age_days: Maximum age of supplies in days (default: 7)
+            limit: Stop after this many supplies (no further pages are requested)
             
         Returns:
             List of incomplete supply dictionaries
         """
-        all_supplies = []
+        return list(islice(self.iter_incomplete_supplies(max_age_days=max_age_days), limit))
+    
+    def iter_incomplete_supplies(self, max_age_days: int = 7) -> Iterator[Dict]:
+        """
+        Yield incomplete supplies not older than max_age_days page by page,
+        so callers can start working before the last page arrives
+        
+        Args:
+            max_age_days: Maximum age of supplies in days (default: 7)
+            
+        Yields:
+            Incomplete supply dictionaries
+        """
+        debug = logger.isEnabledFor(logging.DEBUG)
+        total_added = 0
         next_token = 0
         request_count = 0
         max_requests = 100
@@ -84,6 +162,9 @@ class SupplyOrdersHandler:
         # Create cutoff_date as timezone-aware (UTC)
         cutoff_date = datetime.now(timezone.utc) - timedelta(days=max_age_days)
         cutoff_date_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S UTC')
+        # UTC ISO-8601 strings sort like their datetimes: "...Z" dates are
+        # compared as text, only other formats go through fromisoformat
+        cutoff_iso = cutoff_date.strftime('%Y-%m-%dT%H:%M:%S')
         
         logger.info(f"Fetching incomplete supplies from last {max_age_days} days...")
         logger.info(f"Cutoff date: {cutoff_date_str} (supplies before this date will be filtered out)")
@@ -95,7 +176,7 @@ class SupplyOrdersHandler:
         
         while request_count < max_requests:
             request_count += 1
-            logger.info(f"Request {request_count}/{max_requests}: Fetching supplies (next_token={next_token})...")
+            logger.debug(f"Request {request_count}/{max_requests}: Fetching supplies (next_token={next_token})...")
             
             result = self.fetch_supplies(limit=1000, next_token=next_token)
             
@@ -107,7 +188,7 @@ class SupplyOrdersHandler:
             next_token = result.get("next")
             
             total_supplies_received += len(supplies)
-            logger.info(f"Request {request_count}: Received {len(supplies)} supplies in batch (total so far: {total_supplies_received})")
+            logger.debug(f"Request {request_count}: Received {len(supplies)} supplies in batch (total so far: {total_supplies_received})")
             
             if len(supplies) == 0:
                 logger.info(f"Request {request_count}: No more supplies to fetch")
@@ -127,7 +208,8 @@ class SupplyOrdersHandler:
                 done_status = supply.get("done", True)
                 if done_status:
                     batch_filtered_done += 1
-                    logger.debug(f"Supply {supply_id} ({supply_name}) filtered: done=True (completed)")
+                    if debug:
+                        logger.debug(f"Supply {supply_id} ({supply_name}) filtered: done=True (completed)")
                     continue
                 
                 # Check age - use createdAt
@@ -137,43 +219,41 @@ class SupplyOrdersHandler:
                     logger.warning(f"Supply {supply_id} ({supply_name}) filtered: no createdAt date")
                     continue
                 
-                try:
-                    # Parse ISO format with timezone (Z means UTC)
-                    if created_str.endswith('Z'):
-                        created_dt = datetime.fromisoformat(created_str.replace('Z', '+00:00'))
-                    else:
+                if created_str.endswith('Z') and len(created_str) >= 20 and created_str[10] == 'T':
+                    too_old = created_str[:19] < cutoff_iso
+                else:
+                    try:
                         created_dt = datetime.fromisoformat(created_str)
-                    
-                    # Ensure timezone-aware for comparison
-                    if created_dt.tzinfo is None:
-                        created_dt = created_dt.replace(tzinfo=timezone.utc)
-                    
-                    created_str_formatted = created_dt.strftime('%Y-%m-%d %H:%M:%S UTC')
-                    age_days = (datetime.now(timezone.utc) - created_dt).days
-                    
-                    if created_dt < cutoff_date:
-                        batch_filtered_age += 1
-                        logger.info(
-                            f"Supply {supply_id} ({supply_name}) filtered: too old "
-                            f"(created: {created_str_formatted}, age: {age_days} days, cutoff: {cutoff_date_str})"
+                        # Ensure timezone-aware for comparison
+                        if created_dt.tzinfo is None:
+                            created_dt = created_dt.replace(tzinfo=timezone.utc)
+                        too_old = created_dt < cutoff_date
+                    except Exception as e:
+                        logger.error(
+                            f"Error parsing createdAt for supply {supply_id} ({supply_name}): {e}, "
+                            f"createdAt value: {created_str}"
                         )
                         continue
-                    
-                    # Supply passed all filters
-                    all_supplies.append(supply)
-                    batch_added += 1
-                    logger.info(
+                
+                if too_old:
+                    batch_filtered_age += 1
+                    if debug:
+                        logger.debug(
+                            f"Supply {supply_id} ({supply_name}) filtered: too old "
+                            f"(created: {created_str}, cutoff: {cutoff_date_str})"
+                        )
+                    continue
+                
+                # Supply passed all filters
+                yield supply
+                batch_added += 1
+                if debug:
+                    logger.debug(
                         f"Supply {supply_id} ({supply_name}) added: "
-                        f"(created: {created_str_formatted}, age: {age_days} days, done: {done_status})"
+                        f"(created: {created_str}, done: {done_status})"
                     )
-                    
-                except Exception as e:
-                    logger.error(
-                        f"Error parsing createdAt for supply {supply_id} ({supply_name}): {e}, "
-                        f"createdAt value: {created_str}"
-                    )
-                    continue
             
+            total_added += batch_added
             total_filtered_done += batch_filtered_done
             total_filtered_age += batch_filtered_age
             total_filtered_no_created += batch_filtered_no_created
@@ -192,27 +272,112 @@ class SupplyOrdersHandler:
                 logger.info(f"No next token, all supplies fetched after {request_count} requests")
                 break
             
-            # Small delay to avoid rate limiting
-            time.sleep(0.1)
+            # When a page is ordered newest-first and already ends past the
+            # cutoff, every later page is older still
+            first_created = str(supplies[0].get("createdAt") or "")
+            last_created = str(supplies[-1].get("createdAt") or "")
+            if (
+                first_created.endswith('Z') and last_created.endswith('Z')
+                and first_created[:19] > last_created[:19]
+                and last_created[:19] < cutoff_iso
+            ):
+                logger.info(
+                    f"Request {request_count}: reached supplies older than cutoff, "
+                    "stopping pagination"
+                )
+                break
+            
+            # Pause only if the rate limit headers ask for it
+            self._pace(0.1)
         
         logger.info(
             f"Fetching complete. Summary: "
             f"total_received={total_supplies_received}, "
-            f"total_added={len(all_supplies)}, "
+            f"total_added={total_added}, "
             f"total_filtered_done={total_filtered_done}, "
             f"total_filtered_age={total_filtered_age}, "
             f"total_filtered_no_created={total_filtered_no_created}"
         )
         
-        if len(all_supplies) == 0 and total_supplies_received > 0:
+        if total_added == 0 and total_supplies_received > 0:
             logger.warning(
                 f"WARNING: Received {total_supplies_received} supplies but all were filtered out! "
                 f"Filtered by done: {total_filtered_done}, by age: {total_filtered_age}, "
                 f"no createdAt: {total_filtered_no_created}"
             )
         
-        logger.info(f"Total incomplete supplies found: {len(all_supplies)}")
-        return all_supplies
+        logger.info(f"Total incomplete supplies found: {total_added}")
+    
+    def _get_with_retry(self, url: str, params: Optional[Dict] = None) -> requests.Response:
+        """
+        GET with retries: waits out 429s (X-Ratelimit-Retry / Retry-After
+        headers when present) and backs off exponentially on network errors,
+        so parallel callers slow down instead of dropping results
+        
+        Args:
+            url: Request URL
+            params: Query parameters
+            
+        Returns:
+            Successful response
+            
+        Raises:
+            requests.exceptions.RequestException: when all attempts fail
+        """
+        for attempt in range(WB_API_RETRY_ATTEMPTS):
+            try:
+                response = self.session.get(url, params=params, timeout=30)
+                self._note_rate_limit(response)
+                if response.status_code == 429 and attempt < WB_API_RETRY_ATTEMPTS - 1:
+                    retry_after = (
+                        response.headers.get("X-Ratelimit-Retry")
+                        or response.headers.get("Retry-After")
+                    )
+                    try:
+                        delay = float(retry_after)
+                    except (TypeError, ValueError):
+                        delay = WB_API_RATE_LIMIT_DELAY
+                    logger.warning(f"Rate limit exceeded for {url}. Waiting {delay} seconds...")
+                    time.sleep(delay)
+                    continue
+                response.raise_for_status()
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == WB_API_RETRY_ATTEMPTS - 1:
+                    raise
+                delay = WB_API_RETRY_DELAY * (2 ** attempt)
+                logger.warning(
+                    f"Request error on attempt {attempt + 1}/{WB_API_RETRY_ATTEMPTS}: {e}. "
+                    f"Retrying in {delay} seconds..."
+                )
+                time.sleep(delay)
+        # Unreachable: the last attempt either returns or raises
+        raise requests.exceptions.RetryError(f"All attempts failed for {url}")
+    
+    def _note_rate_limit(self, response: requests.Response):
+        """Remember WB rate limit headers from the latest response"""
+        try:
+            remaining = response.headers.get("X-Ratelimit-Remaining")
+            self._rate_remaining = int(remaining) if remaining is not None else None
+            reset = response.headers.get("X-Ratelimit-Reset")
+            self._rate_reset = float(reset) if reset is not None else None
+        except ValueError:
+            self._rate_remaining = None
+            self._rate_reset = None
+    
+    def _pace(self, default_delay: float):
+        """
+        Pause between paginated requests only when WB reports little quota left
+        
+        Args:
+            default_delay: Pause used when the response had no rate limit headers
+        """
+        if self._rate_remaining is None:
+            time.sleep(default_delay)
+        elif self._rate_remaining <= RATE_LIMIT_HEADROOM:
+            delay = self._rate_reset if self._rate_reset is not None else default_delay
+            logger.debug(f"Rate limit almost used up, waiting {delay} seconds")
+            time.sleep(delay)
     
     def fetch_order_ids_for_supply(self, supply_id: str) -> List[int]:
         """
@@ -230,9 +395,8 @@ class SupplyOrdersHandler:
         )
         
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            result = response.json()
+            response = self._get_with_retry(url)
+            result = json.loads(response.content)
             
             # Response might be a list of order IDs or a dict with 'orderIds'
             if isinstance(result, list):
@@ -265,25 +429,19 @@ class SupplyOrdersHandler:
         Returns:
             Dictionary mapping order_id to order data
         """
-        # Get all incomplete supplies
-        supplies = self.fetch_all_incomplete_supplies(max_age_days=max_age_days)
+        # Incomplete supplies, consumed as pages arrive: order-ID requests
+        # for the first page start while later pages are still loading
+        supplies = self.iter_incomplete_supplies(max_age_days=max_age_days)
         
-        if not supplies:
-            logger.info("No incomplete supplies found")
-            return {}
+        # Collect all order IDs from supplies (a few requests in flight
+        # instead of one at a time with a sleep in between)
+        supply_ids = (supply["id"] for supply in supplies if supply.get("id"))
+        all_order_ids: Set[int] = set()  # supplies can share orders at boundaries
+        with ThreadPoolExecutor(max_workers=SUPPLY_FETCH_WORKERS) as pool:
+            for order_ids in pool.map(self.fetch_order_ids_for_supply, supply_ids):
+                all_order_ids.update(order_ids)
         
-        # Collect all order IDs from supplies
-        all_order_ids = []
-        for supply in supplies:
-            supply_id = supply.get("id")
-            if not supply_id:
-                continue
-            
-            order_ids = self.fetch_order_ids_for_supply(supply_id)
-            all_order_ids.extend(order_ids)
-            time.sleep(0.3)  # Rate limiting
-        
-        logger.info(f"Found {len(all_order_ids)} total order IDs from supplies")
+        logger.info(f"Found {len(all_order_ids)} unique order IDs from supplies")
         
         if not all_order_ids:
             return {}
@@ -293,7 +451,7 @@ class SupplyOrdersHandler:
             date_from_dt = datetime.now() - timedelta(days=max_age_days + 7)
             date_from = int(date_from_dt.timestamp())
         
-        orders_map = self._fetch_orders_by_ids(all_order_ids, date_from)
+        orders_map = self._fetch_orders_by_ids(list(all_order_ids), date_from)
         
         return orders_map
     
@@ -312,7 +470,26 @@ class SupplyOrdersHandler:
         Returns:
             Dictionary mapping order_id to order data
         """
+        return self._scan_orders_by_ids(order_ids, date_from)[0]
+    
+    def _scan_orders_by_ids(
+        self,
+        order_ids: List[int],
+        date_from: Optional[int] = None,
+    ) -> Tuple[Dict[int, Dict], bool]:
+        """
+        _fetch_orders_by_ids that also reports whether the scan finished
+        
+        Args:
+            order_ids: List of order IDs to fetch
+            date_from: Optional Unix timestamp for date filter
+            
+        Returns:
+            (order_id -> order data, False if a request failed or the page
+            limit was hit before every page was read)
+        """
         orders_map = {}
+        complete = False
         order_ids_set = set(order_ids)
         next_token = 0
         request_count = 0
@@ -321,7 +498,7 @@ class SupplyOrdersHandler:
         url = f"{WB_MARKETPLACE_API_BASE}/api/v3/orders"
         
         logger.info(
-            f"Fetching orders to find {len(order_ids)} specific orders..."
+            f"Fetching orders to find {len(order_ids_set)} specific orders..."
         )
         
         while (
@@ -329,7 +506,7 @@ class SupplyOrdersHandler:
             and len(orders_map) < len(order_ids_set)
         ):
             params = {
-                "limit": 1000,
+                "limit": ORDERS_PAGE_LIMIT,
                 "next": next_token,
             }
             
@@ -337,9 +514,8 @@ class SupplyOrdersHandler:
                 params["dateFrom"] = date_from
             
             try:
-                response = self.session.get(url, params=params, timeout=30)
-                response.raise_for_status()
-                result = response.json()
+                response = self._get_with_retry(url, params=params)
+                result = json.loads(response.content)
                 
                 orders = result.get("orders", [])
                 next_token = result.get("next")
@@ -363,19 +539,27 @@ class SupplyOrdersHandler:
                 # Check if we should continue pagination
                 if not next_token or next_token == 0:
                     logger.info("No next token, all orders fetched")
+                    complete = True
+                    break
+                # A short page is the last one; don't request an empty page after it
+                if len(orders) < ORDERS_PAGE_LIMIT:
+                    logger.info("Last page reached, all orders fetched")
+                    complete = True
                     break
                 
                 request_count += 1
-                time.sleep(0.5)  # Rate limiting
+                self._pace(0.5)  # Rate limiting
                 
             except requests.exceptions.RequestException as e:
                 logger.error(f"Error fetching orders: {e}")
                 break
         
+        if len(orders_map) >= len(order_ids_set):
+            complete = True
         logger.info(
-            f"Found {len(orders_map)} out of {len(order_ids)} requested orders"
+            f"Found {len(orders_map)} out of {len(order_ids_set)} requested orders"
         )
-        return orders_map
+        return orders_map, complete
     
     def get_warehouse_id_mapping(self) -> Dict[str, int]:
         """
@@ -425,8 +609,14 @@ class SupplyOrdersHandler:
                 "fetching all orders from supplies"
             )
         
-        # Fetch all orders from supplies
-        orders_map = self.fetch_orders_for_supplies(max_age_days=max_age_days)
+        # Fetch all orders from supplies (one scan serves every warehouse
+        # of this API key for ORDERS_CACHE_TTL seconds)
+        cached = self._orders_cache.get(max_age_days)
+        if cached and time.monotonic() - cached[0] < ORDERS_CACHE_TTL:
+            orders_map = cached[1]
+        else:
+            orders_map = self.fetch_orders_for_supplies(max_age_days=max_age_days)
+            self._orders_cache[max_age_days] = (time.monotonic(), orders_map)
         
         if not orders_map:
             logger.info("No orders found in supplies")
@@ -456,6 +646,7 @@ class SupplyOrdersHandler:
     def _get_warehouse_id_for_name(self, warehouse_name: str) -> Optional[int]:
         """
         Get warehouse_id for a warehouse name by checking ProcessedOrders
+        (cached for WAREHOUSE_ID_CACHE_TTL seconds)
         
         Args:
             warehouse_name: Warehouse name
@@ -463,43 +654,68 @@ class SupplyOrdersHandler:
         Returns:
             Warehouse ID or None
         """
+        if time.monotonic() - self._warehouse_cache_ts < WAREHOUSE_ID_CACHE_TTL:
+            return self._warehouse_id_cache.get(warehouse_name)
+        
         try:
-            # Check ProcessedOrders to find orders for this warehouse
-            # Then fetch one order to get its warehouse_id
-            processed_sheet = self.sheets_handler.spreadsheet.worksheet(
-                "ProcessedOrders"
-            )
-            processed_records = processed_sheet.get_all_records()
-            
-            # Find an order ID for this warehouse
-            order_id_for_warehouse = None
-            for record in processed_records:
-                record_warehouse = str(record.get("Warehouse", "")).strip()
-                if record_warehouse == warehouse_name:
-                    order_id_str = str(record.get("Order ID", "")).strip()
-                    if order_id_str:
-                        try:
-                            order_id_for_warehouse = int(order_id_str)
-                            break
-                        except ValueError:
-                            continue
-            
-            if order_id_for_warehouse:
-                # Fetch this order to get warehouse_id
-                orders_map = self._fetch_orders_by_ids(
-                    [order_id_for_warehouse], date_from=None
-                )
-                if orders_map:
-                    order_data = orders_map.get(order_id_for_warehouse)
-                    if order_data:
-                        warehouse_id = order_data.get("warehouseId")
-                        logger.info(
-                            f"Determined warehouse_id {warehouse_id} for "
-                            f"warehouse {warehouse_name}"
-                        )
-                        return warehouse_id
-            
-            return None
+            self._refresh_warehouse_ids()
+            return self._warehouse_id_cache.get(warehouse_name)
         except Exception as e:
             logger.error(f"Error getting warehouse_id for {warehouse_name}: {e}")
             return None
+
+    def _refresh_warehouse_ids(self):
+        """
+        Rebuild the warehouse name -> warehouse_id cache for this API key
+        
+        Takes one processed order per warehouse from ProcessedOrders and
+        resolves all of them with a single _fetch_orders_by_ids scan.
+        The cache timestamp only advances after a completed scan, so a failed
+        WB request is retried on the next call instead of being cached.
+        """
+        # Only warehouses served by this API key: orders of other keys
+        # never show up in /api/v3/orders and would force a full scan
+        own_warehouses = {
+            info["warehouse"]
+            for info in self.sheets_handler.get_warehouse_api_keys()
+            if info["api_key"] == self.api_key
+        }
+        
+        # Latest processed order for each warehouse
+        order_for_warehouse: Dict[str, int] = {}
+        for order_id_str, record_warehouse in (
+            self.sheets_handler.get_processed_order_warehouses().items()
+        ):
+            if record_warehouse in own_warehouses:
+                try:
+                    order_for_warehouse[record_warehouse] = int(order_id_str)
+                except ValueError:
+                    continue
+        
+        if not order_for_warehouse:
+            # Nothing to resolve (or the sheet reads failed): no WB request was
+            # made, so leave the timestamp alone and look again next time
+            return
+        
+        orders_map, complete = self._scan_orders_by_ids(
+            list(order_for_warehouse.values()), date_from=None
+        )
+        cache: Dict[str, int] = {}
+        for name, order_id in order_for_warehouse.items():
+            warehouse_id = orders_map.get(order_id, {}).get("warehouseId")
+            if warehouse_id:
+                cache[name] = warehouse_id
+                logger.info(
+                    f"Determined warehouse_id {warehouse_id} for "
+                    f"warehouse {name}"
+                )
+        
+        if complete:
+            self._warehouse_id_cache = cache
+            self._warehouse_cache_ts = time.monotonic()
+        else:
+            # Keep what was resolved, but don't cache the misses
+            self._warehouse_id_cache.update(cache)
+            logger.warning(
+                "Warehouse ID lookup incomplete, will retry on the next request"
+            )
@@ -136,8 +136,15 @@ def main() -> int:
     PRODUCT_IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     sheets = SheetsHandler()
-    products = sheets.spreadsheet.worksheet("Products")
-    records = products.get_all_records()
+    products = sheets.get_worksheet("Products")
+    # Raw values + header positions: no per-row dict like get_all_records()
+    values = products.get_all_values()
+    headers = [h.strip() for h in values[0]] if values else []
+    article_col = headers.index("Артикул продавца") if "Артикул продавца" in headers else None
+    photo_col = headers.index("Фото") if "Фото" in headers else None
+    if article_col is None or photo_col is None:
+        logger.error("Products sheet has no 'Артикул продавца' / 'Фото' columns")
+        return 1
 
     now = time.time()
     max_age = max(0, args.max_age_days) * 86400
@@ -146,9 +153,9 @@ def main() -> int:
     ok = skip = fail = 0
 
     attempts = 0
-    for rec in records:
-        article = str(rec.get("Артикул продавца", "")).strip()
-        url = str(rec.get("Фото", "")).strip()
+    for row in values[1:]:
+        article = row[article_col].strip() if article_col < len(row) else ""
+        url = row[photo_col].strip() if photo_col < len(row) else ""
         if not article or not url:
             continue
 
@@ -4,6 +4,7 @@ Polls WB API every 5 minutes and sends notifications
 """
 import logging
 import asyncio
+from typing import Awaitable, Dict, Optional, Set
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -12,7 +13,13 @@ from telegram.ext import (
     ContextTypes,
 )
 
-from config import TELEGRAM_BOT_TOKEN, POLLING_INTERVAL, LOG_LEVEL, LOG_FILE
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    POLLING_INTERVAL,
+    ENABLE_PERIODIC_POLLING,
+    LOG_LEVEL,
+    LOG_FILE,
+)
 from sheets_handler import SheetsHandler
 from order_tracker import OrderTracker
 from telegram_handler import TelegramHandler
@@ -30,6 +37,11 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Warehouses processed at the same time in one polling cycle
+WAREHOUSE_CONCURRENCY = 5
+# Orders notified at the same time (Telegram allows ~30 messages/s per bot)
+NOTIFY_CONCURRENCY = 20
+
 
 class WBBot:
     """Main bot class for Wildberries DBS orders"""
@@ -41,94 +53,221 @@ class WBBot:
         self.telegram_handler = TelegramHandler(self.sheets_handler)
         self.application = None
         self.processing_task = None
+        # WB clients by API key: sessions (and their kept-alive connections)
+        # are reused across polling cycles
+        self._wb_clients: Dict[str, WildberriesAPI] = {}
+        # Orders whose notifications are in flight at once
+        self._notify_semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        # Products sheet map; starts from the local snapshot of the previous run
+        self._products: Dict[str, Dict[str, str]] = {}
+        self._products_from_snapshot = False
+        self._products_refresh_task: Optional[asyncio.Task] = None
+        store = self.order_tracker.store
+        if ENABLE_PERIODIC_POLLING and store is not None:
+            try:
+                self._products = store.load_products()
+                self._products_from_snapshot = bool(self._products)
+                logger.info(f"Loaded {len(self._products)} products from local snapshot")
+            except Exception as e:
+                logger.warning(f"Could not load products snapshot: {e}")
+
+    async def _get_products(self) -> Dict[str, Dict[str, str]]:
+        """
+        Products map for the current cycle
+        
+        The first cycle after a restart uses the local snapshot and re-reads
+        the sheet in the background; later cycles read the sheet first.
+        
+        Returns:
+            Dictionary mapping lowercased vendor code to {'photo_url', 'title'}
+        """
+        if self._products_from_snapshot:
+            self._products_from_snapshot = False
+            self._products_refresh_task = asyncio.create_task(self._refresh_products())
+            return self._products
+        await self._refresh_products()
+        return self._products
+
+    async def _refresh_products(self):
+        """Reload the Products sheet and update the local snapshot if it changed"""
+        products = await asyncio.to_thread(self.sheets_handler.get_products_map)
+        if not products:
+            # Read failed (get_products_map logs and returns {}): keep the last map
+            return
+        if products == self._products:
+            return
+        self._products = products
+        store = self.order_tracker.store
+        if store is not None:
+            try:
+                await asyncio.to_thread(store.save_products, products)
+            except Exception as e:
+                logger.warning(f"Could not save products snapshot: {e}")
 
     async def process_new_orders(self):
         """Process new orders from all warehouses"""
         logger.info("Starting order processing cycle...")
         
         try:
-            # Refresh processed orders list
-            self.order_tracker.refresh()
+            # Sheets/WB calls below are blocking HTTP: run them in worker threads
+            # so Telegram updates keep being served
+            # Refresh processed orders list once for the whole cycle
+            # (catches orders added manually or by other instances)
+            await asyncio.to_thread(self.order_tracker.refresh)
+            # Orders notified in an earlier cycle whose sheet write failed
+            if self.order_tracker.unrecorded:
+                await asyncio.to_thread(self.order_tracker.retry_unrecorded)
             
             # Get all warehouse API keys
-            warehouses = self.sheets_handler.get_warehouse_api_keys()
+            warehouses = await self.sheets_handler.aget_warehouse_api_keys()
             
             if not warehouses:
                 logger.warning("No warehouses found in Google Sheets")
                 return
             
-            # Process orders for each warehouse
+            # /orders/new returns every new order of the seller account, so poll
+            # each API key once; its orders go to the first warehouse listed for
+            # it (as when warehouses were processed one after another)
+            warehouse_for_key: Dict[str, Dict[str, str]] = {}
             for warehouse_info in warehouses:
-                warehouse = warehouse_info["warehouse"]
-                api_key = warehouse_info["api_key"]
-                city = warehouse_info.get("city", "")
+                warehouse_for_key.setdefault(warehouse_info["api_key"], warehouse_info)
+            
+            # Load all products once: one lookup table for every order. Started
+            # as a task so the sheet read overlaps with the WB order/sticker
+            # requests; each warehouse awaits it only when it has orders to send
+            products = asyncio.create_task(self._get_products())
+            
+            try:
+                # Process API keys concurrently, a few at a time so WB and
+                # Google Sheets are not flooded
+                semaphore = asyncio.Semaphore(WAREHOUSE_CONCURRENCY)
+                # Order IDs already taken by a key in this cycle (two tokens of the
+                # same seller account return the same orders)
+                claimed_ids: Set[int] = set()
+                
+                async def process_warehouse(warehouse_info: Dict[str, str]):
+                    warehouse = warehouse_info["warehouse"]
+                    api_key = warehouse_info["api_key"]
+                    city = warehouse_info.get("city", "")
                 
-                logger.info(f"Processing orders for warehouse: {warehouse} (City: {city})")
+                    async with semaphore:
+                        logger.info(f"Processing orders for warehouse: {warehouse} (City: {city})")
+                        return await self._process_warehouse_orders(
+                            warehouse, api_key, products, claimed_ids
+                        )
                 
+                key_warehouses = list(warehouse_for_key.values())
+                results = await asyncio.gather(
+                    *(process_warehouse(info) for info in key_warehouses),
+                    return_exceptions=True,
+                )
+                for warehouse_info, result in zip(key_warehouses, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error processing warehouse {warehouse_info['warehouse']}: {result}")
                 try:
-                    await self._process_warehouse_orders(warehouse, api_key)
+                    await products
                 except Exception as e:
-                    logger.error(f"Error processing warehouse {warehouse}: {e}")
-                    continue
+                    logger.error(f"Error loading products: {e}")
+            finally:
+                # A cancelled cycle (wait_for timeout) must not leave the load
+                # running into the next cycle's _refresh_products
+                if not products.done():
+                    products.cancel()
             
             logger.info("Order processing cycle completed")
             
         except Exception as e:
             logger.error(f"Error in order processing cycle: {e}")
 
-    async def _process_warehouse_orders(self, warehouse: str, api_key: str):
+    async def _process_warehouse_orders(
+        self,
+        warehouse: str,
+        api_key: str,
+        products: Awaitable[Dict[str, Dict[str, str]]],
+        claimed_ids: Set[int],
+    ):
         """
-        Process new orders for a specific warehouse
+        Process new orders for a specific warehouse: send notifications, then
+        record the warehouse's orders to Tasks/ProcessedOrders in one write
         
         Args:
             warehouse: Warehouse name
             api_key: Wildberries API key
+            products: Task resolving to the Products sheet map (shared by all warehouses)
+            claimed_ids: Order IDs handled by other keys this cycle (updated in place)
         """
         try:
-            # Initialize WB API client
-            wb_api = WildberriesAPI(api_key)
-            
-            # Refresh processed order IDs cache before processing
-            # This ensures we catch orders added manually or by other instances
-            self.order_tracker.refresh()
+            # Reuse the WB API client for this key
+            wb_api = self._wb_clients.get(api_key)
+            if wb_api is None:
+                wb_api = self._wb_clients[api_key] = WildberriesAPI(api_key)
             
             # Fetch new orders
-            orders = wb_api.get_new_orders()
+            orders = await asyncio.to_thread(wb_api.get_new_orders)
             
             if not orders:
-                logger.debug(f"No new orders for warehouse: {warehouse}")
+                logger.debug("No new orders for warehouse: %s", warehouse)
                 return
             
             logger.info(f"Found {len(orders)} new orders for warehouse: {warehouse}")
             
-            # Filter out already processed orders
+            # Filter out already processed orders; one entry per order ID even if
+            # WB pages overlap. No await between the check and claiming the IDs,
+            # so concurrent keys never take the same order
+            unique_orders = {order["id"]: order for order in orders if order.get("id")}
             new_orders = [
-                order for order in orders
-                if not self.order_tracker.is_processed(order.get("id"))
+                order for order_id, order in unique_orders.items()
+                if order_id not in claimed_ids and not self.order_tracker.is_processed(order_id)
             ]
+            claimed_ids.update(order["id"] for order in new_orders)
             
             if not new_orders:
-                logger.debug(f"All {len(orders)} orders already processed for warehouse: {warehouse}")
+                logger.debug("All %d orders already processed for warehouse: %s", len(orders), warehouse)
                 return
             
             logger.info(f"Processing {len(new_orders)} new orders for warehouse: {warehouse}")
             
-            # Process each new order with delays to prevent rate limiting
-            import time
-            for idx, order in enumerate(new_orders):
+            # Fetch all stickers in batches (up to 100 per request) instead of one call per order
+            stickers = {}
+            order_ids = [order["id"] for order in new_orders]
+            batch_size = 100
+            for i in range(0, len(order_ids), batch_size):
+                batch = order_ids[i:i + batch_size]
                 try:
-                    await self._process_order(order, warehouse, api_key, wb_api)
-                    # Add delay between orders to prevent rate limiting
-                    # More delay if we're processing many orders
-                    if idx < len(new_orders) - 1:  # Don't delay after last order
-                        delay = 2.0  # 2 seconds between orders
-                        time.sleep(delay)
+                    stickers.update(await asyncio.to_thread(wb_api.get_stickers, batch))
                 except Exception as e:
-                    logger.error(f"Error processing order {order.get('id')}: {e}")
-                    # Still delay even on error to prevent rate limiting
-                    if idx < len(new_orders) - 1:
-                        time.sleep(1.0)
-                    continue
+                    logger.error(f"Error fetching stickers for warehouse {warehouse}: {e}")
+            
+            products_map = await products
+            
+            # Process new orders concurrently; notifications are paced by
+            # TelegramHandler's rate limiters (and retried on RetryAfter)
+            async def process_order(order: dict):
+                async with self._notify_semaphore:
+                    return await self._process_order(
+                        order, warehouse, api_key, stickers.get(order["id"], ""), products_map
+                    )
+            
+            results = []
+            try:
+                results = await asyncio.gather(
+                    *(process_order(order) for order in new_orders),
+                    return_exceptions=True,
+                )
+            finally:
+                # Record to Tasks and mark as processed in one Sheets request as
+                # soon as this warehouse is notified. Runs (shielded) even when
+                # the cycle times out: every order was marked locally before its
+                # notification, so nothing sent is lost; a failed write keeps the
+                # orders in OrderTracker.unrecorded for the next cycle
+                recorded = await asyncio.shield(
+                    asyncio.to_thread(self.order_tracker.retry_unrecorded)
+                )
+                if not recorded:
+                    logger.error(f"Failed to record orders for warehouse {warehouse}")
+            for order, result in zip(new_orders, results):
+                if isinstance(result, Exception):
+                    logger.error("Error processing order %s: %s", order.get('id'), result)
                     
         except Exception as e:
             logger.error(f"Error fetching orders for warehouse {warehouse}: {e}")
@@ -138,34 +277,30 @@ class WBBot:
         order: dict,
         warehouse: str,
         api_key: str,
-        wb_api: WildberriesAPI,
+        sticker: str,
+        products: Dict[str, Dict[str, str]],
     ):
         """
-        Process a single order
+        Process a single order: mark it locally, then send its notifications
         
         Args:
             order: Order dictionary from WB API
             warehouse: Warehouse name
             api_key: API key used
-            wb_api: WildberriesAPI instance
+            sticker: Sticker string fetched for this warehouse's batch ("" if none)
+            products: Products sheet map from get_products_map (lowercased vendor code keys)
         """
         order_id = order.get("id")
         if not order_id:
             logger.warning("Order missing ID, skipping")
             return
         
-        # Double-check: Skip if order already exists in Tasks sheet
-        # This prevents duplicates from race conditions or partial failures
-        if self.sheets_handler.order_exists_in_tasks(order_id):
-            logger.info(f"Order {order_id} already exists in Tasks sheet, skipping")
-            # Still mark as processed to avoid retrying
-            try:
-                self.order_tracker.mark_processed(order_id, warehouse, api_key)
-            except Exception:
-                pass
-            return
+        # Orders already in Tasks were filtered out by is_processed() against the
+        # Tasks ID snapshot read once per cycle; process_orders() also skips the
+        # Tasks row for IDs in the live Tasks index, so no per-order check here
         
-        logger.info(f"Processing order {order_id}")
+        # Per-order messages use lazy %-formatting: built only if the level is enabled
+        logger.info("Processing order %s", order_id)
         
         # Extract order data
         article = order.get("article", "")
@@ -174,54 +309,42 @@ class WBBot:
         # Initialize variables
         product_name = ""  # Not stored in Products sheet, leave empty
         photo_url = None
-        sticker = ""
-        
-        # Fetch sticker with delay to prevent rate limiting
-        try:
-            import time
-            time.sleep(0.5)  # Small delay between API calls
-            stickers = wb_api.get_stickers([order_id])
-            sticker = stickers.get(order_id, "")
-            if sticker:
-                logger.debug(f"Got sticker for order {order_id}: {sticker}")
-        except Exception as e:
-            logger.error(f"Error fetching sticker for order {order_id}: {e}")
+        if sticker:
+            logger.debug("Got sticker for order %s: %s", order_id, sticker)
         
         # Get product photo URL and name from Products sheet by article (vendorCode)
         photo_url = None
         if article:
             try:
-                import time
-                time.sleep(0.5)  # Small delay to prevent rate limiting
-                product_info = self.sheets_handler.get_product_from_sheet(article)
+                product_info = products.get(str(article).strip().lower())
                 if product_info:
-                    photo_url = product_info.get("photo_url")
+                    photo_url = product_info.get("photo_url") or None
                     # Get product name from sheet if available
                     if product_info.get("title"):
                         product_name = product_info.get("title")
                         logger.info(
-                            f"Found product in sheet for article '{article}' "
-                            f"(order {order_id}): {product_name}"
+                            "Found product in sheet for article '%s' (order %s): %s",
+                            article, order_id, product_name,
                         )
                     if photo_url:
-                        logger.info(f"Found product photo in sheet for article '{article}' (order {order_id})")
+                        logger.info("Found product photo in sheet for article '%s' (order %s)", article, order_id)
                 else:
-                    logger.warning(f"Product not found in sheet for article '{article}' (order {order_id})")
+                    logger.warning("Product not found in sheet for article '%s' (order %s)", article, order_id)
             except Exception as e:
-                logger.error(f"Error looking up product in sheet for article '{article}': {e}")
+                logger.error("Error looking up product in sheet for article '%s': %s", article, e)
         
-        # Record to Google Sheets (always record, even if incomplete)
-        # This method now checks for duplicates internally
-        try:
-            self.sheets_handler.add_order_to_tasks(
-                order_id=order_id,
-                photo_url=photo_url,
-                product_name=product_name,
-                article=article or sku,
-                sticker=sticker,
-            )
-        except Exception as e:
-            logger.error(f"Error recording order {order_id} to Google Sheets: {e}")
+        # Mark before sending: once a notification may have gone out, the order
+        # must count as processed even if the cycle is cancelled mid-send.
+        # The Tasks/ProcessedOrders row is written with the warehouse's batch
+        self.order_tracker.mark_notified({
+            "order_id": order_id,
+            "warehouse": warehouse,
+            "api_key": api_key,
+            "photo_url": photo_url,
+            "product_name": product_name,
+            "article": article or sku,
+            "sticker": sticker,
+        })
         
         # Send Telegram notifications for ALL new orders (even without sticker/photo)
         try:
@@ -242,25 +365,32 @@ class WBBot:
                 )
         except Exception as e:
             logger.error(
-                f"Error sending Telegram notification for order {order_id}: {e}"
+                "Error sending Telegram notification for order %s: %s", order_id, e
             )
-        
-        # Mark as processed
-        try:
-            self.order_tracker.mark_processed(order_id, warehouse, api_key)
-        except Exception as e:
-            logger.error(f"Error marking order {order_id} as processed: {e}")
 
     async def periodic_task(self):
         """Periodic task that runs every POLLING_INTERVAL seconds"""
+        loop = asyncio.get_running_loop()
+        next_deadline = loop.time()
         while True:
             try:
-                await self.process_new_orders()
+                # A hanging Sheets/WB call must not hold up later cycles; a
+                # cancelled cycle still records what it notified (see
+                # _process_warehouse_orders)
+                await asyncio.wait_for(self.process_new_orders(), timeout=POLLING_INTERVAL * 2)
+            except asyncio.TimeoutError:
+                logger.error(f"Order processing cycle exceeded {POLLING_INTERVAL * 2}s, cancelled")
             except Exception as e:
                 logger.error(f"Error in periodic task: {e}")
             
-            # Wait for next interval
-            await asyncio.sleep(POLLING_INTERVAL)
+            # Wait for the next fixed deadline (cycle time doesn't add to the period);
+            # after an overrun skip to the next deadline still ahead
+            next_deadline += POLLING_INTERVAL
+            now = loop.time()
+            if next_deadline < now:
+                missed = int((now - next_deadline) // POLLING_INTERVAL) + 1
+                next_deadline += missed * POLLING_INTERVAL
+            await asyncio.sleep(next_deadline - now)
 
     async def start_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -281,21 +411,23 @@ class WBBot:
     async def post_init(self, application: Application):
         """Post-initialization callback"""
         self.application = application
-        logger.info("Bot initialized. Orders are fetched from supplies when warehouse is selected.")
-        
-        # DISABLED: Automatic order processing
-        # Orders are now fetched from supplies when user selects a warehouse in Telegram
-        # self.processing_task = asyncio.create_task(self.periodic_task())
-        # await self.process_new_orders()
+        if ENABLE_PERIODIC_POLLING:
+            self.processing_task = asyncio.create_task(self.periodic_task())
+            logger.info(f"Bot initialized. Polling new orders every {POLLING_INTERVAL}s.")
+        else:
+            logger.info("Bot initialized. Orders are fetched from supplies when warehouse is selected.")
 
     async def post_shutdown(self, application: Application):
         """Post-shutdown callback"""
-        if self.processing_task:
-            self.processing_task.cancel()
-            try:
-                await self.processing_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self.processing_task, self._products_refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                except Exception as e:
+                    logger.warning(f"Background task failed during shutdown: {e}")
         logger.info("Bot shut down")
 
     def run(self):
@@ -313,6 +445,14 @@ class WBBot:
         # Setup handlers
         self.setup_handlers()
         
+        # In debug mode let asyncio report callbacks that block the loop > 100 ms
+        # (e.g. a blocking Sheets/WB call slipping back into async code)
+        if LOG_LEVEL.upper() == "DEBUG":
+            loop = asyncio.new_event_loop()
+            loop.set_debug(True)
+            loop.slow_callback_duration = 0.1
+            asyncio.set_event_loop(loop)
+        
         # Run the bot
         logger.info("Bot is running. Press Ctrl+C to stop.")
         self.application.run_polling(allowed_updates=Update.ALL_TYPES)
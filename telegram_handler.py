@@ -5,75 +5,80 @@ Manages Telegram bot interactions, navigation, and message sending
 import logging
 import time
 import asyncio
-import re
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
 from telegram.ext import ContextTypes
 from sheets_handler import SheetsHandler
-from supply_orders import SupplyOrdersHandler
+from supply_orders import SupplyOrdersHandler, format_supply_date
 from wb_api import WildberriesAPI
-from pdf_generator import PDFGenerator
-from config import SHEET_TASKS_FOR_PDF
+from pdf_generator import PDFGenerator, extract_article_number
+from config import SHEET_TASKS_FOR_PDF, SUPPLY_LIST_LIMIT
 import tempfile
 import os
+import traceback
 
 logger = logging.getLogger(__name__)
 
+# Telegram limits: ~30 messages/s per bot, ~1 message/s per chat (short bursts allowed)
+TELEGRAM_MESSAGES_PER_SECOND = 25
+TELEGRAM_CHAT_MESSAGES_PER_SECOND = 1
+TELEGRAM_CHAT_BURST = 3
+# Send requests in flight at once: a burst refilled by the limiters above must
+# not open more connections than the bot's HTTP pool comfortably serves
+TELEGRAM_MAX_CONCURRENT_SENDS = 20
+# Telegram file_ids remembered per product photo URL (LRU): a photo sent once
+# is re-sent by file_id instead of Telegram downloading the URL again
+PHOTO_FILE_ID_CACHE_SIZE = 512
 
-def extract_article_number(article: str) -> int:
-    """
-    Extract numeric value from article/Offer ID for sorting.
-    
-    Examples:
-        "р20-п5-33" -> 20
-        "р25-п5-33" -> 25
-        "мд33-п2-30" -> 33
-        
-    Args:
-        article: Article string (e.g., "р20-п5-33")
-        
-    Returns:
-        Extracted number (1-99) or 999 if not found (for sorting)
-    """
-    if not article:
-        return 999
-    
-    article = str(article).strip()
-    
-    # Strategy: Remove first 1-2 NON-DIGIT characters, then find first number
-    # Try removing 2 non-digit chars first
-    if len(article) >= 2 and not article[0].isdigit() and not article[1].isdigit():
-        remaining = article[2:]
-        if remaining and remaining[0].isdigit() and remaining[0] != '0':
-            # Extract first number
-            match = re.search(r'\d+', remaining)
-            if match:
-                number = int(match.group())
-                if 1 <= number <= 99:
-                    return number
-    
-    # Try removing 1 non-digit char
-    if len(article) >= 1 and not article[0].isdigit():
-        remaining = article[1:]
-        if remaining and remaining[0].isdigit() and remaining[0] != '0':
-            # Extract first number
-            match = re.search(r'\d+', remaining)
-            if match:
-                number = int(match.group())
-                if 1 <= number <= 99:
-                    return number
-    
-    # If article starts with a digit, try to extract directly
-    if article and article[0].isdigit() and article[0] != '0':
-        match = re.search(r'\d+', article)
-        if match:
-            number = int(match.group())
-            if 1 <= number <= 99:
-                return number
-    
-    # If no valid number found, return 999 for sorting (will appear last)
-    return 999
+
+class AsyncRateLimiter:
+    """Token bucket for coroutines: waits only once tokens run out"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Take one token, sleeping until it has been refilled"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        """Stop handing out tokens for `seconds` (after a 429 / RetryAfter)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._blocked_until
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is int seconds or a timedelta depending on PTB version"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _split_supply_payload(payload: str) -> Tuple[str, Optional[str]]:
+    """Split "<supply_id>|warehouse_<name>" into (supply_id, name or None)"""
+    supply_id, sep, warehouse = payload.partition("|warehouse_")
+    return supply_id, (warehouse if sep else None)
 
 
 class TelegramHandler:
@@ -88,18 +93,67 @@ class TelegramHandler:
         """
         self.sheets_handler = sheets_handler
         self.supply_handlers: Dict[str, SupplyOrdersHandler] = {}  # Cache by api_key
+        # Pace order notifications to Telegram limits instead of fixed sleeps
+        self.send_limiter = AsyncRateLimiter(TELEGRAM_MESSAGES_PER_SECOND, TELEGRAM_MESSAGES_PER_SECOND)
+        self.chat_limiters: Dict[int, AsyncRateLimiter] = {}
+        self.send_semaphore = asyncio.Semaphore(TELEGRAM_MAX_CONCURRENT_SENDS)
+        self.photo_file_ids: "OrderedDict[str, str]" = OrderedDict()
+        # Start menus by (cities, warehouses); see _main_menu
+        self._main_menu_cache: Dict[tuple, Tuple[str, InlineKeyboardMarkup]] = {}
+
+    async def _send_paced(self, chat_id: int, send, **kwargs):
+        """
+        Call a bot send method within Telegram rate limits; on RetryAfter the
+        limiters pause for the requested time and the send is retried once
+        
+        Args:
+            chat_id: Target chat ID
+            send: Bot method, e.g. bot.send_message
+            **kwargs: Arguments for the send method (without chat_id)
+        """
+        chat_limiter = self.chat_limiters.get(chat_id)
+        if chat_limiter is None:
+            chat_limiter = self.chat_limiters[chat_id] = AsyncRateLimiter(
+                TELEGRAM_CHAT_MESSAGES_PER_SECOND, TELEGRAM_CHAT_BURST
+            )
+        for attempt in range(2):
+            await chat_limiter.acquire()
+            await self.send_limiter.acquire()
+            try:
+                # Held only around the request, never while waiting for a token
+                async with self.send_semaphore:
+                    return await send(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logger.warning(f"Telegram flood control for chat {chat_id}, waiting {delay} seconds")
+                self.send_limiter.penalize(delay)
+                chat_limiter.penalize(delay)
+                if attempt == 1:
+                    raise
+
+    def _photo_for_url(self, photo_url: str) -> str:
+        """Cached Telegram file_id for a photo URL, or the URL itself"""
+        file_id = self.photo_file_ids.get(photo_url)
+        if file_id is None:
+            return photo_url
+        self.photo_file_ids.move_to_end(photo_url)
+        return file_id
+
+    def _remember_photo(self, photo_url: str, message) -> None:
+        """Store the file_id Telegram assigned to a photo sent by URL"""
+        photos = getattr(message, "photo", None)
+        if not photos:
+            return
+        self.photo_file_ids[photo_url] = photos[-1].file_id
+        self.photo_file_ids.move_to_end(photo_url)
+        if len(self.photo_file_ids) > PHOTO_FILE_ID_CACHE_SIZE:
+            self.photo_file_ids.popitem(last=False)
 
-    def _get_warehouse_for_order(self, order_id: str) -> Optional[str]:
+    async def _get_warehouse_for_order(self, order_id: str) -> Optional[str]:
         """Get warehouse name for a given order ID from ProcessedOrders sheet"""
         try:
-            processed_sheet = self.sheets_handler.spreadsheet.worksheet("ProcessedOrders")
-            processed_records = processed_sheet.get_all_records()
-
-            for record in processed_records:
-                if str(record.get("Order ID", "")).strip() == str(order_id).strip():
-                    warehouse = str(record.get("Warehouse", "")).strip()
-                    return warehouse if warehouse else None
-            return None
+            order_warehouses = await self.sheets_handler.aget_processed_order_warehouses()
+            return order_warehouses.get(str(order_id).strip()) or None
         except Exception as e:
             logger.error(f"Error getting warehouse for order {order_id}: {e}")
             return None
@@ -156,27 +210,36 @@ class TelegramHandler:
             
             # Send photo with caption if available, otherwise send text only
             if photo_url:
+                photo = self._photo_for_url(photo_url)
                 try:
-                    await bot.send_photo(
-                        chat_id=chat_id,
-                        photo=photo_url,
+                    message = await self._send_paced(
+                        chat_id,
+                        bot.send_photo,
+                        photo=photo,
                         caption=message_text,
                     )
+                    if photo == photo_url:
+                        self._remember_photo(photo_url, message)
                     logger.info(
                         f"Sent order {order_id} notification with photo to chat {chat_id}"
                     )
                 except Exception as e:
+                    if photo != photo_url:
+                        # Stale file_id: next send downloads the URL again
+                        self.photo_file_ids.pop(photo_url, None)
                     logger.warning(
                         f"Failed to send photo for order {order_id}: {e}. "
                         "Sending text only."
                     )
-                    await bot.send_message(
-                        chat_id=chat_id,
+                    await self._send_paced(
+                        chat_id,
+                        bot.send_message,
                         text=message_text,
                     )
             else:
-                await bot.send_message(
-                    chat_id=chat_id,
+                await self._send_paced(
+                    chat_id,
+                    bot.send_message,
                     text=message_text,
                 )
                 logger.info(f"Sent order {order_id} notification (text only) to chat {chat_id}")
@@ -207,15 +270,14 @@ class TelegramHandler:
             photo_url: Optional product photo URL
         """
         try:
-            warehouse_access = self.sheets_handler.get_warehouse_access()
+            warehouse_access = await self.sheets_handler.aget_warehouse_access()
             chat_ids = warehouse_access.get(warehouse, [])
             
             if not chat_ids:
                 logger.warning(f"No chat IDs found for warehouse: {warehouse}")
                 return
             
-            # Send to all chat IDs with access to this warehouse
-            for chat_id in chat_ids:
+            async def notify(chat_id: int):
                 await self.send_order_notification(
                     bot=bot,
                     chat_id=chat_id,
@@ -227,16 +289,78 @@ class TelegramHandler:
                     photo_url=photo_url,
                 )
             
+            # A photo Telegram has not seen yet goes to the first chat alone, so
+            # the others get its file_id instead of Telegram fetching the URL again
+            first_results = []
+            fan_out = list(chat_ids)
+            if photo_url and photo_url not in self.photo_file_ids and len(fan_out) > 1:
+                first_results = await asyncio.gather(notify(fan_out[0]), return_exceptions=True)
+            
+            # Send to all other chat IDs with access to this warehouse at once
+            # (send_order_notification paces itself and logs its own errors;
+            # anything it lets through must not abort the other chats)
+            results = first_results + await asyncio.gather(
+                *(notify(chat_id) for chat_id in fan_out[len(first_results):]),
+                return_exceptions=True,
+            )
+            for chat_id, result in zip(fan_out, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error sending order {order_id} notification to chat {chat_id}: {result}")
+            
             logger.info(f"Sent order {order_id} notifications to {len(chat_ids)} users for warehouse: {warehouse}")
         except Exception as e:
             logger.error(f"Error sending notifications for warehouse {warehouse}: {e}")
 
+    def _main_menu(self, user_info: Dict[str, List[str]]) -> Tuple[str, InlineKeyboardMarkup]:
+        """
+        Text and keyboard of the start menu (shared by /start and "back").
+        Markups are immutable, so one is built per distinct cities/warehouses list.
+        
+        Args:
+            user_info: Entry of get_user_access: {"cities": [...], "warehouses": [...]}
+            
+        Returns:
+            (message text, reply markup)
+        """
+        cities = tuple(user_info["cities"])
+        warehouses = tuple(user_info["warehouses"])
+        key = (cities, warehouses)
+        menu = self._main_menu_cache.get(key)
+        if menu is not None:
+            return menu
+        
+        # Always show city selection if multiple cities
+        if len(cities) > 1:
+            keyboard = [
+                [InlineKeyboardButton(city, callback_data=f"city_{city}")]
+                for city in cities
+            ]
+            text = "👋 Привет! Выберите город или просмотрите все заказы:"
+        else:
+            # Single city - show warehouse selection
+            keyboard = [
+                [InlineKeyboardButton(warehouse, callback_data=f"warehouse_{warehouse}")]
+                for warehouse in warehouses
+            ]
+            text = "👋 Привет! Выберите склад или просмотрите все заказы:"
+        # Add "View All Orders" button if multiple warehouses
+        if len(warehouses) > 1:
+            keyboard.append([
+                InlineKeyboardButton(
+                    "📋 Все заказы",
+                    callback_data="view_all_orders"
+                )
+            ])
+        menu = (text, InlineKeyboardMarkup(keyboard))
+        self._main_menu_cache[key] = menu
+        return menu
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         chat_id = update.effective_chat.id
         
         try:
-            user_access = self.sheets_handler.get_user_access()
+            user_access = await self.sheets_handler.aget_user_access()
             user_info = user_access.get(chat_id)
             
             if not user_info:
@@ -252,52 +376,8 @@ class TelegramHandler:
                 )
                 return
             
-            warehouses = user_info["warehouses"]
-            cities = user_info["cities"]
-            
-            # Always show city selection if multiple cities
-            if len(cities) > 1:
-                keyboard = []
-                for city in cities:
-                    keyboard.append([
-                        InlineKeyboardButton(city, callback_data=f"city_{city}")
-                    ])
-                # Add "View All Orders" button if user has access to all warehouses
-                if len(warehouses) > 1:
-                    keyboard.append([
-                        InlineKeyboardButton(
-                            "📋 Все заказы",
-                            callback_data="view_all_orders"
-                        )
-                    ])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    "👋 Привет! Выберите город или просмотрите все заказы:",
-                    reply_markup=reply_markup,
-                )
-            else:
-                # Single city - show warehouse selection
-                keyboard = []
-                for warehouse in warehouses:
-                    keyboard.append([
-                        InlineKeyboardButton(warehouse, callback_data=f"warehouse_{warehouse}")
-                    ])
-                # Add "View All Orders" button if multiple warehouses
-                if len(warehouses) > 1:
-                    keyboard.append([
-                        InlineKeyboardButton(
-                            "📋 Все заказы",
-                            callback_data="view_all_orders"
-                        )
-                    ])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    "👋 Привет! Выберите склад или просмотрите все заказы:",
-                    reply_markup=reply_markup,
-                )
-                    
+            text, reply_markup = self._main_menu(user_info)
+            await update.message.reply_text(text, reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Error in start command: {e}")
             keyboard = [[InlineKeyboardButton("🔄 Попробовать снова", callback_data="back_to_start")]]
@@ -346,40 +426,31 @@ class TelegramHandler:
         if data == "back_to_start":
             await self._handle_back_to_start(update)
         elif data.startswith("city_"):
-            city = data.replace("city_", "")
+            city = data[len("city_"):]
             await self._handle_city_selection(update, city)
         elif data.startswith("warehouse_"):
-            warehouse = data.replace("warehouse_", "")
+            warehouse = data[len("warehouse_"):]
             await self._handle_warehouse_selection(update, warehouse)
         elif data.startswith("supply_"):
-            # Parse supply_id and warehouse from callback_data
-            parts = data.replace("supply_", "").split("|warehouse_")
-            supply_id = parts[0]
-            warehouse = parts[1] if len(parts) > 1 else None
+            supply_id, warehouse = _split_supply_payload(data[len("supply_"):])
             await self._handle_supply_selection(update, supply_id, warehouse)
         elif data.startswith("send_list_"):
-            # Parse supply_id and warehouse from callback_data
-            parts = data.replace("send_list_", "").split("|warehouse_")
-            supply_id = parts[0]
-            warehouse = parts[1] if len(parts) > 1 else None
+            supply_id, warehouse = _split_supply_payload(data[len("send_list_"):])
             await self._handle_send_list(update, context, supply_id, warehouse)
         elif data.startswith("send_pdf_"):
-            # Parse supply_id and warehouse from callback_data
-            parts = data.replace("send_pdf_", "").split("|warehouse_")
-            supply_id = parts[0]
-            warehouse = parts[1] if len(parts) > 1 else None
+            supply_id, warehouse = _split_supply_payload(data[len("send_pdf_"):])
             await self._handle_send_pdf(update, context, supply_id, warehouse)
         elif data.startswith("order_"):
-            order_id = data.replace("order_", "")
+            order_id = data[len("order_"):]
             await self._handle_order_selection(update, order_id)
         elif data.startswith("complete_"):
-            order_id = data.replace("complete_", "")
+            order_id = data[len("complete_"):]
             await self._handle_order_complete(update, order_id)
         elif data.startswith("back_to_warehouse_"):
-            warehouse = data.replace("back_to_warehouse_", "")
+            warehouse = data[len("back_to_warehouse_"):]
             await self._handle_warehouse_selection(update, warehouse)
         elif data.startswith("back_to_supplies_"):
-            warehouse = data.replace("back_to_supplies_", "")
+            warehouse = data[len("back_to_supplies_"):]
             await self._handle_warehouse_selection(update, warehouse)
         elif data == "view_all_orders":
             await self._handle_view_all_orders(update)
@@ -387,7 +458,7 @@ class TelegramHandler:
     async def _handle_city_selection(self, update: Update, city: str):
         """Handle city selection callback"""
         chat_id = update.effective_chat.id
-        user_access = self.sheets_handler.get_user_access()
+        user_access = await self.sheets_handler.aget_user_access()
         user_info = user_access.get(chat_id)
         
         if not user_info:
@@ -400,11 +471,10 @@ class TelegramHandler:
             return
         
         # Filter warehouses by city
-        warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
+        warehouse_index = await self.sheets_handler.aget_warehouse_index()
         city_warehouses = [
             w for w in user_info["warehouses"]
-            for item in warehouse_api_keys
-            if item["warehouse"] == w and item["city"] == city
+            if w in warehouse_index and warehouse_index[w]["city"] == city
         ]
         
         if not city_warehouses:
@@ -438,7 +508,7 @@ class TelegramHandler:
         chat_id = update.effective_chat.id
         
         try:
-            user_access = self.sheets_handler.get_user_access()
+            user_access = await self.sheets_handler.aget_user_access()
             user_info = user_access.get(chat_id)
             
             if not user_info:
@@ -450,66 +520,18 @@ class TelegramHandler:
                 )
                 return
             
-            warehouses = user_info["warehouses"]
-            cities = user_info["cities"]
-            
-            # Always show city selection if multiple cities
-            if len(cities) > 1:
-                keyboard = []
-                for city in cities:
-                    keyboard.append([
-                        InlineKeyboardButton(city, callback_data=f"city_{city}")
-                    ])
-                # Add "View All Orders" button if user has access to all warehouses
-                if len(warehouses) > 1:
-                    keyboard.append([
-                        InlineKeyboardButton(
-                            "📋 Все заказы",
-                            callback_data="view_all_orders"
-                        )
-                    ])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.callback_query.edit_message_text(
-                    "👋 Привет! Выберите город или просмотрите все заказы:",
-                    reply_markup=reply_markup,
-                )
-            else:
-                # Single city - show warehouse selection
-                keyboard = []
-                for warehouse in warehouses:
-                    keyboard.append([
-                        InlineKeyboardButton(warehouse, callback_data=f"warehouse_{warehouse}")
-                    ])
-                # Add "View All Orders" button if multiple warehouses
-                if len(warehouses) > 1:
-                    keyboard.append([
-                        InlineKeyboardButton(
-                            "📋 Все заказы",
-                            callback_data="view_all_orders"
-                        )
-                    ])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.callback_query.edit_message_text(
-                    "👋 Привет! Выберите склад или просмотрите все заказы:",
-                    reply_markup=reply_markup,
-                )
+            text, reply_markup = self._main_menu(user_info)
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Error in back to start: {e}")
             await update.callback_query.edit_message_text("Произошла ошибка. Попробуйте позже.")
 
-    def _get_supply_handler_for_warehouse(self, warehouse: str) -> Optional[SupplyOrdersHandler]:
+    async def _get_supply_handler_for_warehouse(self, warehouse: str) -> Optional[SupplyOrdersHandler]:
         """Get SupplyOrdersHandler for a warehouse"""
         try:
             # Get API key for this warehouse
-            warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
-            api_key = None
-            
-            for item in warehouse_api_keys:
-                if item["warehouse"] == warehouse:
-                    api_key = item["api_key"]
-                    break
+            item = (await self.sheets_handler.aget_warehouse_index()).get(warehouse)
+            api_key = item["api_key"] if item else None
             
             if not api_key:
                 logger.warning(f"No API key found for warehouse: {warehouse}")
@@ -544,7 +566,7 @@ class TelegramHandler:
             )
             
             # Get supply handler for this warehouse
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             
             if not supply_handler:
                 keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]]
@@ -560,7 +582,9 @@ class TelegramHandler:
             logger.info(f"Starting to fetch incomplete supplies for warehouse: {warehouse} (max_age_days=365)")
             
             try:
-                supplies = supply_handler.fetch_all_incomplete_supplies(max_age_days=365)
+                supplies = await asyncio.to_thread(supply_handler.fetch_all_incomplete_supplies,
+                    max_age_days=365, limit=SUPPLY_LIST_LIMIT
+                )
                 logger.info(f"Successfully fetched supplies for warehouse {warehouse}: found {len(supplies)} incomplete supplies")
             except Exception as e:
                 logger.error(f"Error fetching supplies for warehouse {warehouse}: {e}", exc_info=True)
@@ -590,20 +614,13 @@ class TelegramHandler:
             keyboard = []
             
             # Group supplies in rows of 1 (each supply on its own row)
-            for supply in supplies[:50]:  # Limit to 50 supplies
+            for supply in supplies:
                 supply_id = supply.get("id", "")
                 supply_name = supply.get("name", supply_id)
                 created_str = supply.get("createdAt", "")
                 
                 # Format date for display
-                try:
-                    if created_str:
-                        created_dt = datetime.fromisoformat(created_str.replace('Z', '+00:00'))
-                        date_str = created_dt.strftime('%d.%m.%Y')
-                    else:
-                        date_str = ""
-                except Exception:
-                    date_str = ""
+                date_str = format_supply_date(str(created_str))
                 
                 # Button text: Supply name and date
                 button_text = f"📦 {supply_name}"
@@ -625,9 +642,15 @@ class TelegramHandler:
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
+            # Paging stops at SUPPLY_LIST_LIMIT, so a full list is not the total
+            if len(supplies) >= SUPPLY_LIST_LIMIT:
+                count_line = f"📋 Показаны первые {len(supplies)} незавершенных поставок"
+            else:
+                count_line = f"📋 Найдено незавершенных поставок: {len(supplies)}"
+            
             await query.edit_message_text(
                 f"📦 Склад: {warehouse}\n\n"
-                f"📋 Найдено незавершенных поставок: {len(supplies)}\n\n"
+                f"{count_line}\n\n"
                 "Выберите поставку для просмотра заказов:",
                 reply_markup=reply_markup,
             )
@@ -667,7 +690,7 @@ class TelegramHandler:
             # Get warehouse from parameter or find it
             if not warehouse:
                 # Try to find warehouse from context
-                warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
+                warehouse_api_keys = await self.sheets_handler.aget_warehouse_api_keys()
                 for item in warehouse_api_keys:
                     warehouse = item["warehouse"]
                     break
@@ -682,7 +705,7 @@ class TelegramHandler:
                 return
             
             # Get supply handler for this warehouse
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             
             if not supply_handler:
                 keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]]
@@ -694,7 +717,7 @@ class TelegramHandler:
                 return
             
             # Fetch order IDs for this supply
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
             
             if not order_ids:
                 keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]]
@@ -774,13 +797,13 @@ class TelegramHandler:
             )
             
             # Get supply handler
-            supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+            supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
             if not supply_handler:
                 await query.edit_message_text("❌ Ошибка: обработчик не найден")
                 return
             
             # Fetch order IDs
-            order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+            order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
             if not order_ids:
                 await query.edit_message_text(
                     f"📦 Поставка: {supply_id}\n\n✅ В этой поставке нет заказов."
@@ -790,7 +813,7 @@ class TelegramHandler:
             # Fetch order details
             date_from = datetime.now(timezone.utc) - timedelta(days=30)
             date_from_ts = int(date_from.timestamp())
-            orders_map = supply_handler._fetch_orders_by_ids(order_ids, date_from_ts)
+            orders_map = await asyncio.to_thread(supply_handler._fetch_orders_by_ids, order_ids, date_from_ts)
             
             if not orders_map:
                 await query.edit_message_text(
@@ -799,13 +822,12 @@ class TelegramHandler:
                 return
             
             # Get API key and WB API instance
-            warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
-            api_key = None
-            for item in warehouse_api_keys:
-                if item["warehouse"] == warehouse:
-                    api_key = item["api_key"]
-                    break
-            wb_api = WildberriesAPI(api_key) if api_key else None
+            item = (await self.sheets_handler.aget_warehouse_index()).get(warehouse)
+            api_key = item["api_key"] if item else None
+            wb_api = (
+                WildberriesAPI(api_key, marketplace_session=supply_handler.session)
+                if api_key else None
+            )
             
             # Prepare orders list and sort by article (Артикул продавца)
             orders_list = []
@@ -833,7 +855,7 @@ class TelegramHandler:
                 for i in range(0, len(all_order_ids), batch_size):
                     batch = all_order_ids[i:i + batch_size]
                     try:
-                        batch_stickers = wb_api.get_stickers(batch)
+                        batch_stickers = await asyncio.to_thread(wb_api.get_stickers, batch)
                         all_stickers.update(batch_stickers)
                         logger.info(f"Fetched stickers for batch {i//batch_size + 1} ({len(batch)} orders)")
                     except Exception as e:
@@ -842,20 +864,11 @@ class TelegramHandler:
             # Load all products from sheet once (optimization - avoid multiple API calls)
             logger.info("Loading all products from Products sheet for fast lookup...")
             try:
-                products_sheet = self.sheets_handler.spreadsheet.worksheet("Products")
-                all_products_records = products_sheet.get_all_records()
-                # Create a dictionary for fast lookup: {vendor_code_lower: {photo_url, title}}
-                products_cache = {}
-                for record in all_products_records:
-                    vendor_code = str(record.get("Артикул продавца", "")).strip().lower()
-                    if vendor_code:
-                        products_cache[vendor_code] = {
-                            'photo_url': str(record.get("Фото", "")).strip(),
-                            'title': str(record.get("Наименование", "")).strip(),
-                        }
+                # Dictionary for fast lookup: {vendor_code_lower: {photo_url, title}}
+                products_cache = await self.sheets_handler.aget_products_map()
                 logger.info(f"Loaded {len(products_cache)} products into cache")
             except Exception as e:
-                logger.warning(f"Error loading products cache: {e}, will use per-order lookup")
+                logger.warning(f"Error loading products cache: {e}")
                 products_cache = {}
             
             # Prepare all orders data first (for parallel sending)
@@ -869,13 +882,10 @@ class TelegramHandler:
                     if idx % 10 == 0:
                         logger.info(f"Preparing order {idx}/{len(orders_list)}: {order_id}")
                     
-                    # Get product info from cache (fast!) or fallback to API call
+                    # Get product info from cache (the map holds every Products row,
+                    # so a miss here would also be a miss in the sheet)
                     article_lower = article.strip().lower() if article else ""
-                    product_info = products_cache.get(article_lower) if products_cache else None
-                    if not product_info and products_cache:
-                        # Fallback: try to get from sheet (slower)
-                        product_info_dict = self.sheets_handler.get_product_from_sheet(article)
-                        product_info = product_info_dict if product_info_dict else None
+                    product_info = products_cache.get(article_lower)
                     
                     photo_url = product_info.get("photo_url") if product_info else None
                     product_name = product_info.get("title", "") if product_info else ""
@@ -997,7 +1007,7 @@ class TelegramHandler:
                 
                 # Write all orders in one batch operation
                 if orders_for_batch:
-                    self.sheets_handler.add_orders_to_tasks_batch(orders_for_batch)
+                    await asyncio.to_thread(self.sheets_handler.add_orders_to_tasks_batch, orders_for_batch)
                     logger.info(f"Successfully added {len(orders_for_batch)} orders to Tasks sheet in batch")
             except Exception as e:
                 logger.error(f"Error adding orders to Tasks sheet in batch: {e}")
@@ -1028,7 +1038,6 @@ class TelegramHandler:
                 logger.warning(f"Could not send menu message: {e}")
             
         except Exception as e:
-            import traceback
             logger.error(f"Error showing orders for supply {supply_id}: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
             keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]]
@@ -1072,7 +1081,7 @@ class TelegramHandler:
             # Generate from current supply orders
             if True:  # Always fetch from supply
                 # Fetch orders from supply to generate PDF
-                supply_handler = self._get_supply_handler_for_warehouse(warehouse)
+                supply_handler = await self._get_supply_handler_for_warehouse(warehouse)
                 if not supply_handler:
                     keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=f"back_to_supplies_{warehouse}")]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1083,7 +1092,7 @@ class TelegramHandler:
                     return
                 
                 # Fetch order IDs
-                order_ids = supply_handler.fetch_order_ids_for_supply(supply_id)
+                order_ids = await asyncio.to_thread(supply_handler.fetch_order_ids_for_supply, supply_id)
                 logger.info(f"Found {len(order_ids)} order IDs in supply {supply_id}")
                 if not order_ids:
                     keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=f"back_to_supplies_{warehouse}")]]
@@ -1097,7 +1106,7 @@ class TelegramHandler:
                 # Fetch order details
                 date_from = datetime.now(timezone.utc) - timedelta(days=30)
                 date_from_ts = int(date_from.timestamp())
-                orders_map = supply_handler._fetch_orders_by_ids(order_ids, date_from_ts)
+                orders_map = await asyncio.to_thread(supply_handler._fetch_orders_by_ids, order_ids, date_from_ts)
                 logger.info(f"Fetched {len(orders_map)} order details from {len(order_ids)} order IDs")
                 
                 if not orders_map:
@@ -1110,13 +1119,12 @@ class TelegramHandler:
                     return
                 
                 # Get API key
-                warehouse_api_keys = self.sheets_handler.get_warehouse_api_keys()
-                api_key = None
-                for item in warehouse_api_keys:
-                    if item["warehouse"] == warehouse:
-                        api_key = item["api_key"]
-                        break
-                wb_api = WildberriesAPI(api_key) if api_key else None
+                item = (await self.sheets_handler.aget_warehouse_index()).get(warehouse)
+                api_key = item["api_key"] if item else None
+                wb_api = (
+                    WildberriesAPI(api_key, marketplace_session=supply_handler.session)
+                    if api_key else None
+                )
                 
                 # Fetch all stickers in batches (up to 100 per request) before processing tasks
                 all_stickers = {}
@@ -1129,20 +1137,22 @@ class TelegramHandler:
                     for i in range(0, len(all_order_ids), batch_size):
                         batch = all_order_ids[i:i + batch_size]
                         try:
-                            batch_stickers = wb_api.get_stickers(batch)
+                            batch_stickers = await asyncio.to_thread(wb_api.get_stickers, batch)
                             all_stickers.update(batch_stickers)
                             logger.info(f"Fetched stickers for batch {i//batch_size + 1} ({len(batch)} orders)")
                         except Exception as e:
                             logger.warning(f"Error fetching stickers for batch: {e}")
                 
                 # Convert orders to tasks format and sort by article
+                # (one Products read for all orders instead of a lookup per order)
+                products_cache = await self.sheets_handler.aget_products_map()
                 tasks = []
                 for order_id, order_data in orders_map.items():
                     article = order_data.get("article", "")
                     sku = order_data.get("skus", [""])[0] if order_data.get("skus") else ""
                     
                     # Get product info
-                    product_info = self.sheets_handler.get_product_from_sheet(article)
+                    product_info = products_cache.get(article.strip().lower() if article else "")
                     photo_url = product_info.get("photo_url") if product_info else None
                     product_name = product_info.get("title", "") if product_info else ""
                     
@@ -1175,7 +1185,7 @@ class TelegramHandler:
             
             # Write tasks to TasksForPDF sheet (for viewing in Google Sheets, formula in A1 displays images)
             try:
-                self.sheets_handler.write_tasks_to_pdf_sheet(tasks)
+                await asyncio.to_thread(self.sheets_handler.write_tasks_to_pdf_sheet, tasks)
                 logger.info(f"Wrote {len(tasks)} tasks to TasksForPDF sheet for viewing")
             except Exception as e:
                 logger.warning(f"Error writing to TasksForPDF sheet: {e}, continuing with PDF generation...")
@@ -1187,7 +1197,7 @@ class TelegramHandler:
             temp_dir = tempfile.mkdtemp()
             pdf_path = os.path.join(temp_dir, f"orders_{supply_id}.pdf")
             
-            success = pdf_generator.generate_pdf_from_tasks(
+            success = await asyncio.to_thread(pdf_generator.generate_pdf_from_tasks,
                 tasks=tasks,
                 output_path=pdf_path,
                 title=f"Заказы из поставки {supply_id}",
@@ -1278,14 +1288,14 @@ class TelegramHandler:
         """Handle order selection - show order details"""
         try:
             # Get order details
-            task = self.sheets_handler.get_task_by_order_id(order_id)
+            task = await asyncio.to_thread(self.sheets_handler.get_task_by_order_id, order_id)
             
             if not task:
                 await update.callback_query.answer("Заказ не найден", show_alert=True)
                 return
             
             # Determine warehouse from ProcessedOrders
-            warehouse = self._get_warehouse_for_order(order_id)
+            warehouse = await self._get_warehouse_for_order(order_id)
             
             # Format message
             status_icon = "🟢" if task.get('status', 'new') == 'new' else "✅"
@@ -1380,13 +1390,13 @@ class TelegramHandler:
         """Handle marking order as completed"""
         try:
             # Update order status in sheet
-            success = self.sheets_handler.update_order_status(order_id, "completed")
+            success = await asyncio.to_thread(self.sheets_handler.update_order_status, order_id, "completed")
             
             if success:
                 await update.callback_query.answer("✅ Заказ отмечен как выполненный!", show_alert=True)
                 
                 # Update the message to reflect new status
-                task = self.sheets_handler.get_task_by_order_id(order_id)
+                task = await asyncio.to_thread(self.sheets_handler.get_task_by_order_id, order_id)
                 
                 if task:
                     message_text = (
@@ -1401,7 +1411,7 @@ class TelegramHandler:
                         message_text += f"🏷️ Стикер: {sticker}\n"
                     
                     # Remove complete button, only show back
-                    warehouse = self._get_warehouse_for_order(order_id)
+                    warehouse = await self._get_warehouse_for_order(order_id)
                     
                     keyboard = []
                     if warehouse:
@@ -1444,7 +1454,7 @@ class TelegramHandler:
         """Handle view all orders callback - show order list"""
         try:
             # Get only incomplete (new) orders
-            tasks = self.sheets_handler.get_tasks_from_sheet(
+            tasks = await asyncio.to_thread(self.sheets_handler.get_tasks_from_sheet,
                 warehouse=None, 
                 limit=50,
                 status_filter="new"  # Only show incomplete orders
@@ -1452,7 +1462,7 @@ class TelegramHandler:
             
             if not tasks:
                 # No incomplete orders - show all orders instead
-                all_tasks = self.sheets_handler.get_tasks_from_sheet(
+                all_tasks = await asyncio.to_thread(self.sheets_handler.get_tasks_from_sheet,
                     warehouse=None,
                     limit=50,
                     status_filter=None  # Show all orders
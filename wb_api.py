@@ -6,6 +6,7 @@ import time
 import base64
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional, Tuple
 from config import (
     WB_MARKETPLACE_API_BASE,
@@ -21,16 +22,23 @@ logger = logging.getLogger(__name__)
 class WildberriesAPI:
     """Client for Wildberries API operations"""
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, marketplace_session: Optional[requests.Session] = None):
         """
         Initialize Wildberries API client
         
         Args:
             api_key: Wildberries API key for authentication
+            marketplace_session: Optional existing marketplace API session for the
+                same api_key (e.g. SupplyOrdersHandler.session) to reuse its
+                kept-alive connections
         """
         self.api_key = api_key
-        self.marketplace_session = requests.Session()
+        if marketplace_session is None:
+            marketplace_session = requests.Session()
+            marketplace_session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+        self.marketplace_session = marketplace_session
         self.content_session = requests.Session()
+        self.content_session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
         
         # Set headers for marketplace API
         self.marketplace_session.headers.update({